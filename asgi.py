@@ -0,0 +1,374 @@
+"""ASGI entry point (`uvicorn asgi:app`), see README "Async Mode".
+
+Outbound-bound endpoints run as native async handlers on httpx; every other
+route is the Flask app from server.py mounted as WSGI. Request parsing, SOAP
+payloads and Stripe parameters are shared with server.py.
+"""
+import asyncio
+import os
+import time
+import traceback
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+import metrics
+import server
+from rate_limiter import RateLimitExceeded, backoff_seconds
+
+# Lazy proxy configured (API key, version) by server.py
+stripe = server.stripe
+
+CORS_PREFLIGHT_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+    'Access-Control-Allow-Methods': 'GET,POST,PUT,DELETE,OPTIONS',
+}
+
+
+def json_response(payload, status_code=200):
+    # Same encoder and trailing newline as flask.jsonify, plus the CORS header flask-cors adds
+    return Response(
+        f"{server.app.json.dumps(payload)}\n",
+        status_code=status_code,
+        media_type='application/json',
+        headers={'Access-Control-Allow-Origin': '*'},
+    )
+
+
+def circuit_open_response(e):
+    response = json_response({"error": "Mondial Relay temporarily unavailable", "retryAfter": e.retry_after}, 503)
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
+def stripe_rate_limited_response(e):
+    retry_after = server.stripe_retry_after(e)
+    response = json_response({"error": "Payment provider busy, please retry", "retryAfter": retry_after}, 503)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def cors_preflight():
+    return Response(
+        f"{server.app.json.dumps({'message': 'CORS preflight request'})}\n",
+        media_type='application/json',
+        headers=CORS_PREFLIGHT_HEADERS,
+    )
+
+
+def stripe_encode(params, prefix=None):
+    # Flatten nested params the way stripe-python form-encodes them
+    pairs = []
+    items = params.items() if isinstance(params, dict) else enumerate(params)
+    for key, value in items:
+        name = f"{prefix}[{key}]" if prefix else str(key)
+        if value is None:
+            continue
+        if isinstance(value, (dict, list, tuple)):
+            pairs.extend(stripe_encode(value, name))
+        elif isinstance(value, bool):
+            pairs.append((name, 'true' if value else 'false'))
+        else:
+            pairs.append((name, str(value)))
+    return pairs
+
+
+class AsyncStripe:
+    """Minimal async Stripe REST client sharing stripe-python's key, version
+    and rate-limit budgets (server.stripe_limiter)."""
+
+    def __init__(self, client, rate_limit_retries=3):
+        self.client = client
+        self.rate_limit_retries = rate_limit_retries
+
+    async def acquire(self, bucket, priority, operation):
+        # Polls the bucket without blocking the event loop, for at most max_wait
+        deadline = time.monotonic() + bucket.max_wait
+        while True:
+            wait = bucket.try_acquire(priority)
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                metrics.observe_upstream('stripe', operation, 'rate_limited', 0.0)
+                e = RateLimitExceeded(bucket.name, max(1, round(wait)))
+                raise stripe.error.RateLimitError(
+                    str(e), http_status=429, headers={'Retry-After': str(e.retry_after)}, code='rate_limit'
+                )
+            await asyncio.sleep(wait)
+
+    async def request(self, method, path, params=None, stripe_account=None):
+        headers = {
+            'Authorization': f"Bearer {stripe.api_key}",
+            'Stripe-Version': stripe.api_version,
+        }
+        if stripe_account:
+            headers['Stripe-Account'] = stripe_account
+
+        content = None
+        if method == 'POST':
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            content = urlencode(stripe_encode(params or {}))
+        operation = f"{method} {metrics.normalize_path(path)}"
+        bucket, priority = server.stripe_limiter(method, path)
+        for attempt in range(1 + self.rate_limit_retries):
+            await self.acquire(bucket, priority, operation)
+            with metrics.upstream_call('stripe', operation) as call:
+                response = await self.client.request(method, f"{stripe.api_base}{path}", content=content, headers=headers)
+                call.status = response.status_code
+            if response.status_code != 429 or attempt == self.rate_limit_retries:
+                break
+            bucket.throttle(backoff_seconds(response.headers, attempt))
+
+        body = response.json()
+        if response.status_code >= 400:
+            error = body.get('error', {})
+            error_class = stripe.error.RateLimitError if response.status_code == 429 else stripe.error.StripeError
+            raise error_class(
+                error.get('message'),
+                http_body=response.text,
+                http_status=response.status_code,
+                json_body=body,
+                # Case-insensitive httpx headers: stripe_retry_after reads Retry-After
+                headers=response.headers,
+                code=error.get('code'),
+            )
+        return body
+
+    async def create_checkout_session(self, params):
+        return await self.request('POST', '/v1/checkout/sessions', params)
+
+    async def retrieve_account(self, account_id):
+        return await self.request('GET', f"/v1/accounts/{account_id}")
+
+
+class AsyncSingleFlight:
+    # Collapses concurrent loads of the same key into one task
+    def __init__(self):
+        self._tasks = {}
+
+    def _start(self, key, factory):
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(factory())
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return task
+
+    async def run(self, key, factory):
+        return await asyncio.shield(self._start(key, factory))
+
+    async def get_or_load(self, cache, key, factory):
+        # Same semantics as TTLCache.get_or_load in the sync server: a stale
+        # entry is served while a single background task refreshes it
+        value, needs_refresh = cache.lookup(key)
+        if value is None:
+            return await self.run(key, factory)
+        if needs_refresh and key not in self._tasks:
+            cache.refreshes += 1
+            self._start(key, factory).add_done_callback(
+                lambda task: refresh_failed(cache, key, task)
+            )
+        return value
+
+
+def refresh_failed(cache, key, task):
+    if not task.cancelled() and task.exception() is not None:
+        cache.load_errors += 1
+        print(f"Background refresh failed for {cache.name} {key}: {task.exception()}")
+
+
+CLIENTS = {}
+RELAY_FLIGHTS = AsyncSingleFlight()
+ACCOUNT_FLIGHTS = AsyncSingleFlight()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    CLIENTS['mondial_relay'] = httpx.AsyncClient(
+        timeout=httpx.Timeout(
+            float(os.getenv('MONDIAL_RELAY_READ_TIMEOUT', 15)),
+            connect=float(os.getenv('MONDIAL_RELAY_CONNECT_TIMEOUT', 3.05)),
+        ),
+        limits=httpx.Limits(max_connections=int(os.getenv('ASYNC_MONDIAL_RELAY_MAX_CONNECTIONS', 100))),
+    )
+    CLIENTS['stripe'] = AsyncStripe(httpx.AsyncClient(
+        timeout=httpx.Timeout(80.0, connect=5.0),
+        limits=httpx.Limits(max_connections=int(os.getenv('ASYNC_STRIPE_MAX_CONNECTIONS', 50))),
+    ), rate_limit_retries=int(os.getenv('STRIPE_RATE_LIMIT_RETRIES', 3)))
+    server.start_webhook_workers(server.app)
+    server.RELAY_POINTS_STORE.start()
+    yield
+    await CLIENTS['mondial_relay'].aclose()
+    await CLIENTS['stripe'].client.aclose()
+
+
+async def read_json(request):
+    # Invalid JSON is handed on as None and rejected by the schemas with a 400
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def get_relay_points(request):
+    if request.method == 'OPTIONS':
+        return cors_preflight()
+    try:
+        data = await read_json(request)
+        country, postal_code, limit, latitude, longitude = server.relay_points_query(data)
+        server.RELAY_POINTS_STORE.start()
+
+        if not postal_code:
+            relay_points = server.RELAY_POINTS_STORE.nearest(float(latitude), float(longitude), k=limit)
+            return json_response({'relay_points': relay_points, 'source': 'offline'})
+
+        key = (country, postal_code, limit)
+        try:
+            relay_points = await RELAY_FLIGHTS.get_or_load(
+                server.RELAY_POINTS_CACHE, key, lambda: load_relay_points(*key)
+            )
+        except Exception as e:
+            relay_points, source = server.relay_points_fallback(key)
+            if not relay_points:
+                raise
+            print(f"Mondial Relay unavailable, serving {source} relay points: {e}")
+            return json_response({'relay_points': relay_points, 'source': source})
+
+        return json_response({'relay_points': relay_points})
+
+    except server.ValidationError as e:
+        return json_response({"error": str(e)}, 400)
+    except server.CircuitOpenError as e:
+        return circuit_open_response(e)
+    except server.MondialRelayError as e:
+        return json_response(e.payload, e.status_code)
+    except Exception as e:
+        return json_response({"error": str(e), "stack": traceback.format_exc()}, 500)
+
+
+async def load_relay_points(country, postal_code, limit):
+    # Same circuit breakers as the sync client, so both modes see one outage
+    breaker = server.MONDIAL_RELAY_CLIENT.breaker('WSI4_PointRelais_Recherche')
+    with metrics.upstream_call('mondial_relay', 'WSI4_PointRelais_Recherche') as call, breaker.guard() as guard:
+        response = await CLIENTS['mondial_relay'].post(
+            server.MONDIAL_RELAY_SOAP_URL,
+            content=server.relay_points_soap_request(country, postal_code, limit),
+            headers={'Content-Type': 'text/xml; charset=utf-8'},
+        )
+        call.status = response.status_code
+        guard.failed = response.status_code >= 500
+    relay_points = server.parse_relay_points_response(response)
+    server.RELAY_POINTS_CACHE.set((country, postal_code, limit), relay_points)
+    server.RELAY_POINTS_STORE.add_points(relay_points)
+    return relay_points
+
+
+async def create_shipping_label(request):
+    if request.method == 'OPTIONS':
+        return cors_preflight()
+    try:
+        data = await read_json(request)
+        soap_request = server.shipping_label_soap_request(data)
+        breaker = server.MONDIAL_RELAY_CLIENT.breaker('WSI2_CreationEtiquette')
+        with metrics.upstream_call('mondial_relay', 'WSI2_CreationEtiquette') as call, breaker.guard() as guard:
+            response = await CLIENTS['mondial_relay'].post(
+                server.MONDIAL_RELAY_API_URL,
+                content=soap_request,
+                headers={'Content-Type': 'text/xml; charset=utf-8'},
+            )
+            call.status = response.status_code
+            guard.failed = response.status_code >= 500
+        return json_response({"pdfUrl": server.parse_shipping_label_response(response)})
+    except server.ValidationError as e:
+        return json_response({"error": str(e)}, 400)
+    except server.CircuitOpenError as e:
+        return circuit_open_response(e)
+    except server.MondialRelayError as e:
+        return json_response(e.payload, e.status_code)
+    except Exception as e:
+        print(f"Error in create_shipping_label: {e}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def check_stripe_status(request):
+    if request.method == 'OPTIONS':
+        return cors_preflight()
+    try:
+        data = await read_json(request)
+        account_id = server.STRIPE_STATUS_SCHEMA(data)['account_id']
+
+        try:
+            status = await ACCOUNT_FLIGHTS.get_or_load(
+                server.ACCOUNT_STATUS_CACHE, account_id, lambda: load_account_status(account_id)
+            )
+        except stripe.error.RateLimitError as e:
+            status = server.ACCOUNT_STATUS_CACHE.last_value(account_id)
+            if status is None:
+                return stripe_rate_limited_response(e)
+        except stripe.error.StripeError as e:
+            print(f"Stripe error: {e}")
+            return json_response(server.SIMULATED_ACCOUNT_STATUS)
+        return json_response(status)
+    except server.ValidationError as e:
+        return json_response({"error": str(e)}, 400)
+    except Exception as e:
+        print(f"Error checking Stripe status: {e}")
+        return json_response({"error": str(e)}, 500)
+
+
+async def load_account_status(account_id):
+    started = time.time()
+    account = await CLIENTS['stripe'].retrieve_account(account_id)
+    status = server.account_status(account)
+    # An account.updated webhook received meanwhile is newer: keep it
+    server.ACCOUNT_STATUS_CACHE.set_if_newer(account_id, status, started)
+    return status
+
+
+def checkout_endpoint(build_params, label):
+    async def endpoint(request):
+        if request.method == 'OPTIONS':
+            return cors_preflight()
+        try:
+            data = await read_json(request)
+            params = build_params(data, str(request.base_url))
+            session = await CLIENTS['stripe'].create_checkout_session(params)
+            return json_response({"id": session['id'], "url": session['url']})
+        except server.ValidationError as e:
+            return json_response({"error": str(e)}, 400)
+        except stripe.error.RateLimitError as e:
+            return stripe_rate_limited_response(e)
+        except Exception as e:
+            print(f"Error creating {label}: {e}")
+            return json_response({"error": str(e)}, 500)
+    return endpoint
+
+
+def timed_route(path, endpoint):
+    # Same per-route metrics as the Flask routes (metrics.init_app)
+    async def handler(request):
+        start = time.perf_counter()
+        response = await endpoint(request)
+        metrics.observe_request(request.method, path, response.status_code, time.perf_counter() - start)
+        return response
+    return Route(path, handler, methods=['POST', 'OPTIONS'])
+
+
+routes = [
+    timed_route('/api/get-relay-points', get_relay_points),
+    timed_route('/api/create-shipping-label', create_shipping_label),
+    timed_route('/api/check-stripe-status', check_stripe_status),
+    timed_route('/api/create-checkout-session', checkout_endpoint(server.checkout_session_params, 'checkout session')),
+    timed_route('/api/create-appointment-checkout',
+                checkout_endpoint(server.appointment_checkout_params, 'appointment checkout')),
+    timed_route('/api/create-boost-session', checkout_endpoint(server.boost_session_params, 'boost session')),
+    # Everything else (webhook, uploads, batch endpoints, static files) stays on Flask
+    Mount('/', app=WSGIMiddleware(server.app, workers=int(os.getenv('ASYNC_WSGI_THREADS', 20)))),
+]
+
+app = Starlette(routes=routes, lifespan=lifespan)
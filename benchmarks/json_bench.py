@@ -0,0 +1,113 @@
+"""Micro-benchmark: stdlib json vs the orjson provider on our payload shapes.
+
+    python benchmarks/json_bench.py [--number 2000]
+
+The stdlib column uses Flask's default settings (sorted keys, ASCII
+escaping, compact separators), i.e. what jsonify() did before
+FastJSONProvider.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_provider  # noqa: E402
+
+
+def relay_points(count):
+    # Same keys as server.parse_relay_points
+    return {
+        "relay_points": [
+            {
+                "id": f"{i:06d}",
+                "name": f"Tabac Presse de l'Église {i}",
+                "address": f"{i} rue de la République",
+                "postalCode": "75011",
+                "city": "Paris",
+                "distance": 120.0 + i * 37.5,
+                "openingHours": "Lundi: 09:00-12:30 14:00-19:00",
+                "photoUrl": "",
+                "latitude": 48.857 + i / 1000,
+                "longitude": 2.378 - i / 1000,
+            }
+            for i in range(count)
+        ]
+    }
+
+
+def account_status():
+    # Same keys as server.account_status
+    return {
+        "isVerified": False,
+        "isRestricted": False,
+        "requiresInfo": True,
+        "pendingRequirements": ["individual.verification.document", "external_account", "business_profile.url"],
+        "currentDeadline": 1735689600,
+        "capabilities": {"card_payments": "inactive", "transfers": "pending"},
+    }
+
+
+def delivery_address():
+    # Stored in Stripe metadata by create_checkout_session
+    return {
+        "fullName": "Amélie Dupont",
+        "street": "12 avenue des Champs-Élysées",
+        "postalCode": "75008",
+        "city": "Paris",
+        "country": "FR",
+        "phone": "+33612345678",
+    }
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, sort_keys=True, ensure_ascii=True, separators=(',', ':'))
+
+
+def fast_dumps(obj):
+    if json_provider.orjson is None:
+        return json_provider.dumps(obj)
+    return json_provider.orjson.dumps(obj, option=json_provider.ORJSON_OPTIONS)
+
+
+def timed(func, arg, number):
+    best = float('inf')
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(number):
+            func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=2000, help="calls per timing run")
+    args = parser.parse_args()
+
+    payloads = [
+        ("relay points (20)", relay_points(20)),
+        ("relay points (30)", relay_points(30)),
+        ("account status", account_status()),
+        ("status batch (100)", {"results": {f"acct_{i:016d}": account_status() for i in range(100)}, "errors": {}}),
+        ("delivery address", delivery_address()),
+    ]
+
+    engine = "orjson" if json_provider.orjson is not None else "stdlib fallback (orjson not installed)"
+    print(f"Fast path: {engine}\n")
+    print(f"{'payload':<22}{'bytes':>8}{'dumps std':>12}{'dumps fast':>12}{'loads std':>12}{'loads fast':>12}{'speedup':>10}")
+    for name, payload in payloads:
+        text = stdlib_dumps(payload)
+        dumps_std = timed(stdlib_dumps, payload, args.number)
+        dumps_fast = timed(fast_dumps, payload, args.number)
+        loads_std = timed(json.loads, text, args.number)
+        loads_fast = timed(json_provider.loads, text, args.number)
+        speedup = (dumps_std + loads_std) / (dumps_fast + loads_fast)
+        print(f"{name:<22}{len(text):>8}{dumps_std:>10.1f}µs{dumps_fast:>10.1f}µs"
+              f"{loads_std:>10.1f}µs{loads_fast:>10.1f}µs{speedup:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
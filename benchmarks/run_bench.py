@@ -0,0 +1,231 @@
+"""Load test of every API endpoint against local upstream stubs.
+
+    python benchmarks/run_bench.py --concurrency 32 --requests 500
+    python benchmarks/run_bench.py --scenarios relay-points,checkout --soap-latency-ms 800
+
+The stubs (benchmarks/stubs.py) stand in for Stripe, Mondial Relay and
+Supabase. The app is started under gunicorn with gunicorn.conf.py and a
+throwaway DATA_DIR. Pass --target to load an app that is already running
+(it must point at the stubs itself, see `python benchmarks/stubs.py`).
+
+For each scenario, the harness reports throughput, error count and p50/p95/p99
+latency. --output writes the same numbers as JSON so runs can be compared.
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from stubs import ADMIN_TOKEN, StubServer, add_latency_arguments, state_from_arguments
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+POSTAL_CODES = ['75001', '75011', '69003', '13001', '33000', '31000', '59000', '44000', '67000', '06000']
+ADDRESS = {"fullName": "Client Test", "phone": "0611111111", "street": "2 rue du Test",
+           "postalCode": "75011", "city": "Paris", "country": "FR"}
+RELAY_POINT = {"id": "000001", "name": "RELAIS 1", "address": "1 RUE DE LA REPUBLIQUE",
+               "postalCode": "75011", "city": "PARIS"}
+SELLER = {"fullName": "Vendeur Test", "phone": "0600000000", "street": "1 rue du Stub",
+          "postalCode": "75011", "city": "Paris"}
+ADMIN_HEADERS = {"Authorization": f"Bearer {ADMIN_TOKEN}"}
+# 1x1 PNG
+DOCUMENT_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=='
+)
+
+
+def account_id():
+    return f"acct_bench{random.randrange(1000):04d}"
+
+
+def product(index=0):
+    return {
+        "productId": f"prod-{random.randrange(10000)}",
+        "productTitle": f"Palette {index}",
+        "productPrice": round(random.uniform(5, 120), 2),
+        "sellerId": f"seller-{random.randrange(5)}",
+        "sellerStripeId": account_id(),
+    }
+
+
+# name -> (method, path, kwargs factory). Everything under /api/ plus static files.
+SCENARIOS = {
+    'relay-points': ('POST', '/api/get-relay-points', lambda: {
+        "json": {"postalCode": random.choice(POSTAL_CODES), "country": "FR"}}),
+    'relay-points-nearby': ('POST', '/api/get-relay-points', lambda: {
+        "json": {"latitude": 48.85 + random.uniform(-0.1, 0.1), "longitude": 2.35 + random.uniform(-0.1, 0.1)}}),
+    'stripe-status': ('POST', '/api/check-stripe-status', lambda: {
+        "json": {"account_id": account_id()}}),
+    'stripe-status-action': ('POST', '/api/', lambda: {
+        "json": {"action": "check-stripe-status", "account_id": account_id()}}),
+    'stripe-status-batch': ('POST', '/api/check-stripe-status-batch', lambda: {
+        "json": {"account_ids": [account_id() for _ in range(20)]}, "headers": ADMIN_HEADERS}),
+    'create-account': ('POST', '/api/create-stripe-account', lambda: {
+        "json": {"first_name": "Camille", "last_name": "Martin", "email": "camille@example.com",
+                 "phone": "+33611111111", "dob_day": 1, "dob_month": 2, "dob_year": 1990,
+                 "address_line1": "2 rue du Test", "address_city": "Paris",
+                 "address_postal_code": "75011", "iban": "FR1420041010050500013M02606"}}),
+    'upload-document': ('POST', '/api/upload-document', lambda: {
+        "files": {"file": ("id.png", DOCUMENT_PNG, 'image/png')},
+        "data": {"purpose": "identity_document", "account_id": account_id()}}),
+    'checkout': ('POST', '/api/create-checkout-session', lambda: {
+        "json": {**product(), "buyerId": "buyer-1", "deliveryAddress": ADDRESS, "relayPoint": RELAY_POINT}}),
+    'checkout-cart': ('POST', '/api/create-checkout-session', lambda: {
+        "json": {"items": [product(i) for i in range(5)], "buyerId": "buyer-1",
+                 "deliveryAddress": ADDRESS, "relayPoint": RELAY_POINT}}),
+    'appointment-checkout': ('POST', '/api/create-appointment-checkout', lambda: {
+        "json": {"amount": 2000, "stripe_account_id": account_id()}}),
+    'boost-checkout': ('POST', '/api/create-boost-session', lambda: {
+        "json": {"productId": "prod-1", "duration": 7, "priceId": "price_boost7", "buyerId": "buyer-1"}}),
+    'quote-prices': ('POST', '/api/quote-prices', lambda: {
+        "json": {"prices": [round(random.uniform(1, 200), 2) for _ in range(1000)]}}),
+    'shipping-label': ('POST', '/api/create-shipping-label', lambda: {
+        "json": {"buyer": ADDRESS, "seller": SELLER, "relayPoint": RELAY_POINT, "productId": "prod-1"}}),
+    'shipping-labels-batch': ('POST', '/api/create-shipping-labels', lambda: {
+        "json": {"labels": [{"buyer": ADDRESS, "seller": SELLER, "relayPoint": RELAY_POINT,
+                             "productId": f"prod-{i}"} for i in range(10)]}, "headers": ADMIN_HEADERS}),
+    'stats': ('GET', '/api/cache-stats', lambda: {}),
+    'static-index': ('GET', '/', lambda: {"headers": {"Accept-Encoding": "br, gzip"}}),
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def run_scenario(target, name, count, concurrency, timeout):
+    method, path, make_kwargs = SCENARIOS[name]
+    local = threading.local()
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def one(_):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session.request(method, f"{target}{path}", timeout=timeout, **make_kwargs())
+            response.content
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(count)))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    errors = sum(n for status, n in statuses.items() if not isinstance(status, int) or status >= 500)
+    return {
+        "scenario": name,
+        "requests": count,
+        "errors": errors,
+        "statuses": {str(status): n for status, n in statuses.items()},
+        "rps": round(count / wall, 1),
+        "p50Ms": round(1000 * percentile(latencies, 0.50), 1),
+        "p95Ms": round(1000 * percentile(latencies, 0.95), 1),
+        "p99Ms": round(1000 * percentile(latencies, 0.99), 1),
+    }
+
+
+def start_app(stubs, port, data_dir, extra_env=None):
+    env = dict(os.environ, **stubs.env())
+    env.update(extra_env or {})
+    env.update({
+        'PORT': str(port),
+        'DATA_DIR': data_dir,
+        'PROMETHEUS_MULTIPROC_DIR': os.path.join(data_dir, 'prometheus'),
+        'GUNICORN_ACCESS_LOG': os.devnull,
+    })
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    target = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"❌ App exited during startup:\n{process.stderr.read()}")
+        try:
+            requests.get(f"{target}/api/startup-stats", timeout=1)
+            return process, target
+        except requests.RequestException:
+            time.sleep(0.25)
+    process.terminate()
+    raise SystemExit("❌ App did not start within 60s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', help="URL of an already running app (skips starting gunicorn)")
+    parser.add_argument('--port', type=int, default=5099, help="port for the gunicorn started by the harness")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma-separated, default all: {', '.join(SCENARIOS)}")
+    parser.add_argument('--requests', type=int, default=300, help="requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--warmup', type=int, default=20, help="untimed requests per scenario first")
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    state = state_from_arguments(args)
+    with StubServer(state) as stubs, tempfile.TemporaryDirectory(prefix='shay-bench-') as data_dir:
+        process = None
+        target = args.target
+        if not target:
+            process, target = start_app(stubs, args.port, data_dir)
+        try:
+            print(f"Target {target}, stubs {stubs.base_url}, concurrency {args.concurrency}\n")
+            print(f"{'scenario':<24}{'req':>6}{'err':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  statuses")
+            results = []
+            for name in names:
+                if args.warmup:
+                    run_scenario(target, name, args.warmup, args.concurrency, args.timeout)
+                result = run_scenario(target, name, args.requests, args.concurrency, args.timeout)
+                results.append(result)
+                print(f"{name:<24}{result['requests']:>6}{result['errors']:>6}{result['rps']:>9}"
+                      f"{result['p50Ms']:>9}{result['p95Ms']:>9}{result['p99Ms']:>9}  {result['statuses']}")
+            print(f"\nUpstream calls: {state.counts}")
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "run": uuid.uuid4().hex,
+                "at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                "settings": {k: v for k, v in vars(args).items() if k != 'output'},
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""Local stand-ins for Stripe, Mondial Relay and Supabase, for load tests.
+
+    python benchmarks/stubs.py --port 8099 --soap-latency-ms 300
+
+One HTTP server answers all three upstreams, routed by path:
+
+- /v1/...            Stripe (stripe-mock style canned objects)
+- /Web_Services.asmx Mondial Relay SOAP (WSI4_PointRelais_Recherche)
+- /api/Shipment      Mondial Relay label creation (WSI2_CreationEtiquette)
+- /labels/<n>.pdf    label PDFs referenced by URL_PDF
+- /rest/v1/<table>   Supabase REST (in-memory profiles and messages)
+
+Point the app at it with the environment printed at startup
+(STRIPE_API_BASE, MONDIAL_RELAY_SOAP_URL, MONDIAL_RELAY_API_URL,
+SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY).
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Any well-formed JWT is accepted by supabase-py; the stub does not check it
+SUPABASE_STUB_KEY = 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.c3R1Yg'
+# Bearer token of the app's admin routes while it runs against the stubs
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', 'bench-admin')
+
+SOAP_ENVELOPE = """<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" \
+xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+<soap:Body>{body}</soap:Body>
+</soap:Envelope>"""
+
+RELAY_POINT_XML = """<PointRelais_Details>\
+<STAT>0</STAT><Num>{num:06d}</Num><LgAdr1>RELAIS {num} PRESSE TABAC</LgAdr1><LgAdr2 />\
+<LgAdr3>{num} RUE DE LA REPUBLIQUE</LgAdr3><LgAdr4 /><CP>{postal_code}</CP><Ville>PARIS</Ville><Pays>FR</Pays>\
+<Localisation1 /><Localisation2 /><Latitude>{latitude}</Latitude><Longitude>{longitude}</Longitude>\
+<TypeActivite>000</TypeActivite><Information /><Horaires_Lundi><string>0900</string><string>1900</string></Horaires_Lundi>\
+<Horaires_Livraison><string>Lundi: 09:00-12:30 14:00-19:00</string></Horaires_Livraison>\
+<URL_Photo>https://ww2.mondialrelay.com/public/permanent/photo_relais.aspx?ens=CC22UCDZ&amp;num={num:06d}</URL_Photo>\
+<URL_Plan>https://ww2.mondialrelay.com/public/permanent/plan_relais.aspx?ens=CC22UCDZ&amp;num={num:06d}</URL_Plan>\
+<Distance>{distance}</Distance></PointRelais_Details>"""
+
+# Smallest file the label store accepts as a PDF
+LABEL_PDF = b"%PDF-1.4\n1 0 obj << /Type /Catalog >> endobj\ntrailer << /Root 1 0 R >>\n%%EOF\n"
+
+# /v1/<resource>[/<prefix>_<id>], e.g. /v1/checkout/sessions, /v1/accounts/acct_123
+STRIPE_ID_RE = re.compile(r'^/v1/([a-z_/]+?)(?:/([a-z]+_[A-Za-z0-9_]+))?$')
+
+
+def stripe_account(account_id):
+    return {
+        "id": account_id,
+        "object": "account",
+        "charges_enabled": True,
+        "payouts_enabled": False,
+        "capabilities": {"card_payments": "active", "transfers": "pending"},
+        "requirements": {
+            "currently_due": ["external_account"],
+            "current_deadline": None,
+            "disabled_reason": None,
+            "eventually_due": [],
+            "past_due": [],
+        },
+    }
+
+
+class StubState:
+    """Latency settings and in-memory data shared by the handler threads."""
+
+    def __init__(self, latencies_ms, jitter=0.2, relay_points=20):
+        self.latencies_ms = latencies_ms  # upstream -> mean latency
+        self.jitter = jitter
+        self.relay_points = relay_points
+        self.base_url = None
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.messages = []
+        self.labels = itertools.count(1)
+
+    def wait(self, upstream):
+        latency = self.latencies_ms.get(upstream, 0) / 1000
+        if latency:
+            time.sleep(latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+        with self.lock:
+            self.counts[upstream] = self.counts.get(upstream, 0) + 1
+
+
+def make_handler(state):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return self.rfile.read(length) if length else b''
+
+        def reply(self, status, payload, content_type='application/json'):
+            if not isinstance(payload, bytes):
+                payload = (json.dumps(payload) if content_type == 'application/json' else payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self.route('GET')
+
+        def do_POST(self):
+            self.route('POST')
+
+        def do_PATCH(self):
+            self.route('PATCH')
+
+        def route(self, method):
+            parts = urlsplit(self.path)
+            body = self.body()
+            if parts.path.startswith('/v1/'):
+                state.wait('stripe')
+                self.stripe(method, parts.path)
+            elif parts.path.startswith('/rest/v1/'):
+                state.wait('supabase')
+                self.supabase(method, parts.path[len('/rest/v1/'):], parse_qs(parts.query), body)
+            elif parts.path.startswith('/labels/'):
+                state.wait('label_pdf')
+                self.reply(200, LABEL_PDF, 'application/pdf')
+            elif b'WSI4_PointRelais_Recherche' in body:
+                state.wait('soap')
+                self.relay_points(body)
+            elif b'WSI2_CreationEtiquette' in body:
+                state.wait('soap')
+                self.label()
+            else:
+                self.reply(404, {"error": f"No stub for {method} {parts.path}"})
+
+        def stripe(self, method, path):
+            match = STRIPE_ID_RE.match(path)
+            resource, object_id = match.groups() if match else (None, None)
+            suffix = uuid.uuid4().hex[:14]
+            if resource == 'accounts':
+                self.reply(200, stripe_account(object_id or f"acct_{suffix}"))
+            elif resource == 'checkout/sessions':
+                session_id = object_id or f"cs_test_{suffix}"
+                self.reply(200, {
+                    "id": session_id,
+                    "object": "checkout.session",
+                    "url": f"https://checkout.stripe.com/c/pay/{session_id}",
+                    "payment_intent": f"pi_{suffix}",
+                })
+            elif resource == 'payment_intents':
+                self.reply(200, {"id": object_id, "object": "payment_intent", "latest_charge": f"ch_{suffix}"})
+            elif resource == 'transfers':
+                self.reply(200, {"id": f"tr_{suffix}", "object": "transfer"})
+            elif resource == 'files':
+                self.reply(200, {"id": f"file_{suffix}", "object": "file", "purpose": "identity_document"})
+            else:
+                self.reply(404, {"error": {"type": "invalid_request_error", "message": f"Unrecognized request URL ({path})"}})
+
+        def supabase(self, method, table, query, body):
+            if table == 'profiles':
+                seller_id = query.get('id', ['eq.unknown'])[0].split('.', 1)[-1]
+                self.reply(200, [{"id": seller_id, "metadata": {"shippingAddress": {
+                    "fullName": "Vendeur Test", "phone": "0600000000", "street": "1 rue du Stub",
+                    "postalCode": "75011", "city": "Paris", "country": "FR",
+                }}}])
+            elif table == 'messages' and method == 'POST':
+                rows = json.loads(body or b'[]')
+                rows = rows if isinstance(rows, list) else [rows]
+                with state.lock:
+                    state.messages.extend(rows)
+                self.reply(201, rows)
+            else:
+                self.reply(200, [])
+
+        def relay_points(self, body):
+            match = re.search(rb'<mr:CP>(\d+)</mr:CP>', body)
+            postal_code = match.group(1).decode() if match else '75011'
+            points = ''.join(
+                RELAY_POINT_XML.format(
+                    num=index + 1, postal_code=postal_code, distance=100 + 75 * index,
+                    latitude=f"48,{856614 + 731 * index}", longitude=f"002,{352222 + 517 * index}",
+                )
+                for index in range(state.relay_points)
+            )
+            self.reply(200, SOAP_ENVELOPE.format(body=(
+                '<WSI4_PointRelais_RechercheResponse xmlns="http://www.mondialrelay.fr/webservice/">'
+                f'<WSI4_PointRelais_RechercheResult><STAT>0</STAT><PointsRelais>{points}</PointsRelais>'
+                '</WSI4_PointRelais_RechercheResult></WSI4_PointRelais_RechercheResponse>'
+            )), 'text/xml; charset=utf-8')
+
+        def label(self):
+            number = next(state.labels)
+            self.reply(200, SOAP_ENVELOPE.format(body=(
+                '<WSI2_CreationEtiquetteResponse xmlns="http://www.mondialrelay.fr/webservice/">'
+                f'<WSI2_CreationEtiquetteResult><Stat>0</Stat><ExpeditionNum>{number:08d}</ExpeditionNum>'
+                f'<URL_PDF>{state.base_url}/labels/{number}.pdf</URL_PDF>'
+                '</WSI2_CreationEtiquetteResult></WSI2_CreationEtiquetteResponse>'
+            )), 'text/xml; charset=utf-8')
+
+    return StubHandler
+
+
+class StubServer:
+    """Runs the stubs on a background thread: `with StubServer(state) as stubs:`."""
+
+    def __init__(self, state, host='127.0.0.1', port=0):
+        self.state = state
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(state))
+        self.httpd.daemon_threads = True
+        self.base_url = state.base_url = f"http://{host}:{self.httpd.server_port}"
+
+    def env(self):
+        # Environment that points server.py at the stubs
+        return {
+            'STRIPE_API_BASE': self.base_url,
+            'STRIPE_SECRET_KEY': 'sk_test_stub',
+            'MONDIAL_RELAY_SOAP_URL': f"{self.base_url}/Web_Services.asmx",
+            'MONDIAL_RELAY_API_URL': f"{self.base_url}/api/Shipment",
+            'SUPABASE_URL': self.base_url,
+            'SUPABASE_SERVICE_ROLE_KEY': SUPABASE_STUB_KEY,
+            'ADMIN_TOKEN': ADMIN_TOKEN,
+            # The stub has no rate limit: keep the app's Stripe budgets out of the way
+            # unless they are being measured
+            'STRIPE_READ_RATE': os.getenv('STRIPE_READ_RATE', '10000'),
+            'STRIPE_WRITE_RATE': os.getenv('STRIPE_WRITE_RATE', '10000'),
+        }
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True, name='stubs').start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_latency_arguments(parser):
+    parser.add_argument('--stripe-latency-ms', type=float, default=150)
+    parser.add_argument('--soap-latency-ms', type=float, default=300)
+    parser.add_argument('--supabase-latency-ms', type=float, default=40)
+    parser.add_argument('--label-pdf-latency-ms', type=float, default=80)
+    parser.add_argument('--jitter', type=float, default=0.2, help="latency spread, +/- fraction of the mean")
+    parser.add_argument('--relay-points', type=int, default=20, help="relay points per SOAP search")
+
+
+def state_from_arguments(args):
+    return StubState({
+        'stripe': args.stripe_latency_ms,
+        'soap': args.soap_latency_ms,
+        'supabase': args.supabase_latency_ms,
+        'label_pdf': args.label_pdf_latency_ms,
+    }, jitter=args.jitter, relay_points=args.relay_points)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    with StubServer(state_from_arguments(args), args.host, args.port) as stubs:
+        print(f"✅ Stubs listening on {stubs.base_url}")
+        for name, value in stubs.env().items():
+            print(f"export {name}={value}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""Replay bursts of signed Stripe webhook events against /api/stripe-webhook.
+
+    python benchmarks/webhook_replay.py --synthetic 300 --rate 50 --concurrency 16
+    python benchmarks/webhook_replay.py --events recorded.jsonl --target http://127.0.0.1:5000 --secret whsec_...
+
+Each line of --events is a Stripe event object, e.g. from
+`stripe events list --type checkout.session.completed` or the dashboard.
+Without --events, --synthetic N checkout.session.completed events are
+generated (product purchases, plus carts with --cart-ratio).
+
+Every event is signed at send time the way Stripe does it
+(`Stripe-Signature: t=<ts>,v1=<HMAC-SHA256(secret, "<ts>.<payload>")>`).
+Event and session ids get a per-run suffix so the app does not treat a replay
+as duplicates (--keep-ids to exercise deduplication instead).
+
+Reported:
+- ack latency (p50/p95/p99) and status counts of the webhook responses,
+- end-to-end time from send to the label PDF being served by
+  /api/labels/<session_id> (one per seller for carts),
+- the webhook queue stats at the end.
+
+Without --target, the app is started under gunicorn against the local stubs
+(benchmarks/stubs.py) with --secret as STRIPE_WEBHOOK_SECRET.
+"""
+import argparse
+import copy
+import hashlib
+import hmac
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from run_bench import ADDRESS, RELAY_POINT, account_id, percentile, start_app
+from stubs import StubServer, add_latency_arguments, state_from_arguments
+
+
+def sign(payload, secret, timestamp=None):
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def synthetic_event(index, cart=False):
+    # Same metadata as checkout_session_params / cart_session_params
+    session_id = f"cs_test_replay{index:06d}"
+    metadata = {
+        "buyerId": f"buyer-{index}",
+        "deliveryAddress": json.dumps(ADDRESS),
+        "relayPoint": json.dumps(RELAY_POINT),
+    }
+    if cart:
+        sellers = [
+            {"sellerId": f"seller-{n}", "stripeId": account_id(), "amount": random.randrange(500, 12000),
+             "productIds": [f"prod-{index}-{n}"]}
+            for n in range(random.randint(2, 4))
+        ]
+        metadata.update({"type": "cart", "cartId": f"cart_{index}", "sellerCount": str(len(sellers))})
+        metadata.update({f"seller_{n}": json.dumps(seller) for n, seller in enumerate(sellers)})
+    else:
+        metadata.update({"type": "product", "productId": f"prod-{index}", "sellerId": f"seller-{index % 50}"})
+    return {
+        "id": f"evt_replay{index:06d}",
+        "object": "event",
+        "type": "checkout.session.completed",
+        "created": int(time.time()),
+        "data": {"object": {
+            "id": session_id,
+            "object": "checkout.session",
+            "payment_intent": f"pi_replay{index:06d}",
+            "payment_status": "paid",
+            "metadata": metadata,
+        }},
+    }
+
+
+def load_events(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def order_ids(event):
+    # Ids under which the labels are stored (see handle_cart_payment)
+    session = event.get('data', {}).get('object', {})
+    metadata = session.get('metadata') or {}
+    if event.get('type') != 'checkout.session.completed':
+        return []
+    if metadata.get('type') == 'cart':
+        sellers = [json.loads(metadata[f"seller_{n}"]) for n in range(int(metadata.get('sellerCount', 0)))]
+        return [f"{session['id']}:{seller['sellerId']}" for seller in sellers]
+    if metadata.get('type') == 'product':
+        return [session['id']]
+    return []
+
+
+def fresh_ids(event, suffix):
+    event = copy.deepcopy(event)
+    event['id'] = f"{event['id']}_{suffix}"
+    session = event.get('data', {}).get('object', {})
+    if session.get('object') == 'checkout.session':
+        session['id'] = f"{session['id']}_{suffix}"
+    return event
+
+
+class LabelPoller:
+    """Polls /api/labels/<id> in the background and records when each label appears."""
+
+    def __init__(self, target, interval):
+        self.target = target
+        self.interval = interval
+        self.pending = {}  # order id -> send time
+        self.done = {}  # order id -> seconds from send to label
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True, name='label-poller')
+
+    def expect(self, order_id, sent_at):
+        with self.lock:
+            self.pending[order_id] = sent_at
+
+    def run(self):
+        session = requests.Session()
+        while not self.stopped.is_set():
+            with self.lock:
+                pending = list(self.pending.items())
+            for order_id, sent_at in pending:
+                try:
+                    response = session.head(f"{self.target}/api/labels/{order_id}", timeout=5)
+                except requests.RequestException:
+                    continue
+                if response.status_code == 200:
+                    with self.lock:
+                        self.pending.pop(order_id, None)
+                        self.done[order_id] = time.perf_counter() - sent_at
+            self.stopped.wait(self.interval)
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.lock:
+                if not self.pending:
+                    break
+            time.sleep(self.interval)
+        self.stopped.set()
+        self.thread.join()
+
+
+def replay(target, events, secret, rate, concurrency, timeout, poller):
+    local = threading.local()
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def send(event):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        payload = json.dumps(event).encode()
+        headers = {'Content-Type': 'application/json', 'Stripe-Signature': sign(payload, secret)}
+        start = time.perf_counter()
+        try:
+            response = session.post(f"{target}/api/stripe-webhook", data=payload, headers=headers, timeout=timeout)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        if status == 200 and poller is not None:
+            for order_id in order_ids(event):
+                poller.expect(order_id, start)
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, event in enumerate(events):
+            if rate:
+                # Open-loop schedule: event i leaves at start + i / rate
+                delay = start + index / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(send, event)
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "events": len(events),
+        "seconds": round(wall, 2),
+        "rate": round(len(events) / wall, 1),
+        "errors": sum(n for status, n in statuses.items() if status != 200),
+        "statuses": {str(status): n for status, n in statuses.items()},
+        "ackP50Ms": round(1000 * percentile(latencies, 0.50), 1),
+        "ackP95Ms": round(1000 * percentile(latencies, 0.95), 1),
+        "ackP99Ms": round(1000 * percentile(latencies, 0.99), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', help="JSONL file of Stripe events")
+    parser.add_argument('--synthetic', type=int, default=200, help="generated events when --events is not given")
+    parser.add_argument('--cart-ratio', type=float, default=0.2, help="share of synthetic events that are carts")
+    parser.add_argument('--keep-ids', action='store_true', help="send event/session ids unchanged")
+    parser.add_argument('--secret', default=os.getenv('STRIPE_WEBHOOK_SECRET', 'whsec_replay'))
+    parser.add_argument('--target', help="URL of an already running app (skips starting gunicorn)")
+    parser.add_argument('--port', type=int, default=5098)
+    parser.add_argument('--rate', type=float, default=0, help="events per second, 0 = as fast as possible")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--timeout', type=float, default=30, help="per webhook request")
+    parser.add_argument('--no-labels', action='store_true', help="do not measure time to label creation")
+    parser.add_argument('--label-timeout', type=float, default=300, help="seconds to wait for the labels")
+    parser.add_argument('--poll-interval', type=float, default=0.2)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    if args.events:
+        events = load_events(args.events)
+    else:
+        events = [synthetic_event(index, cart=random.random() < args.cart_ratio) for index in range(args.synthetic)]
+    if not args.keep_ids:
+        suffix = uuid.uuid4().hex[:8]
+        events = [fresh_ids(event, suffix) for event in events]
+
+    state = state_from_arguments(args)
+    with StubServer(state) as stubs, tempfile.TemporaryDirectory(prefix='shay-replay-') as data_dir:
+        process = None
+        target = args.target
+        if not target:
+            process, target = start_app(stubs, args.port, data_dir, {'STRIPE_WEBHOOK_SECRET': args.secret})
+        try:
+            poller = None if args.no_labels else LabelPoller(target, args.poll_interval)
+            if poller is not None:
+                poller.thread.start()
+            print(f"Replaying {len(events)} events to {target} (rate {args.rate or 'max'}/s, concurrency {args.concurrency})")
+            result = replay(target, events, args.secret, args.rate, args.concurrency, args.timeout, poller)
+            print(f"✅ Sent in {result['seconds']}s ({result['rate']}/s), statuses {result['statuses']}")
+            print(f"Ack latency p50 {result['ackP50Ms']} ms, p95 {result['ackP95Ms']} ms, p99 {result['ackP99Ms']} ms")
+
+            if poller is not None:
+                poller.wait(args.label_timeout)
+                durations = sorted(poller.done.values())
+                result.update({
+                    "labels": len(durations),
+                    "labelsMissing": len(poller.pending),
+                    "labelP50Ms": round(1000 * percentile(durations, 0.50), 1),
+                    "labelP95Ms": round(1000 * percentile(durations, 0.95), 1),
+                    "labelP99Ms": round(1000 * percentile(durations, 0.99), 1),
+                    "labelMaxMs": round(1000 * durations[-1], 1) if durations else 0.0,
+                })
+                print(f"Labels {result['labels']} ready, {result['labelsMissing']} missing after {args.label_timeout}s")
+                print(f"Send to label p50 {result['labelP50Ms']} ms, p95 {result['labelP95Ms']} ms, "
+                      f"p99 {result['labelP99Ms']} ms, max {result['labelMaxMs']} ms")
+
+            try:
+                result["queue"] = requests.get(f"{target}/api/webhook-queue/stats", timeout=5).json()
+                print(f"Queue: {result['queue']}")
+            except (requests.RequestException, ValueError) as e:
+                print(f"❌ Could not read queue stats: {e}")
+            if not args.target:
+                print(f"Upstream calls: {state.counts}")
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"settings": {k: v for k, v in vars(args).items() if k not in ('output', 'secret')},
+                       "results": result}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
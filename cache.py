@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _InflightCall:
+    # An upstream load in progress, shared by every caller waiting on the same key
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class TTLCache:
+    """Bounded in-memory LRU cache with per-entry TTL.
+
+    Entries older than `ttl` but younger than `ttl + stale_ttl` are served
+    immediately while a single background refresh runs. Concurrent misses
+    on the same key are collapsed into one loader call. Expired entries are
+    only replaced by a successful load, so `last_value` can still return
+    them while the upstream is down. Each entry records the wall-clock time
+    its value dates from, so `set_if_newer` can drop out-of-order updates.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, stale_ttl=0, name='cache'):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data = OrderedDict()  # key -> (value, expires_at, updated_at)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self.load_errors = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None, updated_at=None):
+        with self._lock:
+            self._store(key, value, ttl, updated_at)
+
+    def set_if_newer(self, key, value, updated_at, ttl=None):
+        # For pushed updates that may arrive late or replayed (webhooks):
+        # ignored when the cached value dates from after `updated_at`
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[2] > updated_at:
+                return False
+            self._store(key, value, ttl, updated_at)
+            return True
+
+    def _store(self, key, value, ttl, updated_at):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (value, expires_at, time.time() if updated_at is None else updated_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def last_value(self, key, default=None):
+        # Last loaded value, expired or not (fallback when reloading fails)
+        with self._lock:
+            entry = self._data.get(key)
+            return default if entry is None else entry[0]
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def lookup(self, key):
+        # (value, needs_refresh) for callers that run the load themselves
+        # (asyncio, see asgi.py): a stale value is returned with True, a miss
+        # or an entry past its stale window gives (None, True)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at, _ = entry
+                if now < expires_at:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value, False
+                if now < expires_at + self.stale_ttl:
+                    self._data.move_to_end(key)
+                    self.stale_hits += 1
+                    return value, True
+            self.misses += 1
+            return None, True
+
+    def get_or_load(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at, _ = entry
+                if now < expires_at:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if now < expires_at + self.stale_ttl:
+                    # Serve the stale value and refresh it in the background
+                    self._data.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._inflight:
+                        call = self._inflight[key] = _InflightCall()
+                        self.refreshes += 1
+                        threading.Thread(
+                            target=self._load, args=(key, loader, call, True), daemon=True
+                        ).start()
+                    return value
+
+            self.misses += 1
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InflightCall()
+
+        if not leader:
+            return call.wait()
+        return self._load(key, loader, call)
+
+    def _load(self, key, loader, call, background=False):
+        # The value dates from when the load started, not when it returned
+        started = time.time()
+        try:
+            value = loader()
+            self.set_if_newer(key, value, started)
+            call.value = value
+            return value
+        except Exception as e:
+            with self._lock:
+                self.load_errors += 1
+            call.error = e
+            if background:
+                print(f"Background refresh failed for {self.name} {key}: {e}")
+                return None
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.event.set()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "staleTtl": self.stale_ttl,
+                "hits": self.hits,
+                "staleHits": self.stale_hits,
+                "misses": self.misses,
+                "hitRatio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "refreshes": self.refreshes,
+                "loadErrors": self.load_errors,
+                "inflight": len(self._inflight),
+            }
@@ -0,0 +1,123 @@
+import math
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    # Appel refusé sans contacter l'upstream ; retry_after en secondes
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit {name} is open, retry in {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class _Guard:
+    # One guarded call; set `failed` for failures that are not exceptions (HTTP 5xx)
+    def __init__(self, breaker):
+        self.breaker = breaker
+        self.failed = False
+
+    def __enter__(self):
+        self.breaker.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None or self.failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return False
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one upstream operation.
+
+    After `failure_threshold` failures in a row the circuit opens and calls
+    fail immediately with CircuitOpenError for `reset_timeout` seconds.
+    Then up to `half_open_max_calls` probe calls are let through: a success
+    closes the circuit, a failure opens it again. A threshold of 0 disables it.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def guard(self):
+        return _Guard(self)
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now):
+        if self._state == OPEN and now >= self._opened_at + self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def retry_after(self):
+        with self._lock:
+            return self._retry_after(time.monotonic())
+
+    def _retry_after(self, now):
+        remaining = self._opened_at + self.reset_timeout - now
+        return max(1, math.ceil(remaining)) if self._state == OPEN else 1
+
+    def acquire(self):
+        if self.failure_threshold <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return
+            self.rejected += 1
+            retry_after = self._retry_after(now)
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                print(f"✅ Circuit {self.name} closed")
+            self._state = CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                print(f"❌ Circuit {self.name} opened after {self._failures} consecutive failures")
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            return {
+                "state": state,
+                "consecutiveFailures": self._failures,
+                "retryAfter": self._retry_after(now) if state == OPEN else 0,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
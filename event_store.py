@@ -0,0 +1,181 @@
+import os
+import sqlite3
+import threading
+import time
+
+from webhook_queue import connect
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_events (
+    event_id TEXT PRIMARY KEY,
+    session_id TEXT,
+    processed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_processed_events_at ON processed_events (processed_at);
+CREATE TABLE IF NOT EXISTS processed_sessions (
+    session_id TEXT PRIMARY KEY,
+    label_url TEXT,
+    claimed_at REAL NOT NULL,
+    completed_at REAL,
+    transferred_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_processed_sessions_at ON processed_sessions (claimed_at);
+"""
+
+CLAIMED = 'claimed'
+DONE = 'done'
+BUSY = 'busy'
+
+
+class EventStore:
+    """Dedup store for Stripe webhook event ids and checkout session ids.
+
+    A checkout session is claimed before its label is created and completed
+    once the seller has been sent the label, so redeliveries and concurrent
+    workers never create a second label. The label URL is recorded as soon
+    as the label exists, and a cart seller's transfer as soon as it is made:
+    a retry resumes after these checkpoints. Rows older than `retention`
+    seconds are purged.
+    """
+
+    def __init__(self, path, retention=30 * 86400, lease_seconds=300, purge_interval=3600):
+        self.path = path
+        self.retention = retention
+        self.lease_seconds = lease_seconds
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._last_purge = 0.0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        # Bases créées avant le point de reprise des transferts
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(processed_sessions)")}
+        if 'transferred_at' not in columns:
+            try:
+                conn.execute("ALTER TABLE processed_sessions ADD COLUMN transferred_at REAL")
+            except sqlite3.OperationalError:
+                pass  # ajoutée entre-temps par un autre worker
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = connect(self.path)
+            self._local.pid = os.getpid()
+        return conn
+
+    def seen_event(self, event_id):
+        row = self._conn().execute(
+            "SELECT 1 FROM processed_events WHERE event_id = ?", (event_id,)
+        ).fetchone()
+        return row is not None
+
+    def mark_event(self, event_id, session_id=None):
+        self._conn().execute(
+            "INSERT OR IGNORE INTO processed_events (event_id, session_id, processed_at) VALUES (?, ?, ?)",
+            (event_id, session_id, time.time())
+        )
+        self._maybe_purge()
+
+    def claim_session(self, session_id):
+        # Returns (CLAIMED, None), (DONE, label_url) or (BUSY, None)
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT label_url, claimed_at, completed_at FROM processed_sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO processed_sessions (session_id, claimed_at) VALUES (?, ?)",
+                    (session_id, now)
+                )
+                result = (CLAIMED, None)
+            elif row[2] is not None:
+                result = (DONE, row[0])
+            elif row[1] + self.lease_seconds <= now:
+                # Previous worker died mid-flight: take the claim over
+                conn.execute(
+                    "UPDATE processed_sessions SET claimed_at = ? WHERE session_id = ?",
+                    (now, session_id)
+                )
+                result = (CLAIMED, None)
+            else:
+                result = (BUSY, None)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return result
+
+    def complete_session(self, session_id, label_url):
+        self._conn().execute(
+            "UPDATE processed_sessions SET label_url = ?, completed_at = ? WHERE session_id = ?",
+            (label_url, time.time(), session_id)
+        )
+
+    def record_label(self, session_id, label_url):
+        # Checkpoint: label created, seller not notified yet
+        self._conn().execute(
+            "UPDATE processed_sessions SET label_url = ? WHERE session_id = ? AND completed_at IS NULL",
+            (label_url, session_id)
+        )
+
+    def record_transfer(self, session_id):
+        # Checkpoint: seller paid, the transfer must not be created again
+        self._conn().execute(
+            "UPDATE processed_sessions SET transferred_at = ? WHERE session_id = ? AND completed_at IS NULL",
+            (time.time(), session_id)
+        )
+
+    def progress(self, session_id):
+        # Checkpoints of a claimed session, so a retry resumes after them
+        row = self._conn().execute(
+            "SELECT label_url, transferred_at FROM processed_sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return {"labelUrl": None, "transferred": False}
+        return {"labelUrl": row[0], "transferred": row[1] is not None}
+
+    def release_session(self, session_id):
+        # The next delivery can claim the session at once; sessions with a
+        # checkpoint keep their row (lease expired) so it is not lost
+        conn = self._conn()
+        conn.execute(
+            "DELETE FROM processed_sessions WHERE session_id = ? AND completed_at IS NULL"
+            " AND label_url IS NULL AND transferred_at IS NULL",
+            (session_id,)
+        )
+        conn.execute(
+            "UPDATE processed_sessions SET claimed_at = ? WHERE session_id = ? AND completed_at IS NULL",
+            (time.time() - self.lease_seconds, session_id)
+        )
+
+    def get_session(self, session_id):
+        row = self._conn().execute(
+            "SELECT label_url, completed_at FROM processed_sessions WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+        if row is None or row[1] is None:
+            return None
+        return {"labelUrl": row[0], "completedAt": row[1]}
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        cutoff = now - self.retention
+        conn = self._conn()
+        conn.execute("DELETE FROM processed_events WHERE processed_at < ?", (cutoff,))
+        conn.execute("DELETE FROM processed_sessions WHERE claimed_at < ?", (cutoff,))
+
+    def stats(self):
+        conn = self._conn()
+        return {
+            "events": conn.execute("SELECT COUNT(*) FROM processed_events").fetchone()[0],
+            "sessions": conn.execute("SELECT COUNT(*) FROM processed_sessions").fetchone()[0],
+            "retentionSeconds": self.retention,
+        }
@@ -0,0 +1,63 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+try:
+    import numpy
+except ImportError:  # Optional: quote_cents falls back to plain Python loops
+    numpy = None
+
+# Barème Shay Beauty, en centimes
+SERVICE_FEE_BASIS_POINTS = 800  # 8 %
+FIXED_FEE_CENTS = 70
+SHIPPING_CENTS = 389
+
+# Below this size the numpy conversion costs more than it saves
+NUMPY_MIN_SIZE = 64
+
+
+def to_cents(amount):
+    # Euros (float, str or int) -> integer cents, rounded half-up.
+    # str() first so 19.99 is read as written, not as 19.989999...
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def percent_of(cents, basis_points):
+    # Half-up rounding in integer arithmetic (non-negative amounts)
+    return (cents * basis_points + 5000) // 10000
+
+
+def seller_fees(subtotal_cents, shipping_cents=SHIPPING_CENTS):
+    # Fees for one seller's parcel: the seller receives the subtotal, the
+    # platform keeps the service fee, the fixed fee and the shipping
+    service_fee = percent_of(subtotal_cents, SERVICE_FEE_BASIS_POINTS)
+    platform_fee = service_fee + FIXED_FEE_CENTS + shipping_cents
+    return {
+        "subtotal": subtotal_cents,
+        "serviceFee": service_fee,
+        "fixedFee": FIXED_FEE_CENTS,
+        "shipping": shipping_cents,
+        "platformFee": platform_fee,
+        "total": subtotal_cents + platform_fee,
+    }
+
+
+def quote_cents(prices_cents, shipping_cents=SHIPPING_CENTS):
+    # Final prices for many listings at once, column-wise:
+    # {"price": [...], "serviceFee": [...], "total": [...]} plus the flat fees.
+    # The numpy path uses int64: callers must bound the prices (server.py
+    # caps them at QUOTE_MAX_PRICE_CENTS), it overflows above ~1.15e15 cents
+    if numpy is not None and len(prices_cents) >= NUMPY_MIN_SIZE:
+        prices = numpy.asarray(prices_cents, dtype=numpy.int64)
+        service_fees = (prices * SERVICE_FEE_BASIS_POINTS + 5000) // 10000
+        totals = prices + service_fees + (FIXED_FEE_CENTS + shipping_cents)
+        service_fees, totals = service_fees.tolist(), totals.tolist()
+    else:
+        service_fees = [(price * SERVICE_FEE_BASIS_POINTS + 5000) // 10000 for price in prices_cents]
+        flat = FIXED_FEE_CENTS + shipping_cents
+        totals = [price + fee + flat for price, fee in zip(prices_cents, service_fees)]
+    return {
+        "price": list(prices_cents),
+        "serviceFee": service_fees,
+        "fixedFee": FIXED_FEE_CENTS,
+        "shipping": shipping_cents,
+        "total": totals,
+    }
@@ -0,0 +1,94 @@
+"""gunicorn settings for production (`gunicorn -c gunicorn.conf.py`).
+
+Almost every request waits on Stripe, Mondial Relay or Supabase, so workers
+are thread-based (gthread) or greenlet-based (gevent) rather than sync.
+See README "Production" for how the numbers below are sized.
+"""
+import math
+import multiprocessing
+import os
+import shutil
+
+wsgi_app = 'server:app'
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    # Must run before server.py imports ssl/requests/stripe in the master
+    from gevent import monkey
+    monkey.patch_all()
+
+# Little's law: requests in flight = arrival rate × time spent per request.
+# 50% headroom on top of the measured upstream latency.
+TARGET_RPS = float(os.getenv('GUNICORN_TARGET_RPS', 0))
+UPSTREAM_LATENCY_MS = float(os.getenv('GUNICORN_UPSTREAM_LATENCY_MS', 400))
+
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+if os.getenv('GUNICORN_THREADS'):
+    threads = int(os.getenv('GUNICORN_THREADS'))
+elif TARGET_RPS:
+    in_flight = TARGET_RPS * UPSTREAM_LATENCY_MS / 1000 * 1.5
+    threads = max(4, math.ceil(in_flight / workers))
+else:
+    threads = 16
+# gevent: connections handled concurrently per worker
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# Load server.py once in the master: the relay-point index, static manifest
+# and imported modules are shared copy-on-write by every worker. SQLite
+# connections, HTTP sessions and background threads are re-created per pid.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true')
+
+# Stripe calls may take up to 80s; label creation up to 15s (+ retries)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 90))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then, staggered so they do not all restart together
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+# Prometheus metrics are aggregated across workers through this directory.
+# It must be set before server.py imports prometheus_client.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/shay-prometheus')
+
+# Stripe's rate limit is per account: each worker gets 1/workers of the
+# STRIPE_READ_RATE / STRIPE_WRITE_RATE budgets (see server.py)
+os.environ.setdefault('STRIPE_LIMIT_PROCESSES', str(workers))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+# With preload, import stripe/supabase/XML in the master too so workers
+# inherit them; without preload each worker imports them on first use
+warm_imports = preload_app and os.getenv('GUNICORN_WARM_IMPORTS', 'true').lower() in ('1', 'true')
+
+
+def on_starting(server):
+    # Samples left by a previous run would be added to the new counters
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'])
+
+
+def when_ready(server):
+    if warm_imports:
+        import lazy_imports
+        lazy_imports.preload()
+    server.log.info(
+        f"✅ {workers} {worker_class} workers x {threads if worker_class == 'gthread' else worker_connections} "
+        f"concurrent requests (preload={preload_app})"
+    )
+
+
+def post_worker_init(worker):
+    # Background threads do not survive fork: start the webhook workers in each child,
+    # and load the relay-point store before the first request needs it
+    import server
+    server.start_webhook_workers(server.app)
+    server.RELAY_POINTS_STORE.start()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,160 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import metrics
+from circuit_breaker import CircuitBreaker
+from lazy_imports import LazyModule
+
+# Imported on the first outbound call, not at worker startup
+requests = LazyModule('requests')
+
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class OutboundClient:
+    """Shared keep-alive HTTP client for outbound calls.
+
+    One pooled `requests.Session` per process (recreated after a fork),
+    default connect/read timeouts, jittered retries for idempotent calls
+    only, per-host latency/error counters and one circuit breaker per
+    operation (connection errors, timeouts and 5xx count as failures).
+    """
+
+    def __init__(self, pool_size=20, connect_timeout=3.05, read_timeout=15.0,
+                 max_retries=2, backoff=0.2, max_backoff=2.0, name=None,
+                 breaker_threshold=5, breaker_reset_timeout=30.0):
+        self.name = name
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.breakers = {}
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    @property
+    def session(self):
+        if self._session is None or self._session_pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._session_pid != os.getpid():
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._session_pid = os.getpid()
+                    self._stats = {}
+        return self._session
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def breaker(self, operation):
+        breaker = self.breakers.get(operation)
+        if breaker is None:
+            with self._lock:
+                breaker = self.breakers.get(operation)
+                if breaker is None:
+                    breaker = self.breakers[operation] = CircuitBreaker(
+                        f"{self.name or 'outbound'}.{operation}",
+                        failure_threshold=self.breaker_threshold,
+                        reset_timeout=self.breaker_reset_timeout
+                    )
+        return breaker
+
+    def request(self, method, url, idempotent=None, timeout=None, operation=None, **kwargs):
+        # `operation` labels the call in the Prometheus metrics and picks its
+        # circuit breaker (defaults to the URL path). Raises CircuitOpenError
+        # without calling the upstream while the circuit is open.
+        parts = urlsplit(url)
+        operation = operation or metrics.normalize_path(parts.path)
+        with metrics.upstream_call(self.name or parts.netloc, operation) as call, self.breaker(operation).guard() as guard:
+            response = self._request(method, url, parts.netloc, idempotent, timeout, **kwargs)
+            call.status = response.status_code
+            guard.failed = response.status_code >= 500
+        return response
+
+    def _request(self, method, url, host, idempotent, timeout, **kwargs):
+        # Non-idempotent calls (label creation) are only retried when the
+        # connection was never established, so the request never left the box
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempts = 1 + self.max_retries
+        session = self.session
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            start = time.perf_counter()
+            try:
+                response = session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except requests.exceptions.ConnectTimeout as e:
+                self._record(host, None, time.perf_counter() - start, error=e)
+                if last_attempt:
+                    raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record(host, None, time.perf_counter() - start, error=e)
+                if last_attempt or not idempotent:
+                    raise
+            else:
+                self._record(host, response.status_code, time.perf_counter() - start)
+                if last_attempt or not idempotent or response.status_code not in RETRYABLE_STATUSES:
+                    return response
+
+            self._record_retry(host)
+            time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt))))
+
+    def _host_stats(self, host):
+        stats = self._stats.get(host)
+        if stats is None:
+            stats = self._stats[host] = {
+                "requests": 0,
+                "errors": 0,
+                "retries": 0,
+                "totalSeconds": 0.0,
+                "maxSeconds": 0.0,
+                "statuses": {},
+            }
+        return stats
+
+    def _record(self, host, status_code, elapsed, error=None):
+        with self._lock:
+            stats = self._host_stats(host)
+            stats["requests"] += 1
+            stats["totalSeconds"] += elapsed
+            stats["maxSeconds"] = max(stats["maxSeconds"], elapsed)
+            if error is not None or status_code >= 500:
+                stats["errors"] += 1
+            key = type(error).__name__ if error is not None else str(status_code)
+            stats["statuses"][key] = stats["statuses"].get(key, 0) + 1
+
+    def _record_retry(self, host):
+        with self._lock:
+            self._host_stats(host)["retries"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                host: dict(
+                    stats,
+                    statuses=dict(stats["statuses"]),
+                    avgMs=round(1000 * stats["totalSeconds"] / stats["requests"], 2) if stats["requests"] else 0.0,
+                )
+                for host, stats in self._stats.items()
+            }
+
+    def breaker_stats(self):
+        with self._lock:
+            breakers = dict(self.breakers)
+        return {operation: breaker.stats() for operation, breaker in breakers.items()}
@@ -0,0 +1,103 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional: compression is skipped without it
+    Image = None
+
+JPEG_MAGIC = b'\xff\xd8\xff'
+PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+
+
+def sniff_image_type(data):
+    if data.startswith(JPEG_MAGIC):
+        return 'JPEG'
+    if data.startswith(PNG_MAGIC):
+        return 'PNG'
+    return None
+
+
+def compress_image(data, max_dimension, max_bytes, quality):
+    # Runs in a worker process. Returns (bytes, format); EXIF is dropped
+    # because the image is re-encoded without passing `exif=`.
+    with Image.open(io.BytesIO(data)) as img:
+        source_format = img.format
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        if source_format == 'PNG':
+            out = io.BytesIO()
+            img.save(out, 'PNG', optimize=True)
+            if out.tell() <= max_bytes:
+                return out.getvalue(), 'PNG'
+
+        # JPEG, or a PNG scan still too large: step quality down until it fits.
+        # Transparent areas are flattened onto white, not left black
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            rgba = img.convert('RGBA')
+            rgb = Image.new('RGB', rgba.size, (255, 255, 255))
+            rgb.paste(rgba, mask=rgba.getchannel('A'))
+        else:
+            rgb = img.convert('RGB')
+        for q in (quality, quality - 10, quality - 20, quality - 30):
+            out = io.BytesIO()
+            rgb.save(out, 'JPEG', quality=max(q, 40), optimize=True, progressive=True)
+            if out.tell() <= max_bytes:
+                break
+        return out.getvalue(), 'JPEG'
+
+
+def mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class DocumentCompressor:
+    """Downscales and re-encodes JPEG/PNG identity documents off-thread.
+
+    The CPU work runs in a small process pool (created lazily, once per
+    worker process) so request threads only wait on the result. Files under
+    `min_bytes` (default: `max_bytes`) are left alone, and so is any file the
+    re-encoding would not make smaller.
+    """
+
+    def __init__(self, enabled=True, workers=2, max_dimension=3000, max_bytes=4 * 1024 * 1024,
+                 min_bytes=None, quality=85, timeout=30):
+        self.enabled = enabled and Image is not None
+        self.workers = workers
+        self.max_dimension = max_dimension
+        self.max_bytes = max_bytes
+        self.min_bytes = max_bytes if min_bytes is None else min_bytes
+        self.quality = quality
+        self.timeout = timeout
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    # Not fork: the gthread worker has other threads that may hold
+                    # locks at fork time; forkserver children start from a clean process
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context())
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def compress(self, data, filename):
+        # Returns (data, filename); files that are not JPEG/PNG, or smaller
+        # than `min_bytes`, are passed through untouched
+        if not self.enabled or len(data) < self.min_bytes or sniff_image_type(data) is None:
+            return data, filename
+
+        future = self._pool().submit(compress_image, data, self.max_dimension, self.max_bytes, self.quality)
+        compressed, image_format = future.result(timeout=self.timeout)
+        if len(compressed) >= len(data):
+            return data, filename
+        if image_format == 'JPEG':
+            filename = f"{os.path.splitext(filename)[0]}.jpg"
+        return compressed, filename
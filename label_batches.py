@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from webhook_queue import connect
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS label_batch_items (
+    batch_id TEXT NOT NULL,
+    item_index INTEGER NOT NULL,
+    payload_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    pdf_url TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (batch_id, item_index)
+);
+CREATE INDEX IF NOT EXISTS idx_label_batch_items_updated ON label_batch_items (updated_at);
+CREATE TABLE IF NOT EXISTS label_batches (
+    batch_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+RUNNING = 'running'
+FINISHED = 'finished'
+
+
+def payload_hash(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class LabelBatchStore:
+    """Per-item checkpoints for bulk shipping-label batches.
+
+    Items that already produced a label are skipped when the same batch id
+    is submitted again with the same payload, so a partially failed batch
+    can be resumed without creating duplicate labels. A batch is claimed
+    before it runs: a second submission is refused while the first one is
+    still making progress (within `lease_seconds`).
+    """
+
+    def __init__(self, path, retention=14 * 86400, lease_seconds=900):
+        self.path = path
+        self.retention = retention
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = connect(self.path)
+            self._local.pid = os.getpid()
+        return conn
+
+    def claim(self, batch_id, total):
+        # True when the caller now runs the batch, False while another run is live
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT status, updated_at FROM label_batches WHERE batch_id = ?", (batch_id,)
+            ).fetchone()
+            claimed = row is None or row[0] != RUNNING or row[1] + self.lease_seconds <= now
+            if claimed:
+                conn.execute(
+                    "INSERT OR REPLACE INTO label_batches (batch_id, status, total, updated_at) VALUES (?, ?, ?, ?)",
+                    (batch_id, RUNNING, total, now)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return claimed
+
+    def finish(self, batch_id):
+        self._conn().execute(
+            "UPDATE label_batches SET status = ?, updated_at = ? WHERE batch_id = ?",
+            (FINISHED, time.time(), batch_id)
+        )
+
+    def batch(self, batch_id):
+        row = self._conn().execute(
+            "SELECT status, total, updated_at FROM label_batches WHERE batch_id = ?", (batch_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"status": row[0], "total": row[1], "updatedAt": row[2]}
+
+    def mark_pending(self, batch_id, items):
+        # items: [(item_index, payload_hash)] about to be (re)created
+        now = time.time()
+        self._conn().executemany(
+            "INSERT OR REPLACE INTO label_batch_items "
+            "(batch_id, item_index, payload_hash, status, updated_at) VALUES (?, ?, ?, 'pending', ?)",
+            [(batch_id, index, item_hash, now) for index, item_hash in items]
+        )
+
+    def completed(self, batch_id):
+        # {item_index: (payload_hash, pdf_url)} for items that succeeded
+        rows = self._conn().execute(
+            "SELECT item_index, payload_hash, pdf_url FROM label_batch_items "
+            "WHERE batch_id = ? AND status = 'done'",
+            (batch_id,)
+        ).fetchall()
+        return {index: (item_hash, pdf_url) for index, item_hash, pdf_url in rows}
+
+    def record(self, batch_id, item_index, item_hash, pdf_url=None, error=None):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO label_batch_items "
+            "(batch_id, item_index, payload_hash, status, pdf_url, error, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (batch_id, item_index, item_hash, 'done' if pdf_url else 'failed', pdf_url, error, time.time())
+        )
+        # Progression : prolonge le bail du lot
+        self._conn().execute(
+            "UPDATE label_batches SET updated_at = ? WHERE batch_id = ?", (time.time(), batch_id)
+        )
+
+    def progress(self, batch_id):
+        rows = self._conn().execute(
+            "SELECT item_index, status, pdf_url, error, updated_at FROM label_batch_items "
+            "WHERE batch_id = ? ORDER BY item_index",
+            (batch_id,)
+        ).fetchall()
+        return [
+            {"index": index, "status": status, "pdfUrl": pdf_url, "error": error, "updatedAt": updated_at}
+            for index, status, pdf_url, error, updated_at in rows
+        ]
+
+    def purge(self):
+        cutoff = time.time() - self.retention
+        conn = self._conn()
+        conn.execute("DELETE FROM label_batch_items WHERE updated_at < ?", (cutoff,))
+        conn.execute("DELETE FROM label_batches WHERE updated_at < ?", (cutoff,))
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import threading
+import time
+
+from webhook_queue import connect
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    session_id TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    source_url TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class LabelStore:
+    """Local copies of Mondial Relay label PDFs.
+
+    Each PDF is downloaded once, written under its SHA-256 (identical files
+    are stored once) and indexed by checkout session id.
+    """
+
+    def __init__(self, directory, client, max_bytes=5 * 1024 * 1024):
+        self.directory = directory
+        self.client = client
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+        os.makedirs(directory, exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = connect(os.path.join(self.directory, 'labels.db'))
+            self._local.pid = os.getpid()
+        return conn
+
+    def path_for(self, digest):
+        return os.path.join(self.directory, f"{digest}.pdf")
+
+    def fetch_and_store(self, session_id, url):
+        response = self.client.get(url, operation='label_pdf')
+        if response.status_code != 200:
+            raise Exception(f"Label download failed: HTTP {response.status_code}")
+        content = response.content
+        if not content.startswith(b'%PDF'):
+            raise Exception("Label download did not return a PDF")
+        if len(content) > self.max_bytes:
+            raise Exception(f"Label PDF too large ({len(content)} bytes)")
+
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.path_for(digest)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+        self._conn().execute(
+            "INSERT OR REPLACE INTO labels (session_id, sha256, size, source_url, created_at) VALUES (?, ?, ?, ?, ?)",
+            (session_id, digest, len(content), url, time.time())
+        )
+        return digest
+
+    def lookup(self, session_id):
+        row = self._conn().execute(
+            "SELECT sha256, size FROM labels WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None or not os.path.exists(self.path_for(row[0])):
+            return None
+        return {"sha256": row[0], "size": row[1], "path": self.path_for(row[0])}
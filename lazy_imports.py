@@ -0,0 +1,77 @@
+import importlib
+import threading
+import time
+
+_LOCK = threading.RLock()
+_REGISTRY = []
+_MODULES = []
+LOAD_TIMES = {}  # name -> seconds spent importing/building it
+
+
+class LazyValue:
+    """Builds a value once, on first use, thread-safely.
+
+    The time spent in `factory` is recorded in LOAD_TIMES so startup costs
+    show up in `report()`.
+    """
+
+    _UNSET = object()
+
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._value = self._UNSET
+        _REGISTRY.append(self)
+
+    @property
+    def loaded(self):
+        return self._value is not self._UNSET
+
+    def get(self):
+        if self._value is self._UNSET:
+            # RLock: a factory may itself touch another lazy value
+            with _LOCK:
+                if self._value is self._UNSET:
+                    started = time.perf_counter()
+                    value = self._factory()
+                    LOAD_TIMES[self.name] = time.perf_counter() - started
+                    print(f"✅ Loaded {self.name} in {1000 * LOAD_TIMES[self.name]:.1f} ms")
+                    self._value = value
+        return self._value
+
+
+class LazyModule:
+    """Module proxy: the import happens on first attribute access.
+
+    `on_load(module)` runs once, before any caller sees the module (used to
+    configure stripe's API key).
+    """
+
+    def __init__(self, name, on_load=None):
+        def load():
+            module = importlib.import_module(name)
+            if on_load is not None:
+                on_load(module)
+            return module
+        object.__setattr__(self, '_lazy', LazyValue(name, load))
+        _MODULES.append(self._lazy)
+
+    def __getattr__(self, attr):
+        return getattr(self._lazy.get(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._lazy.get(), attr, value)
+
+
+def preload():
+    # Imports every lazy module up front (e.g. in a preloading gunicorn master,
+    # so forked workers share them). Clients are left to each worker.
+    for lazy in list(_MODULES):
+        lazy.get()
+
+
+def report():
+    return {
+        "loadedMs": {name: round(1000 * seconds, 1) for name, seconds in LOAD_TIMES.items()},
+        "pending": [lazy.name for lazy in _REGISTRY if not lazy.loaded],
+    }
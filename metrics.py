@@ -0,0 +1,102 @@
+import os
+import re
+import time
+
+from flask import g, request
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import REGISTRY, multiprocess
+
+from circuit_breaker import CircuitOpenError
+
+# Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+# (see gunicorn.conf.py) and /metrics aggregates them on each scrape
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HTTP_REQUESTS = Counter(
+    'http_requests_total', "HTTP requests handled, by route and status",
+    ['method', 'route', 'status']
+)
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', "Time spent handling HTTP requests",
+    ['method', 'route'], buckets=LATENCY_BUCKETS
+)
+UPSTREAM_REQUESTS = Counter(
+    'upstream_requests_total', "Outbound calls, by upstream, operation and outcome",
+    ['upstream', 'operation', 'status']
+)
+UPSTREAM_REQUEST_DURATION = Histogram(
+    'upstream_request_duration_seconds', "Time spent in outbound calls (retries included)",
+    ['upstream', 'operation'], buckets=LATENCY_BUCKETS
+)
+
+# Object ids in API paths (acct_1Nv0..., cs_test_a1B2...) are folded into {id}
+_ID_SEGMENT_RE = re.compile(r'/[a-z]+_(?:test_|live_)?(?=[A-Za-z0-9]*\d)[A-Za-z0-9]+(?=/|$)')
+
+
+def normalize_path(path):
+    return _ID_SEGMENT_RE.sub('/{id}', path)
+
+
+def observe_request(method, route, status, seconds):
+    HTTP_REQUESTS.labels(method, route, str(status)).inc()
+    HTTP_REQUEST_DURATION.labels(method, route).observe(seconds)
+
+
+def observe_upstream(upstream, operation, status, seconds):
+    UPSTREAM_REQUESTS.labels(upstream, operation, str(status)).inc()
+    UPSTREAM_REQUEST_DURATION.labels(upstream, operation).observe(seconds)
+
+
+class upstream_call:
+    """Times one outbound call: `with upstream_call('supabase', 'profiles.select') as call:`.
+
+    Set `call.status` (an HTTP status or 'ok'/'error') inside the block;
+    an exception escaping the block is recorded as 'error', or as
+    'circuit_open' when a circuit breaker refused the call.
+    """
+
+    def __init__(self, upstream, operation):
+        self.upstream = upstream
+        self.operation = operation
+        self.status = 'ok'
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            status = self.status
+        else:
+            status = 'circuit_open' if issubclass(exc_type, CircuitOpenError) else 'error'
+        observe_upstream(self.upstream, self.operation, status, time.perf_counter() - self._start)
+        return False
+
+
+def init_app(app):
+    # Per-route counters and latency, labelled with the URL rule (/api/labels/<session_id>)
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            observe_request(request.method, route, response.status_code, time.perf_counter() - start)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_route():
+        return app.response_class(render(), content_type=CONTENT_TYPE_LATEST)
+
+
+def render():
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -0,0 +1,234 @@
+import collections
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from flask import g, jsonify, request
+
+# Opt-in sampling profiler: a profiled request's thread is sampled every
+# PROFILE_INTERVAL_MS from a background thread (sys._current_frames), so the
+# request itself runs unmodified. Off unless PROFILE_TOKEN is set.
+# Samples are kept per process: with several gunicorn workers, each one
+# answers the admin endpoint with its own share.
+# Not usable under the gevent worker class: greenlets share one OS thread.
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))  # 0.01 = 1 % des requêtes
+PROFILE_HEADER = os.getenv('PROFILE_HEADER', 'X-Profile')
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL_MS', 5)) / 1000
+PROFILE_MAX_STACKS = int(os.getenv('PROFILE_MAX_STACKS', 2000))  # distinct stacks per route
+PROFILE_RECENT_REQUESTS = int(os.getenv('PROFILE_RECENT_REQUESTS', 50))
+MAX_DEPTH = 128
+
+# Frames from these modules only add noise on top of every stack
+SKIPPED_MODULE_PREFIXES = ('threading', 'concurrent.futures.thread', 'gunicorn.', 'socketserver')
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{code.co_name}"
+
+
+def collapse(frame):
+    # Stack as "root;...;leaf", the collapsed format of flamegraph.pl and speedscope
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        if not frame.f_globals.get('__name__', '').startswith(SKIPPED_MODULE_PREFIXES):
+            labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Profile:
+    """Collapsed-stack sample counts with a cap on distinct stacks."""
+
+    def __init__(self, max_stacks):
+        self.max_stacks = max_stacks
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.requests = 0
+        self.seconds = 0.0
+        self.started = time.perf_counter()
+
+    def add(self, stack, count=1):
+        self.samples += count
+        if stack in self.stacks or len(self.stacks) < self.max_stacks:
+            self.stacks[stack] += count
+        else:
+            self.stacks['[other]'] += count
+
+    def merge(self, other):
+        for stack, count in other.stacks.items():
+            self.add(stack, count)
+        self.requests += 1
+        self.seconds += other.seconds
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top=10):
+        return {
+            "requests": self.requests,
+            "samples": self.samples,
+            "seconds": round(self.seconds, 3),
+            "top": [{"stack": stack, "samples": count} for stack, count in self.stacks.most_common(top)],
+        }
+
+
+class SamplingProfiler:
+    """Samples registered threads and aggregates their stacks per route."""
+
+    def __init__(self, interval=PROFILE_INTERVAL, max_stacks=PROFILE_MAX_STACKS, recent=PROFILE_RECENT_REQUESTS):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.lock = threading.Lock()
+        self.active = {}  # thread id -> Profile of the running request
+        self.routes = {}  # route -> aggregated Profile
+        self.recent = collections.OrderedDict()  # profile id -> (route, Profile)
+        self.recent_max = recent
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self, thread_id):
+        profile = Profile(self.max_stacks)
+        with self.lock:
+            self.active[thread_id] = profile
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True, name='profiler')
+                self.thread.start()
+        self.wakeup.set()
+        return profile
+
+    def stop(self, thread_id, route):
+        with self.lock:
+            profile = self.active.pop(thread_id, None)
+            if profile is None:
+                return None
+            profile.seconds = time.perf_counter() - profile.started
+            self.routes.setdefault(route, Profile(self.max_stacks)).merge(profile)
+            profile_id = uuid.uuid4().hex[:12]
+            self.recent[profile_id] = (route, profile)
+            while len(self.recent) > self.recent_max:
+                self.recent.popitem(last=False)
+        return profile_id
+
+    def discard(self, thread_id):
+        with self.lock:
+            self.active.pop(thread_id, None)
+
+    def run(self):
+        # Sleeps on the event while no request is being profiled
+        while True:
+            with self.lock:
+                thread_ids = list(self.active)
+            if not thread_ids:
+                self.wakeup.clear()
+                self.wakeup.wait()
+                continue
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id in thread_ids:
+                    profile = self.active.get(thread_id)
+                    frame = frames.get(thread_id)
+                    if profile is not None and frame is not None:
+                        profile.add(collapse(frame))
+            del frames
+            time.sleep(self.interval)
+
+    def report(self, route=None, profile_id=None):
+        # Profile to serve, or None: one recent request, one route, or all routes merged
+        with self.lock:
+            if profile_id:
+                entry = self.recent.get(profile_id)
+                return entry[1] if entry else None
+            if route:
+                return self.routes.get(route)
+            merged = Profile(self.max_stacks)
+            for name, profile in self.routes.items():
+                for stack, count in profile.stacks.items():
+                    merged.stacks[f"{name};{stack}"] += count
+                merged.samples += profile.samples
+                merged.requests += profile.requests
+                merged.seconds += profile.seconds
+            return merged
+
+    def stats(self):
+        with self.lock:
+            return {
+                "routes": {route: profile.summary(top=3) for route, profile in self.routes.items()},
+                "recent": [
+                    {"id": profile_id, "route": route, "samples": profile.samples, "seconds": round(profile.seconds, 3)}
+                    for profile_id, (route, profile) in reversed(self.recent.items())
+                ],
+            }
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+            self.recent.clear()
+
+
+PROFILER = SamplingProfiler()
+
+
+def authorized(value):
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(value or '', PROFILE_TOKEN)
+
+
+def should_profile():
+    # A PROFILE_HEADER carrying the token forces profiling of this request
+    if authorized(request.headers.get(PROFILE_HEADER)):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def init_app(app):
+    if not PROFILE_TOKEN:
+        return
+
+    @app.before_request
+    def start_profile():
+        if request.endpoint in ('profile_route', 'metrics_route') or not should_profile():
+            return
+        g.profile_thread = threading.get_ident()
+        PROFILER.start(g.profile_thread)
+
+    @app.after_request
+    def finish_profile(response):
+        thread_id = g.pop('profile_thread', None)
+        if thread_id is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            profile_id = PROFILER.stop(thread_id, f"{request.method} {route}")
+            if profile_id:
+                response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    @app.teardown_request
+    def discard_profile(exc):
+        # Request aborted before after_request: do not leave the thread registered
+        thread_id = g.pop('profile_thread', None)
+        if thread_id is not None:
+            PROFILER.discard(thread_id)
+
+    # GET: collapsed stacks (text/plain, one "frame;frame count" line per stack)
+    #   ?route=POST /api/get-relay-points  one route
+    #   ?id=<X-Profile-Id>                  one profiled request
+    #   ?format=json                        per-route summary and recent requests
+    # DELETE: clears the collected samples
+    @app.route('/api/admin/profile', methods=['GET', 'DELETE'])
+    def profile_route():
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme != 'Bearer' or not authorized(token):
+            return jsonify({"error": "Unauthorized"}), 401
+        if request.method == 'DELETE':
+            PROFILER.reset()
+            return jsonify({"status": "reset"})
+        if request.args.get('format') == 'json':
+            return jsonify(PROFILER.stats())
+        profile = PROFILER.report(route=request.args.get('route'), profile_id=request.args.get('id'))
+        if profile is None:
+            return jsonify({"error": "Profile not found"}), 404
+        return app.response_class(profile.collapsed(), content_type='text/plain; charset=utf-8')
@@ -0,0 +1,157 @@
+import heapq
+import itertools
+import math
+import random
+import threading
+import time
+
+# Lower value = served first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+def backoff_seconds(response_headers, attempt):
+    # After a 429: Retry-After when the upstream sends one, else jittered exponential backoff
+    try:
+        return float(response_headers['Retry-After'])
+    except (KeyError, TypeError, ValueError):
+        return min(8.0, 0.5 * 2 ** attempt) * random.uniform(1, 1.5)
+
+
+class RateLimitExceeded(Exception):
+    # Pas de jeton obtenu à temps (ou file pleine) ; retry_after en secondes
+    def __init__(self, name, retry_after):
+        super().__init__(f"Rate limit {name} reached, retry in {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket with a bounded, priority-ordered wait queue.
+
+    Refills at `rate` tokens per second, up to `burst`. Callers that find
+    the bucket empty wait by priority (FIFO within a level). A caller is
+    refused with RateLimitExceeded when its expected wait is over `max_wait`
+    seconds, or when `max_queue` callers are already waiting. `throttle`
+    (after an upstream 429) empties and pauses the bucket and halves the
+    rate; the rate then climbs back to `rate` over `recovery` seconds.
+    """
+
+    def __init__(self, name, rate, burst=None, max_queue=100, max_wait=5.0, recovery=30.0):
+        self.name = name
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.recovery = recovery
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._current_rate = rate
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []  # heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self.granted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if self._current_rate < self.rate:
+            self._current_rate = min(self.rate, self._current_rate + self.rate * elapsed / self.recovery)
+        # No tokens accrue while paused
+        start = max(self._updated, self._paused_until)
+        if now > start:
+            self._tokens = min(self.burst, self._tokens + (now - start) * self._current_rate)
+        self._updated = now
+
+    def _delay(self, now, ahead=0):
+        # Seconds until a caller with `ahead` waiters in front of it gets a token
+        missing = max(0.0, ahead + 1 - self._tokens)
+        return max(0.0, self._paused_until - now) + missing / self._current_rate
+
+    def _reject(self, now):
+        self.rejected += 1
+        return RateLimitExceeded(self.name, max(1, math.ceil(self._delay(now, len(self._waiters)))))
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        # Blocks until a token is taken; returns the seconds spent waiting
+        now = time.monotonic()
+        with self._cond:
+            self._refill(now)
+            if not self._waiters and self._tokens >= 1:
+                self._tokens -= 1
+                self.granted += 1
+                return 0.0
+
+            entry = (priority, next(self._sequence))
+            ahead = sum(1 for waiter in self._waiters if waiter < entry)
+            if len(self._waiters) >= self.max_queue or self._delay(now, ahead) > self.max_wait:
+                raise self._reject(now)
+
+            heapq.heappush(self._waiters, entry)
+            self.queued += 1
+            started = now
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiters[0] == entry and self._tokens >= 1:
+                        self._tokens -= 1
+                        self.granted += 1
+                        self.wait_seconds += now - started
+                        return now - started
+                    if now - started >= self.max_wait:
+                        raise self._reject(now)
+                    timeout = self.max_wait - (now - started)
+                    if self._waiters[0] == entry:
+                        timeout = min(timeout, self._delay(now))
+                    self._cond.wait(timeout)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def try_acquire(self, priority=PRIORITY_NORMAL):
+        # Non-blocking variant for asyncio callers: 0 when a token was taken,
+        # otherwise the seconds to sleep before trying again
+        now = time.monotonic()
+        with self._cond:
+            self._refill(now)
+            ahead = sum(1 for waiter in self._waiters if waiter[0] <= priority)
+            if not ahead and self._tokens >= 1:
+                self._tokens -= 1
+                self.granted += 1
+                return 0.0
+            return max(0.01, self._delay(now, ahead))
+
+    def throttle(self, delay):
+        # The upstream answered 429: stop for `delay` seconds, then resume at half rate
+        now = time.monotonic()
+        with self._cond:
+            self._refill(now)
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, now + delay)
+            self._current_rate = max(self.rate / 10, self._current_rate / 2)
+            self.throttled += 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                "rate": self.rate,
+                "currentRate": round(self._current_rate, 2),
+                "tokens": round(self._tokens, 2),
+                "pausedFor": round(max(0.0, self._paused_until - now), 3),
+                "waiting": len(self._waiters),
+                "granted": self.granted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "throttled": self.throttled,
+                "avgWaitMs": round(1000 * self.wait_seconds / self.queued, 2) if self.queued else 0.0,
+            }
@@ -0,0 +1,241 @@
+import csv
+import heapq
+import json
+import math
+import os
+import threading
+import time
+from array import array
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def _to_xyz(lat, lon):
+    # Points on the unit sphere: chord distance is monotonic with great-circle distance
+    lat_r = math.radians(lat)
+    lon_r = math.radians(lon)
+    cos_lat = math.cos(lat_r)
+    return cos_lat * math.cos(lon_r), cos_lat * math.sin(lon_r), math.sin(lat_r)
+
+
+def _chord_to_meters(chord_sq):
+    chord = math.sqrt(chord_sq)
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, chord / 2))
+
+
+class _KDIndex:
+    """Immutable implicit k-d tree over unit-sphere coordinates.
+
+    Coordinates live in flat `array('d')` buffers and the tree is the
+    median-split permutation in `order`; node [lo, hi) is at (lo + hi) // 2.
+    """
+
+    def __init__(self, ids, coords):
+        n = len(ids)
+        self.ids = ids
+        self.xyz = (array('d', bytes(8 * n)), array('d', bytes(8 * n)), array('d', bytes(8 * n)))
+        for i, (lat, lon) in enumerate(coords):
+            x, y, z = _to_xyz(lat, lon)
+            self.xyz[0][i] = x
+            self.xyz[1][i] = y
+            self.xyz[2][i] = z
+        self.order = array('i', range(n))
+        self._build(0, n, 0)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _build(self, lo, hi, depth):
+        stack = [(lo, hi, depth)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if hi - lo <= 1:
+                continue
+            axis = self.xyz[depth % 3]
+            self.order[lo:hi] = array('i', sorted(self.order[lo:hi], key=axis.__getitem__))
+            mid = (lo + hi) // 2
+            stack.append((lo, mid, depth + 1))
+            stack.append((mid + 1, hi, depth + 1))
+
+    def nearest(self, lat, lon, k):
+        if not self.ids or k <= 0:
+            return []
+        q = _to_xyz(lat, lon)
+        xs, ys, zs = self.xyz
+        heap = []  # max-heap of (-dist_sq, idx)
+        stack = [(0, len(self.ids), 0, 0.0)]
+        while stack:
+            lo, hi, depth, bound = stack.pop()
+            if lo >= hi or (len(heap) == k and bound >= -heap[0][0]):
+                continue
+            mid = (lo + hi) // 2
+            idx = self.order[mid]
+            d = (xs[idx] - q[0]) ** 2 + (ys[idx] - q[1]) ** 2 + (zs[idx] - q[2]) ** 2
+            if len(heap) < k:
+                heapq.heappush(heap, (-d, idx))
+            elif d < -heap[0][0]:
+                heapq.heapreplace(heap, (-d, idx))
+
+            diff = q[depth % 3] - self.xyz[depth % 3][idx]
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            # Far side is pushed first so the near side is searched first;
+            # it is pruned on pop once the heap holds k closer points
+            stack.append((far[0], far[1], depth + 1, diff * diff))
+            stack.append((near[0], near[1], depth + 1, bound))
+        return sorted((-neg_d, idx) for neg_d, idx in heap)
+
+
+class RelayPointStore:
+    """Local relay-point dataset with a nearest-K spatial query.
+
+    Points come from a bulk JSON/JSONL import and from every successful
+    Mondial Relay search; the index is rebuilt in the background and the
+    accumulated dataset is snapshotted back to `path`.
+    """
+
+    def __init__(self, path=None, centroids_path=None, refresh_interval=300):
+        self.path = path
+        self.centroids_path = centroids_path
+        self.refresh_interval = refresh_interval
+        self._points = {}
+        self._imported_centroids = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._unsaved = False
+        self._dataset_mtime = None
+        self._index = _KDIndex([], [])
+        self._centroids = {}
+        self._thread_pid = None
+        self._start_lock = threading.Lock()
+        self.last_refresh = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def start(self):
+        # Idempotent, and restarted after a fork (threads don't survive it).
+        # The first load runs in the background thread, not in the caller's request
+        with self._start_lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            threading.Thread(target=self._refresh_loop, daemon=True, name='relay-store').start()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing relay point store: {e}")
+            time.sleep(self.refresh_interval)
+
+    def add_points(self, points, persist=True):
+        with self._lock:
+            for point in points:
+                if point.get('latitude') is None or point.get('longitude') is None:
+                    continue
+                if str(point.get('id', '')).startswith('unknown-'):
+                    continue
+                self._points[point['id']] = dict(point)
+                self._dirty = True
+                self._unsaved = self._unsaved or persist
+
+    def refresh(self):
+        loaded = self._load_dataset()
+        if self._imported_centroids == {} and self.centroids_path:
+            self._imported_centroids = self._load_centroids()
+
+        with self._lock:
+            if not loaded and not self._dirty and self.last_refresh is not None:
+                return False
+            points = list(self._points.values())
+            save = self._unsaved
+            self._dirty = False
+            self._unsaved = False
+
+        ids = [p['id'] for p in points]
+        coords = [(p['latitude'], p['longitude']) for p in points]
+        index = _KDIndex(ids, coords)
+
+        sums = {}
+        for p in points:
+            acc = sums.setdefault(p.get('postalCode'), [0.0, 0.0, 0])
+            acc[0] += p['latitude']
+            acc[1] += p['longitude']
+            acc[2] += 1
+        centroids = {cp: (lat / n, lon / n) for cp, (lat, lon, n) in sums.items() if cp}
+        centroids.update(self._imported_centroids)
+
+        self._index = index
+        self._centroids = centroids
+        self.last_refresh = time.time()
+        if save:
+            self._save_dataset(points)
+        return True
+
+    def _load_dataset(self):
+        if not self.path or not os.path.exists(self.path):
+            return False
+        mtime = os.path.getmtime(self.path)
+        if mtime == self._dataset_mtime:
+            return False
+        with open(self.path, encoding='utf-8') as f:
+            if self.path.endswith('.jsonl'):
+                points = [json.loads(line) for line in f if line.strip()]
+            else:
+                points = json.load(f)
+        self._dataset_mtime = mtime
+        self.add_points(points, persist=False)
+        print(f"✅ Loaded {len(points)} relay points from {self.path}")
+        return True
+
+    def _save_dataset(self, points):
+        if not self.path or self.path.endswith('.jsonl'):
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(points, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._dataset_mtime = os.path.getmtime(self.path)
+        except OSError as e:
+            print(f"Error saving relay point store: {e}")
+
+    def _load_centroids(self):
+        # CSV lines: postal_code,latitude,longitude
+        if not os.path.exists(self.centroids_path):
+            return {}
+        centroids = {}
+        with open(self.centroids_path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                try:
+                    centroids[row[0].strip()] = (float(row[1]), float(row[2]))
+                except (IndexError, ValueError):
+                    continue
+        return centroids
+
+    def centroid(self, postal_code):
+        return self._centroids.get(postal_code)
+
+    def nearest(self, latitude=None, longitude=None, postal_code=None, k=20):
+        if latitude is None or longitude is None:
+            centroid = self.centroid(postal_code)
+            if centroid is None:
+                return []
+            latitude, longitude = centroid
+
+        index = self._index
+        results = []
+        for dist_sq, idx in index.nearest(latitude, longitude, k):
+            point = dict(self._points[index.ids[idx]])
+            point['distance'] = round(_chord_to_meters(dist_sq))
+            results.append(point)
+        return results
+
+    def stats(self):
+        return {
+            "points": len(self._index),
+            "pending": len(self._points) - len(self._index),
+            "postalCodes": len(self._centroids),
+            "lastRefresh": self.last_refresh,
+        }
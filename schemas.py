@@ -0,0 +1,140 @@
+import math
+
+
+class ValidationError(Exception):
+    # Requête invalide, renvoyée au client en 400
+    pass
+
+
+def _as_str(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise TypeError
+
+
+def _as_int(value):
+    if isinstance(value, bool):
+        raise TypeError
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        return int(value.strip())
+    raise TypeError
+
+
+def _as_float(value):
+    if isinstance(value, bool):
+        raise TypeError
+    if isinstance(value, (int, float)):
+        result = float(value)
+    elif isinstance(value, str):
+        result = float(value.strip())
+    else:
+        raise TypeError
+    if not math.isfinite(result):
+        raise ValueError
+    return result
+
+
+def _as_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ('true', 'false', '1', '0'):
+        return value.lower() in ('true', '1')
+    if value in (0, 1):
+        return bool(value)
+    raise TypeError
+
+
+def _as_type(expected):
+    def coerce(value):
+        if not isinstance(value, expected):
+            raise TypeError
+        return value
+    return coerce
+
+
+COERCERS = {
+    str: (_as_str, 'string'),
+    int: (_as_int, 'integer'),
+    float: (_as_float, 'number'),
+    bool: (_as_bool, 'boolean'),
+    dict: (_as_type(dict), 'object'),
+    list: (_as_type(list), 'array'),
+    None: (lambda value: value, 'value'),
+}
+
+
+class Field:
+    """One entry of a Schema. `type=None` accepts any JSON value as is."""
+
+    def __init__(self, type=str, required=True, default=None, allow_empty=True,
+                 min_value=None, max_value=None, schema=None):
+        self.type = dict if schema is not None else type
+        self.required = required
+        self.default = default
+        self.allow_empty = allow_empty
+        self.min_value = min_value
+        self.max_value = max_value
+        self.schema = schema
+
+
+class Schema:
+    """Declarative request schema, compiled once into a validator.
+
+    Calling the schema on a request body returns a copy with every declared
+    field coerced to its type (unknown keys are kept) or raises
+    ValidationError naming the first offending field.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self._checks = tuple(self._compile(name, field) for name, field in fields.items())
+
+    @staticmethod
+    def _compile(name, field):
+        coerce, type_name = COERCERS[field.type]
+        required = field.required
+        default = field.default
+        allow_empty = field.allow_empty
+        min_value = field.min_value
+        max_value = field.max_value
+        nested = field.schema
+
+        def check(data, result, prefix):
+            value = data.get(name)
+            if value is None or (not allow_empty and value in ('', [], {})):
+                if required:
+                    raise ValidationError(f"Missing required field: {prefix}{name}")
+                if default is not None:
+                    result[name] = default
+                return
+            try:
+                value = coerce(value)
+            except (TypeError, ValueError):
+                raise ValidationError(f"Invalid field {prefix}{name}: expected {type_name}") from None
+            if not allow_empty and value in ('', [], {}):
+                raise ValidationError(f"Missing required field: {prefix}{name}")
+            if min_value is not None and value < min_value:
+                raise ValidationError(f"Invalid field {prefix}{name}: must be >= {min_value}")
+            if max_value is not None and value > max_value:
+                raise ValidationError(f"Invalid field {prefix}{name}: must be <= {max_value}")
+            if nested is not None:
+                value = nested.validate(value, f"{prefix}{name}.")
+            result[name] = value
+
+        return check
+
+    def validate(self, data, prefix=''):
+        if not isinstance(data, dict):
+            raise ValidationError(f"{prefix[:-1] or 'Request body'} must be a JSON object")
+        result = dict(data)
+        for check in self._checks:
+            check(data, result, prefix)
+        return result
+
+    __call__ = validate
@@ -1,113 +1,343 @@
-import os
-import json
 import time
+IMPORT_STARTED = time.perf_counter()
+import os
+import io
 import uuid
 import hashlib
+import hmac
+import threading
 import traceback
-from flask import Flask, request, jsonify, send_from_directory
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Blueprint, Request, current_app, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
-import stripe
 from dotenv import load_dotenv
-import requests
 from werkzeug.utils import secure_filename
 import tempfile
-import xml.etree.ElementTree as ET
-import supabase
+import mimetypes
+import lazy_imports
+import metrics
+import profiler
+from lazy_imports import LazyModule, LazyValue
+from cache import TTLCache
+from relay_store import RelayPointStore
+from http_client import OutboundClient
+from webhook_queue import WebhookQueue, RetryLater
+from circuit_breaker import CircuitOpenError
+from rate_limiter import TokenBucket, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from image_processing import DocumentCompressor
+from label_batches import LabelBatchStore, payload_hash
+from label_store import LabelStore
+from static_assets import StaticAssets
+from event_store import EventStore, DONE, BUSY
+from schemas import ValidationError, Schema, Field
+import json_provider
+from fees import to_cents, seller_fees, quote_cents, FIXED_FEE_CENTS, SHIPPING_CENTS
+from json_provider import FastJSONProvider
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Stripe with API key from .env
-stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
-stripe.api_version = '2023-10-16'
-
 # Verify API key
-if not stripe.api_key or not stripe.api_key.startswith('sk_'):
+STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
+if not STRIPE_SECRET_KEY or not STRIPE_SECRET_KEY.startswith('sk_'):
     print("❌ Error: Invalid or missing Stripe API key.")
 else:
-    print(f"✅ Stripe API key detected: {stripe.api_key[:4]}************")
+    print(f"✅ Stripe API key detected: {STRIPE_SECRET_KEY[:4]}************")
+
+# Stripe-compatible stub (benchmarks/stubs.py) instead of api.stripe.com
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')
+
+# Rate limit Stripe (par compte, tous processus confondus) : 100 lectures/s et
+# 100 écritures/s en live, 25 en test. Budgets par défaut avec de la marge,
+# partagés entre les workers gunicorn (STRIPE_LIMIT_PROCESSES, voir gunicorn.conf.py)
+STRIPE_LIVE_MODE = (STRIPE_SECRET_KEY or '').startswith(('sk_live', 'rk_live'))
+STRIPE_LIMIT_PROCESSES = max(1, int(os.getenv('STRIPE_LIMIT_PROCESSES', 1)))
+STRIPE_READ_LIMITER = TokenBucket(
+    'stripe_read',
+    rate=float(os.getenv('STRIPE_READ_RATE', 80 if STRIPE_LIVE_MODE else 20)) / STRIPE_LIMIT_PROCESSES,
+    max_queue=int(os.getenv('STRIPE_LIMIT_MAX_QUEUE', 100)),
+    max_wait=float(os.getenv('STRIPE_LIMIT_MAX_WAIT', 5))
+)
+STRIPE_WRITE_LIMITER = TokenBucket(
+    'stripe_write',
+    rate=float(os.getenv('STRIPE_WRITE_RATE', 80 if STRIPE_LIVE_MODE else 20)) / STRIPE_LIMIT_PROCESSES,
+    max_queue=int(os.getenv('STRIPE_LIMIT_MAX_QUEUE', 100)),
+    max_wait=float(os.getenv('STRIPE_LIMIT_MAX_WAIT', 5))
+)
+
+def stripe_limiter(method, path):
+    # (budget, priorité) d'un appel Stripe : le checkout passe avant tout,
+    # le polling de statut des comptes (check-stripe-status) en dernier
+    if method == 'GET':
+        priority = PRIORITY_LOW if path.startswith('/v1/accounts/') else PRIORITY_NORMAL
+        return STRIPE_READ_LIMITER, priority
+    priority = PRIORITY_HIGH if path == '/v1/checkout/sessions' else PRIORITY_NORMAL
+    return STRIPE_WRITE_LIMITER, priority
+
+# stripe, supabase and the XML parser are imported on first use, so workers
+# that only serve static files or relay points never pay for them
+def configure_stripe(module):
+    import stripe_http
+    module.api_key = STRIPE_SECRET_KEY
+    module.api_version = '2023-10-16'
+    module.default_http_client = stripe_http.InstrumentedRequestsClient(
+        limiter=stripe_limiter,
+        rate_limit_retries=int(os.getenv('STRIPE_RATE_LIMIT_RETRIES', 3))
+    )
+    if STRIPE_API_BASE:
+        module.api_base = STRIPE_API_BASE
+        module.upload_api_base = STRIPE_API_BASE
+
+stripe = LazyModule('stripe', on_load=configure_stripe)
+ET = LazyModule('xml.etree.ElementTree')
 
 # Initialize Supabase
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
 if not SUPABASE_URL or not SUPABASE_KEY:
     print("❌ Error: Missing Supabase environment variables.")
-    supabase_client = None
-else:
-    supabase_client = supabase.create_client(SUPABASE_URL, SUPABASE_KEY)
-    print("✅ Supabase client initialized")
 
-# Initialize Flask app
-app = Flask(__name__, static_folder='dist', static_url_path='/')
-CORS(app, resources={r"/*": {"origins": "*"}})
+supabase = LazyModule('supabase')
+
+def create_supabase_client():
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        return None
+    return supabase.create_client(SUPABASE_URL, SUPABASE_KEY)
+
+SUPABASE_CLIENT = LazyValue('supabase_client', create_supabase_client)
 
-# Mondial Relay API credentials
-MONDIAL_RELAY_API_URL = 'https://connect-api.mondialrelay.com/api/Shipment'
+def supabase_execute(table, operation, query):
+    # Exécute une requête Supabase en la chronométrant (métriques par table)
+    with metrics.upstream_call('supabase', f"{table}.{operation}") as call:
+        response = query.execute()
+        if getattr(response, 'error', None):
+            call.status = 'error'
+    return response
+
+# Routes are registered on a blueprint; the Flask app itself is built by create_app()
+bp = Blueprint('shay', __name__)
+
+# Mondial Relay API credentials (URLs overridable for the benchmarks/ stubs)
+MONDIAL_RELAY_API_URL = os.getenv('MONDIAL_RELAY_API_URL', 'https://connect-api.mondialrelay.com/api/Shipment')
+MONDIAL_RELAY_SOAP_URL = os.getenv('MONDIAL_RELAY_SOAP_URL', 'https://api.mondialrelay.com/Web_Services.asmx')
 MONDIAL_RELAY_BRAND_ID = os.getenv('MONDIALRELAY_BRAND_ID', 'CC22UCDZ')
 MONDIAL_RELAY_API_LOGIN = os.getenv('MONDIALRELAY_API_LOGIN', 'CC22UCDZ@business-api.mondialrelay.com')
 MONDIAL_RELAY_API_PASSWORD = os.getenv('MONDIALRELAY_API_PASSWORD', '@YeVkNvuZ*py]nSB7:Dq')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
 
-# Temporary directory for file uploads
-UPLOAD_FOLDER = tempfile.gettempdir()
+# Répertoire des données locales (files d'attente, bases SQLite)
+DATA_DIR = os.getenv('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+
+# Événements et sessions Stripe déjà traités (idempotence des webhooks)
+EVENT_STORE = EventStore(
+    path=os.getenv('WEBHOOK_EVENT_STORE_PATH', os.path.join(DATA_DIR, 'webhook_events.db')),
+    retention=int(os.getenv('WEBHOOK_EVENT_RETENTION', 30 * 86400))
+)
+
+# Client HTTP partagé (keep-alive, timeouts, retries) pour les appels Mondial Relay
+MONDIAL_RELAY_CLIENT = OutboundClient(
+    pool_size=int(os.getenv('MONDIAL_RELAY_POOL_SIZE', 20)),
+    connect_timeout=float(os.getenv('MONDIAL_RELAY_CONNECT_TIMEOUT', 3.05)),
+    read_timeout=float(os.getenv('MONDIAL_RELAY_READ_TIMEOUT', 15)),
+    max_retries=int(os.getenv('MONDIAL_RELAY_MAX_RETRIES', 2)),
+    name='mondial_relay',
+    # Coupe-circuit par opération : échec immédiat pendant une panne
+    breaker_threshold=int(os.getenv('MONDIAL_RELAY_BREAKER_THRESHOLD', 5)),
+    breaker_reset_timeout=float(os.getenv('MONDIAL_RELAY_BREAKER_RESET_TIMEOUT', 30))
+)
+
+# Cache des points relais, indexé par (pays, code postal, nombre de résultats)
+RELAY_POINTS_DEFAULT_LIMIT = 20
+RELAY_POINTS_MAX_LIMIT = 30
+RELAY_POINTS_CACHE = TTLCache(
+    maxsize=int(os.getenv('RELAY_CACHE_SIZE', 5000)),
+    ttl=int(os.getenv('RELAY_CACHE_TTL', 6 * 3600)),
+    stale_ttl=int(os.getenv('RELAY_CACHE_STALE_TTL', 18 * 3600)),
+    name='relay_points'
+)
+
+# Cache du statut des comptes Stripe (check-stripe-status est interrogé en boucle).
+# Cache propre à chaque worker : un webhook account.updated ne met à jour que
+# le worker qui le reçoit, les autres peuvent servir un statut périmé pendant
+# au plus ACCOUNT_STATUS_CACHE_TTL secondes
+ACCOUNT_STATUS_CACHE = TTLCache(
+    maxsize=int(os.getenv('ACCOUNT_STATUS_CACHE_SIZE', 10000)),
+    ttl=int(os.getenv('ACCOUNT_STATUS_CACHE_TTL', 120)),
+    name='account_status'
+)
+
+# Jeton des routes d'administration (Authorization: Bearer <ADMIN_TOKEN>),
+# vérifié comme celui du profileur ; sans jeton configuré ces routes répondent 401
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+# Vérification de statut en lot (admin) : pool partagé, plafonné pour respecter le rate limit Stripe
+STRIPE_BATCH_MAX_ACCOUNTS = int(os.getenv('STRIPE_BATCH_MAX_ACCOUNTS', 50))
+STRIPE_BATCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv('STRIPE_BATCH_CONCURRENCY', 8)),
+    thread_name_prefix='stripe-batch'
+)
+
+# Panier : une seule session Checkout pour plusieurs produits / vendeurs
+CART_MAX_ITEMS = int(os.getenv('CART_MAX_ITEMS', 50))
+CART_MAX_SELLERS = int(os.getenv('CART_MAX_SELLERS', 10))
+STRIPE_METADATA_MAX_LENGTH = 500
+
+# Devis de prix en lot (pages produits, listes)
+QUOTE_MAX_ITEMS = int(os.getenv('QUOTE_MAX_ITEMS', 10000))
+# Prix maximal accepté (10 M€) : bien en dessous du débordement int64 du calcul numpy
+QUOTE_MAX_PRICE_CENTS = 10 ** 9
+
+# Création d'étiquettes en lot : appels SOAP parallèles, plafonnés, avec points de reprise
+SHIPPING_LABEL_BATCH_MAX_ITEMS = int(os.getenv('SHIPPING_LABEL_BATCH_MAX_ITEMS', 500))
+SHIPPING_LABEL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv('SHIPPING_LABEL_CONCURRENCY', 4)),
+    thread_name_prefix='shipping-label'
+)
+LABEL_BATCH_STORE = LabelBatchStore(
+    path=os.getenv('LABEL_BATCH_STORE_PATH', os.path.join(DATA_DIR, 'label_batches.db')),
+    # Lot sans progression depuis ce délai (worker arrêté) : peut être repris
+    lease_seconds=int(os.getenv('LABEL_BATCH_LEASE', 900))
+)
+
+# Copies locales des étiquettes PDF, servies depuis /api/labels/<session_id>
+LABEL_STORE = LabelStore(
+    directory=os.getenv('LABEL_STORE_DIR', os.path.join(DATA_DIR, 'labels')),
+    client=MONDIAL_RELAY_CLIENT
+)
+# URL publique du backend, utilisée dans les messages envoyés hors requête
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', '').rstrip('/')
+
+# Base locale de points relais (import en masse + réponses SOAP accumulées),
+# utilisée quand l'API Mondial Relay est lente ou indisponible
+RELAY_POINTS_STORE = RelayPointStore(
+    path=os.getenv('RELAY_POINTS_DATASET'),
+    centroids_path=os.getenv('RELAY_POSTAL_CENTROIDS'),
+    refresh_interval=int(os.getenv('RELAY_STORE_REFRESH_INTERVAL', 300))
+)
+
+# Taille maximale des documents envoyés (Stripe refuse au-delà de 10 Mo)
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+# Marge pour les en-têtes multipart et les champs du formulaire
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+# Compression optionnelle des photos de pièces d'identité (nécessite Pillow)
+DOCUMENT_COMPRESSOR = DocumentCompressor(
+    enabled=os.getenv('DOCUMENT_COMPRESSION', 'false').lower() == 'true',
+    workers=int(os.getenv('DOCUMENT_COMPRESSION_WORKERS', 2)),
+    max_dimension=int(os.getenv('DOCUMENT_MAX_DIMENSION', 3000)),
+    max_bytes=int(os.getenv('DOCUMENT_TARGET_BYTES', 4 * 1024 * 1024)),
+    # Par défaut seuls les fichiers au-delà de la taille cible sont recompressés
+    min_bytes=int(os.getenv('DOCUMENT_COMPRESSION_MIN_BYTES', os.getenv('DOCUMENT_TARGET_BYTES', 4 * 1024 * 1024))),
+    quality=int(os.getenv('DOCUMENT_JPEG_QUALITY', 85))
+)
+if os.getenv('DOCUMENT_COMPRESSION', 'false').lower() == 'true' and not DOCUMENT_COMPRESSOR.enabled:
+    print("❌ Error: DOCUMENT_COMPRESSION requires Pillow (pip install Pillow).")
+# Les photos brutes peuvent dépasser la limite Stripe tant qu'elles sont recompressées
+UPLOAD_INPUT_MAX_BYTES = max(
+    UPLOAD_MAX_BYTES,
+    int(os.getenv('DOCUMENT_INPUT_MAX_BYTES', 25 * 1024 * 1024)) if DOCUMENT_COMPRESSOR.enabled else 0
+)
+
+UPLOAD_ENDPOINT = 'shay.upload_document_route'
+
+class UploadRequest(Request):
+    # Sur la route d'upload uniquement, les fichiers reçus restent en mémoire
+    # jusqu'au plafond au lieu d'être écrits dans un fichier temporaire
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint != UPLOAD_ENDPOINT:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_INPUT_MAX_BYTES + UPLOAD_FORM_OVERHEAD, mode='rb+')
+
+def upload_filename(filename, content_type):
+    # stripe-python envoie toujours le fichier en application/octet-stream :
+    # Stripe détecte le format par l'extension, qui doit donc suivre le type MIME
+    extension = mimetypes.guess_extension(content_type or '')
+    if extension and not os.path.splitext(filename)[1]:
+        return f"{filename}{extension}"
+    return filename
+
+class UploadStream:
+    # Flux nommé transmis tel quel à stripe.File.create, qui compte les octets lus
+    def __init__(self, stream, name, content_type=None):
+        self._stream = stream
+        self.name = upload_filename(name, content_type)
+        self.content_type = content_type
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
 
 # Main route for handling all API requests
-@app.route('/api/', methods=['POST', 'OPTIONS'])
+@bp.route('/api/', methods=['POST', 'OPTIONS'])
 def api_handler():
     if request.method == 'OPTIONS':
         return handle_cors()
     
     try:
         # Parse JSON data
-        data = request.json
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Request body must be a JSON object"}), 400
         
         # Route to appropriate function based on action
         if 'action' not in data:
             return jsonify({"error": "No action specified"}), 400
         
         action = data['action']
-        
-        if action == 'create-stripe-account-with-token':
-            return create_stripe_account_with_token(data)
-        elif action == 'create-stripe-account':
-            return create_stripe_account(data)
-        elif action == 'check-stripe-status':
-            return check_stripe_status(data)
-        elif action == 'create-custom-account':
-            return create_custom_account(data)
-        else:
+        handler = API_ACTIONS.get(action) if isinstance(action, str) else None
+        if handler is None:
             return jsonify({"error": f"Unknown action: {action}"}), 400
+        return handler(data)
     
     except Exception as e:
         print(f"Error in API handler: {e}")
         return jsonify({"error": str(e)}), 500
 
 # Specific API routes
-@app.route('/api/create-stripe-account', methods=['POST', 'OPTIONS'])
+@bp.route('/api/create-stripe-account', methods=['POST', 'OPTIONS'])
 def create_stripe_account_route():
     if request.method == 'OPTIONS':
         return handle_cors()
     
     try:
-        data = request.json
+        data = request.get_json(silent=True)
         return create_stripe_account(data)
     except Exception as e:
         print(f"Error creating Stripe account: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/check-stripe-status', methods=['POST', 'OPTIONS'])
+@bp.route('/api/check-stripe-status', methods=['POST', 'OPTIONS'])
 def check_stripe_status_route():
     if request.method == 'OPTIONS':
         return handle_cors()
     
     try:
-        data = request.json
+        data = request.get_json(silent=True)
         return check_stripe_status(data)
     except Exception as e:
         print(f"Error checking Stripe status: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/upload-document', methods=['POST', 'OPTIONS'])
+@bp.route('/api/check-stripe-status-batch', methods=['POST', 'OPTIONS'])
+def check_stripe_status_batch_route():
+    if request.method == 'OPTIONS':
+        return handle_cors()
+    # Jusqu'à STRIPE_BATCH_MAX_ACCOUNTS appels Stripe par requête : réservé aux admins
+    unauthorized = admin_unauthorized()
+    if unauthorized:
+        return unauthorized
+    
+    try:
+        data = request.get_json(silent=True)
+        return check_stripe_status_batch(data)
+    except Exception as e:
+        print(f"Error checking Stripe status batch: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/api/upload-document', methods=['POST', 'OPTIONS'])
 def upload_document_route():
     if request.method == 'OPTIONS':
         return handle_cors()
@@ -118,43 +348,55 @@ def upload_document_route():
         print(f"Error uploading document: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/create-checkout-session', methods=['POST', 'OPTIONS'])
+@bp.route('/api/create-checkout-session', methods=['POST', 'OPTIONS'])
 def create_checkout_session_route():
     if request.method == 'OPTIONS':
         return handle_cors()
     
     try:
-        data = request.json
+        data = request.get_json(silent=True)
         return create_checkout_session(data)
     except Exception as e:
         print(f"Error creating checkout session: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/create-appointment-checkout', methods=['POST', 'OPTIONS'])
+@bp.route('/api/create-appointment-checkout', methods=['POST', 'OPTIONS'])
 def create_appointment_checkout_route():
     if request.method == 'OPTIONS':
         return handle_cors()
     
     try:
-        data = request.json
+        data = request.get_json(silent=True)
         return create_appointment_checkout(data)
     except Exception as e:
         print(f"Error creating appointment checkout: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/create-boost-session', methods=['POST', 'OPTIONS'])
+@bp.route('/api/create-boost-session', methods=['POST', 'OPTIONS'])
 def create_boost_session_route():
     if request.method == 'OPTIONS':
         return handle_cors()
     
     try:
-        data = request.json
+        data = request.get_json(silent=True)
         return create_boost_session(data)
     except Exception as e:
         print(f"Error creating boost session: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/get-relay-points', methods=['POST', 'OPTIONS'])
+@bp.route('/api/quote-prices', methods=['POST', 'OPTIONS'])
+def quote_prices_route():
+    if request.method == 'OPTIONS':
+        return handle_cors()
+    
+    try:
+        data = request.get_json(silent=True)
+        return quote_prices(data)
+    except Exception as e:
+        print(f"Error quoting prices: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/api/get-relay-points', methods=['POST', 'OPTIONS'])
 def get_relay_points_route():
     if request.method == 'OPTIONS':
         return handle_cors()
@@ -164,21 +406,100 @@ def get_relay_points_route():
         print(f"Error getting relay points: {e}")
         return jsonify({"error": str(e)}), 500
 
+@bp.route('/api/cache-stats', methods=['GET'])
+def cache_stats_route():
+    return jsonify({
+        "relay_points": RELAY_POINTS_CACHE.stats(),
+        "relay_points_store": RELAY_POINTS_STORE.stats(),
+        "account_status": ACCOUNT_STATUS_CACHE.stats(),
+        "static_assets": STATIC_ASSETS.stats()
+    })
+
+@bp.route('/api/startup-stats', methods=['GET'])
+def startup_stats_route():
+    return jsonify({"serverImportMs": round(1000 * SERVER_IMPORT_SECONDS, 1), **lazy_imports.report()})
+
+@bp.route('/api/outbound-stats', methods=['GET'])
+def outbound_stats_route():
+    return jsonify({
+        "mondial_relay": MONDIAL_RELAY_CLIENT.stats(),
+        "breakers": MONDIAL_RELAY_CLIENT.breaker_stats(),
+        "stripe_limits": {"read": STRIPE_READ_LIMITER.stats(), "write": STRIPE_WRITE_LIMITER.stats()}
+    })
+
 # Nouvelle route pour la création d'étiquette d'expédition
-@app.route('/api/create-shipping-label', methods=['POST', 'OPTIONS'])
+@bp.route('/api/create-shipping-label', methods=['POST', 'OPTIONS'])
 def create_shipping_label_route():
     if request.method == 'OPTIONS':
         return handle_cors()
     
     try:
-        data = request.json
+        data = request.get_json(silent=True)
         return create_shipping_label(data)
     except Exception as e:
         print(f"Error creating shipping label: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Création d'étiquettes en lot (retraitement de commandes, envois multiples)
+@bp.route('/api/create-shipping-labels', methods=['POST', 'OPTIONS'])
+def create_shipping_labels_route():
+    if request.method == 'OPTIONS':
+        return handle_cors()
+    unauthorized = admin_unauthorized()
+    if unauthorized:
+        return unauthorized
+    
+    try:
+        data = request.get_json(silent=True)
+        return create_shipping_labels(data)
+    except Exception as e:
+        print(f"Error creating shipping labels: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/api/create-shipping-labels/<batch_id>', methods=['GET'])
+def shipping_label_batch_progress_route(batch_id):
+    unauthorized = admin_unauthorized()
+    if unauthorized:
+        return unauthorized
+    batch = LABEL_BATCH_STORE.batch(batch_id)
+    if batch is None:
+        return jsonify({"error": "Batch not found"}), 404
+    items = LABEL_BATCH_STORE.progress(batch_id)
+    counts = {status: sum(1 for item in items if item['status'] == status) for status in ('done', 'failed', 'pending')}
+    return jsonify({
+        "batchId": batch_id,
+        **batch,
+        "succeeded": counts['done'],
+        "failed": counts['failed'],
+        "pending": counts['pending'],
+        "items": items
+    })
+
+# Étiquettes stockées localement (ETag, requêtes conditionnelles et Range).
+# Pas d'authentification : l'URL elle-même (id de session Checkout, non
+# devinable) sert de droit d'accès, comme un lien de partage. Le PDF contient
+# les noms et adresses de l'acheteur et du vendeur : cache navigateur
+# uniquement, jamais dans un proxy ou un CDN partagé
+@bp.route('/api/labels/<session_id>', methods=['GET', 'HEAD'])
+def label_pdf_route(session_id):
+    label = LABEL_STORE.lookup(session_id)
+    if not label:
+        return jsonify({"error": "Label not found"}), 404
+    
+    response = send_file(
+        label['path'],
+        mimetype='application/pdf',
+        download_name=f"etiquette-{session_id}.pdf",
+        conditional=True,
+        etag=label['sha256'],
+        max_age=30 * 86400
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
 # Webhook Stripe pour gérer les paiements réussis
-@app.route('/api/stripe-webhook', methods=['POST'])
+@bp.route('/api/stripe-webhook', methods=['POST'])
 def stripe_webhook():
     if not STRIPE_WEBHOOK_SECRET:
         return jsonify({"error": "Webhook secret not configured"}), 500
@@ -198,27 +519,197 @@ def stripe_webhook():
         # Invalid signature
         return jsonify({"error": "Invalid signature"}), 400
 
-    # Handle the checkout.session.completed event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        return handle_successful_payment(session)
+    # Mise à jour en place du statut des comptes connectés ; un événement plus
+    # ancien que le statut en cache (retard, rejeu) est ignoré
+    if event['type'] == 'account.updated':
+        account = event['data']['object']
+        if not ACCOUNT_STATUS_CACHE.set_if_newer(account['id'], account_status(account), event['created']):
+            return jsonify({"status": "outdated"}), 200
+        return jsonify({"status": "success"}), 200
+
+    # Stripe renvoie parfois le même événement : on ignore les doublons
+    if EVENT_STORE.seen_event(event['id']):
+        return jsonify({"status": "duplicate"}), 200
+
+    # Les paiements sont traités en arrière-plan : on persiste l'événement
+    # puis on acquitte immédiatement pour ne pas faire attendre Stripe
+    if event['type'] in QUEUED_WEBHOOK_EVENTS:
+        try:
+            WEBHOOK_QUEUE.enqueue(event['id'], event['type'], payload.decode('utf-8'))
+        except Exception as e:
+            print(f"Error queueing webhook event {event['id']}: {e}")
+            return jsonify({"error": "Could not queue event"}), 500
+        return jsonify({"status": "queued"}), 200
 
     return jsonify({"status": "success"}), 200
 
+@bp.route('/api/webhook-queue/stats', methods=['GET'])
+def webhook_queue_stats_route():
+    return jsonify({**WEBHOOK_QUEUE.stats(), "eventStore": EVENT_STORE.stats()})
+
+@bp.before_app_request
+def start_background_workers():
+    start_webhook_workers(current_app._get_current_object())
+
 # Function implementations
+
+# Actions de /api/ : nom de l'action -> fonction (data) -> réponse
+API_ACTIONS = {}
+
+def api_action(name):
+    def register(handler):
+        API_ACTIONS[name] = handler
+        return handler
+    return register
+
+def stripe_retry_after(e):
+    # Secondes à attendre d'après une RateLimitError Stripe (ou du limiteur local)
+    try:
+        return max(1, int(float((e.headers or {}).get('Retry-After'))))
+    except (TypeError, ValueError):
+        return 1
+
+def stripe_rate_limited_response(e):
+    # Budget Stripe épuisé (ou 429 persistant) : 503 avec Retry-After plutôt qu'une 500
+    retry_after = stripe_retry_after(e)
+    response = jsonify({"error": "Payment provider busy, please retry", "retryAfter": retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
+# Schémas des requêtes, compilés une fois au chargement du module
+STRIPE_ACCOUNT_WITH_TOKEN_SCHEMA = Schema({
+    'account_token': Field(str, allow_empty=False),
+    'email': Field(str, allow_empty=False),
+    'iban': Field(str, allow_empty=False),
+    'website': Field(str, required=False),
+})
+
+STRIPE_ACCOUNT_SCHEMA = Schema({
+    'first_name': Field(str, allow_empty=False),
+    'last_name': Field(str, allow_empty=False),
+    'email': Field(str, allow_empty=False),
+    'phone': Field(str, allow_empty=False),
+    'dob_day': Field(int, min_value=1, max_value=31),
+    'dob_month': Field(int, min_value=1, max_value=12),
+    'dob_year': Field(int, min_value=1900),
+    'address_line1': Field(str, allow_empty=False),
+    'address_city': Field(str, allow_empty=False),
+    'address_postal_code': Field(str, allow_empty=False),
+    'iban': Field(str, allow_empty=False),
+    'tos_date': Field(int, required=False),
+    'website': Field(str, required=False),
+    'business_type': Field(str, required=False),
+    'business_profile_mcc': Field(str, required=False),
+})
+
+STRIPE_STATUS_SCHEMA = Schema({
+    'account_id': Field(str, allow_empty=False),
+})
+
+STRIPE_STATUS_BATCH_SCHEMA = Schema({
+    'account_ids': Field(list, allow_empty=False),
+    'stream': Field(bool, required=False),
+})
+
+CHECKOUT_SESSION_SCHEMA = Schema({
+    'productId': Field(str),
+    'productTitle': Field(str, allow_empty=False),
+    'productPrice': Field(float, min_value=0),
+    'serviceFee': Field(float, required=False, min_value=0),
+    'fixedFee': Field(float, required=False, min_value=0),
+    'shippingCost': Field(float, required=False, min_value=0),
+    'sellerId': Field(str),
+    'sellerStripeId': Field(str, required=False),
+    'buyerId': Field(str),
+    'deliveryAddress': Field(None),
+    'usePlatformAccount': Field(bool, required=False),
+    'successUrl': Field(str, required=False),
+    'cancelUrl': Field(str, required=False),
+})
+
+# Point relais de livraison, requis pour créer l'étiquette Mondial Relay
+RELAY_POINT_SCHEMA = Schema({
+    'id': Field(str, allow_empty=False),
+    'address': Field(str),
+    'city': Field(str),
+    'postalCode': Field(str, allow_empty=False),
+})
+
+CART_CHECKOUT_SCHEMA = Schema({
+    'items': Field(list, allow_empty=False),
+    'buyerId': Field(str),
+    'deliveryAddress': Field(None),
+    # Requis : les vendeurs sont payés au webhook, le colis doit pouvoir partir
+    'relayPoint': Field(schema=RELAY_POINT_SCHEMA),
+    'successUrl': Field(str, required=False),
+    'cancelUrl': Field(str, required=False),
+})
+
+CART_ITEM_SCHEMA = Schema({
+    'productId': Field(str),
+    'productTitle': Field(str, allow_empty=False),
+    'productPrice': Field(float, min_value=0),
+    'quantity': Field(int, required=False, default=1, min_value=1),
+    'sellerId': Field(str, allow_empty=False),
+    'sellerStripeId': Field(str, required=False),
+})
+
+QUOTE_PRICES_SCHEMA = Schema({
+    'prices': Field(list, required=False),  # En euros
+    'pricesCents': Field(list, required=False),
+    'shippingCost': Field(float, required=False, min_value=0, max_value=QUOTE_MAX_PRICE_CENTS / 100),
+})
+
+APPOINTMENT_CHECKOUT_SCHEMA = Schema({
+    'amount': Field(int, min_value=1),  # En centimes
+    'stripe_account_id': Field(str, allow_empty=False),
+})
+
+BOOST_SESSION_SCHEMA = Schema({
+    'productId': Field(str),
+    'duration': Field(None),
+    'priceId': Field(str, allow_empty=False),
+    'buyerId': Field(str),
+})
+
+RELAY_POINTS_SCHEMA = Schema({
+    'postalCode': Field(str, required=False),
+    'latitude': Field(float, required=False, min_value=-90, max_value=90),
+    'longitude': Field(float, required=False, min_value=-180, max_value=180),
+    'country': Field(str, required=False),
+    'limit': Field(int, required=False),
+})
+
+SHIPPING_CONTACT_SCHEMA = Schema({
+    'fullName': Field(str, allow_empty=False),
+    'phone': Field(str, required=False, default=''),
+})
+
+SHIPPING_LABEL_SCHEMA = Schema({
+    'buyer': Field(schema=SHIPPING_CONTACT_SCHEMA),
+    'seller': Field(schema=Schema({
+        **SHIPPING_CONTACT_SCHEMA.fields,
+        'street': Field(str, allow_empty=False),
+        'city': Field(str, allow_empty=False),
+        'postalCode': Field(str, allow_empty=False),
+    })),
+    'relayPoint': Field(schema=RELAY_POINT_SCHEMA),
+    'productId': Field(str),
+})
+
+SHIPPING_LABEL_BATCH_SCHEMA = Schema({
+    'labels': Field(list, allow_empty=False),
+    'batchId': Field(str, required=False),
+})
+
+@api_action('create-stripe-account-with-token')
 def create_stripe_account_with_token(data):
     try:
-        account_token = data.get('account_token')
-        email = data.get('email')
-        iban = data.get('iban')
+        data = STRIPE_ACCOUNT_WITH_TOKEN_SCHEMA(data)
+        account_token = data['account_token']
+        email = data['email']
+        iban = data['iban']
         website = data.get('website')
-        tos_date = data.get('tos_date', int(time.time()))
-        
-        if not account_token:
-            return jsonify({"error": "Missing account_token parameter"}), 400
-        
-        if not email or not iban:
-            return jsonify({"error": "Missing required parameters (email, iban)"}), 400
         
         # Create Stripe account with account token
         account = stripe.Account.create(
@@ -253,6 +744,10 @@ def create_stripe_account_with_token(data):
         )
         
         return jsonify({"id": account.id})
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    except stripe.error.RateLimitError as e:
+        return stripe_rate_limited_response(e)
     except stripe.error.StripeError as e:
         print(f"Stripe error: {e}")
         return jsonify({
@@ -263,16 +758,11 @@ def create_stripe_account_with_token(data):
         print(f"Error creating Stripe account with token: {e}")
         return jsonify({"error": str(e)}), 500
 
+@api_action('create-stripe-account')
 def create_stripe_account(data):
     try:
         # Validate required fields
-        required_fields = ['first_name', 'last_name', 'email', 'phone', 
-                          'dob_day', 'dob_month', 'dob_year', 
-                          'address_line1', 'address_city', 'address_postal_code', 'iban']
-        
-        for field in required_fields:
-            if field not in data or not data[field]:
-                return jsonify({"error": f"Missing required field: {field}"}), 400
+        data = STRIPE_ACCOUNT_SCHEMA(data)
         
         # Create Stripe account
         try:
@@ -295,9 +785,9 @@ def create_stripe_account(data):
                     "last_name": data['last_name'],
                     "phone": data['phone'],
                     "dob": {
-                        "day": int(data['dob_day']),
-                        "month": int(data['dob_month']),
-                        "year": int(data['dob_year'])
+                        "day": data['dob_day'],
+                        "month": data['dob_month'],
+                        "year": data['dob_year']
                     },
                     "address": {
                         "line1": data['address_line1'],
@@ -323,12 +813,14 @@ def create_stripe_account(data):
                     }
                 },
                 tos_acceptance={
-                    "date": int(data.get('tos_date', int(time.time()))),
+                    "date": data.get('tos_date', int(time.time())),
                     "ip": request.remote_addr,
                     "service_agreement": "full"
                 }
             )
             return jsonify({"id": account.id})
+        except stripe.error.RateLimitError as e:
+            return stripe_rate_limited_response(e)
         except stripe.error.StripeError as e:
             print(f"Stripe error: {e}")
             return jsonify({
@@ -336,10 +828,13 @@ def create_stripe_account(data):
                 "details": e.user_message if hasattr(e, 'user_message') else None
             }), 400
         
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error creating Stripe account: {e}")
         return jsonify({"error": str(e)}), 500
 
+@api_action('create-custom-account')
 def create_custom_account(data=None):
     try:
         # Create a custom Stripe account with minimal information
@@ -359,51 +854,116 @@ def create_custom_account(data=None):
         )
         
         return jsonify({"id": account.id})
+    except stripe.error.RateLimitError as e:
+        return stripe_rate_limited_response(e)
     except Exception as e:
         print(f"Error creating custom Stripe account: {e}")
         return jsonify({"error": str(e)}), 500
 
+@api_action('check-stripe-status')
 def check_stripe_status(data):
     try:
-        account_id = data.get('account_id')
-        
-        if not account_id:
-            return jsonify({"error": "Missing account_id parameter"}), 400
+        account_id = STRIPE_STATUS_SCHEMA(data)['account_id']
         
         try:
-            account = stripe.Account.retrieve(account_id)
-            
-            # Get detailed requirements
-            requirements = account.requirements
-            
-            status = {
-                "isVerified": account.charges_enabled and account.payouts_enabled,
-                "isRestricted": requirements.disabled_reason is not None,
-                "requiresInfo": len(requirements.currently_due) > 0,
-                "pendingRequirements": requirements.currently_due,
-                "currentDeadline": requirements.current_deadline,
-                "capabilities": account.capabilities
-            }
-            
+            # Statut servi depuis le cache, mis à jour par le webhook account.updated
+            status = ACCOUNT_STATUS_CACHE.get_or_load(account_id, lambda: fetch_account_status(account_id))
             return jsonify(status)
+        except stripe.error.RateLimitError as e:
+            # Budget épuisé : dernier statut connu, sinon le client repasse plus tard
+            status = ACCOUNT_STATUS_CACHE.last_value(account_id)
+            if status is not None:
+                return jsonify(status)
+            return stripe_rate_limited_response(e)
         except stripe.error.StripeError as e:
             print(f"Stripe error: {e}")
             # Fallback to simulated status if Stripe API fails
-            return jsonify({
-                "isVerified": False,
-                "isRestricted": False,
-                "requiresInfo": True,
-                "pendingRequirements": ['verification.document.front', 'business_profile.mcc'],
-                "currentDeadline": None,
-                "capabilities": {"card_payments": "inactive", "transfers": "inactive"}
-            })
+            return jsonify(SIMULATED_ACCOUNT_STATUS)
             
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error checking Stripe status: {e}")
         return jsonify({"error": str(e)}), 500
 
+def check_stripe_status_batch(data):
+    try:
+        data = STRIPE_STATUS_BATCH_SCHEMA(data)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    account_ids = data['account_ids']
+    
+    # Dédoublonnage en gardant l'ordre
+    account_ids = list(dict.fromkeys(str(account_id) for account_id in account_ids))
+    if len(account_ids) > STRIPE_BATCH_MAX_ACCOUNTS:
+        return jsonify({"error": f"Too many accounts (max {STRIPE_BATCH_MAX_ACCOUNTS})"}), 400
+    
+    futures = [STRIPE_BATCH_EXECUTOR.submit(account_status_result, account_id) for account_id in account_ids]
+    
+    # Gros lots : résultats envoyés au fil de l'eau en NDJSON
+    if data.get('stream'):
+        def generate():
+            for future in as_completed(futures):
+                yield json_provider.dumps(future.result()) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    results = {}
+    errors = {}
+    for future in as_completed(futures):
+        result = future.result()
+        if 'error' in result:
+            errors[result['account_id']] = result['error']
+        else:
+            results[result['account_id']] = result['status']
+    
+    return jsonify({"results": results, "errors": errors})
+
+def account_status_result(account_id):
+    try:
+        status = ACCOUNT_STATUS_CACHE.get_or_load(account_id, lambda: fetch_account_status(account_id))
+        return {"account_id": account_id, "status": status}
+    except stripe.error.StripeError as e:
+        print(f"Stripe error for {account_id}: {e}")
+        return {"account_id": account_id, "error": str(e)}
+    except Exception as e:
+        print(f"Error checking Stripe status for {account_id}: {e}")
+        return {"account_id": account_id, "error": str(e)}
+
+def fetch_account_status(account_id):
+    account = stripe.Account.retrieve(account_id)
+    return account_status(account)
+
+# Statut renvoyé quand l'API Stripe échoue
+SIMULATED_ACCOUNT_STATUS = {
+    "isVerified": False,
+    "isRestricted": False,
+    "requiresInfo": True,
+    "pendingRequirements": ['verification.document.front', 'business_profile.mcc'],
+    "currentDeadline": None,
+    "capabilities": {"card_payments": "inactive", "transfers": "inactive"}
+}
+
+def account_status(account):
+    # Accepte un objet Stripe ou le JSON brut de l'API (mode async)
+    requirements = account['requirements']
+    
+    return {
+        "isVerified": account['charges_enabled'] and account['payouts_enabled'],
+        "isRestricted": requirements['disabled_reason'] is not None,
+        "requiresInfo": len(requirements['currently_due']) > 0,
+        "pendingRequirements": requirements['currently_due'],
+        "currentDeadline": requirements['current_deadline'],
+        "capabilities": account['capabilities']
+    }
+
 def upload_document():
     try:
+        # Refuser les fichiers trop gros avant de lire le corps de la requête
+        if request.content_length is None:
+            return jsonify({"error": "Missing Content-Length"}), 411
+        if request.content_length > UPLOAD_INPUT_MAX_BYTES + UPLOAD_FORM_OVERHEAD:
+            return jsonify({"error": f"File too large (max {UPLOAD_INPUT_MAX_BYTES} bytes)"}), 413
+        
         if 'file' not in request.files:
             return jsonify({"error": "No file part"}), 400
             
@@ -414,36 +974,53 @@ def upload_document():
         if not file or not purpose or not account_id:
             return jsonify({"error": "Missing required parameters"}), 400
         
+        file.stream.seek(0, os.SEEK_END)
+        size = file.stream.tell()
+        file.stream.seek(0)
+        if size > UPLOAD_INPUT_MAX_BYTES:
+            return jsonify({"error": f"File too large (max {UPLOAD_INPUT_MAX_BYTES} bytes)"}), 413
+        
+        stream = file.stream
+        filename = secure_filename(file.filename) or 'document'
+        content_type = file.mimetype
+        if DOCUMENT_COMPRESSOR.enabled:
+            # Redimensionnement / réencodage hors du thread de requête, sans EXIF
+            start = time.perf_counter()
+            try:
+                data, compressed_filename = DOCUMENT_COMPRESSOR.compress(file.stream.read(), filename)
+                if compressed_filename != filename:
+                    # Réencodé en JPEG
+                    filename, content_type = compressed_filename, 'image/jpeg'
+                stream = io.BytesIO(data)
+                size_after = len(data)
+                duration_ms = (time.perf_counter() - start) * 1000
+                print(f"🗜️ Document compressed from {size} to {size_after} bytes in {duration_ms:.0f} ms")
+                size = size_after
+            except Exception as e:
+                print(f"Error compressing document, uploading original: {e}")
+                file.stream.seek(0)
+                stream = file.stream
+        
+        if size > UPLOAD_MAX_BYTES:
+            return jsonify({"error": f"File too large (max {UPLOAD_MAX_BYTES} bytes)"}), 413
+        
         try:
-            # Save file to temporary location
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(filepath)
-            
-            # Read the file
-            with open(filepath, 'rb') as f:
-                file_data = f.read()
-            
-            # Upload file to Stripe
+            # Upload file to Stripe directly from the request stream
+            start = time.perf_counter()
+            upload_stream = UploadStream(stream, filename, content_type)
             file_upload = stripe.File.create(
                 purpose=purpose,
-                file={
-                    'data': file_data,
-                    'name': filename,
-                    'type': file.content_type
-                },
+                file=upload_stream,
                 stripe_account=account_id
             )
-            
-            # Clean up temporary file
-            os.remove(filepath)
+            duration_ms = (time.perf_counter() - start) * 1000
+            print(f"📄 Uploaded {upload_stream.bytes_read} bytes to Stripe in {duration_ms:.0f} ms")
             
             return jsonify({"id": file_upload.id})
+        except stripe.error.RateLimitError as e:
+            return stripe_rate_limited_response(e)
         except stripe.error.StripeError as e:
             print(f"Stripe error: {e}")
-            # Clean up temporary file if it exists
-            if os.path.exists(filepath):
-                os.remove(filepath)
             return jsonify({"error": str(e)}), 400
             
     except Exception as e:
@@ -452,486 +1029,906 @@ def upload_document():
 
 def create_checkout_session(data):
     try:
-        # Validate required fields
-        required_fields = ['productId', 'productTitle', 'productPrice', 'sellerId', 'buyerId', 'deliveryAddress']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"Missing required field: {field}"}), 400
-        
-        # Extract data
-        product_id = data['productId']
-        product_title = data['productTitle']
-        product_price = float(data['productPrice'])
-        service_fee = float(data.get('serviceFee', product_price * 0.08))  # Default to 8%
-        fixed_fee = float(data.get('fixedFee', 0.70))  # Default to 0.70€
-        shipping_cost = float(data.get('shippingCost', 3.89))  # Default to 3.89€
-        seller_id = data['sellerId']
-        seller_stripe_id = data.get('sellerStripeId')
-        buyer_id = data['buyerId']
-        delivery_address = data['deliveryAddress']
-        relay_point = data.get('relayPoint')
-        use_platform_account = data.get('usePlatformAccount', False)
-        
-        # Calculate total
-        total = product_price + service_fee + fixed_fee + shipping_cost
-        total_cents = int(total * 100)
-        
-        # Calculate platform fee (service fee + fixed fee + shipping)
-        platform_fee = int((service_fee + fixed_fee + shipping_cost) * 100)
-        
-        # Create line items
-        line_items = [
-            {
-                "price_data": {
-                    "currency": "eur",
-                    "product_data": {
-                        "name": product_title,
-                        "description": "Achat sur Shay Beauty",
-                    },
-                    "unit_amount": int(product_price * 100),
-                },
-                "quantity": 1,
-            },
-            {
-                "price_data": {
-                    "currency": "eur",
-                    "product_data": {
-                        "name": "Frais de service",
-                        "description": "Frais de service Shay Beauty (8%)",
-                    },
-                    "unit_amount": int(service_fee * 100),
-                },
-                "quantity": 1,
-            },
-            {
-                "price_data": {
-                    "currency": "eur",
-                    "product_data": {
-                        "name": "Frais fixes",
-                        "description": "Frais fixes Shay Beauty",
-                    },
-                    "unit_amount": int(fixed_fee * 100),
-                },
-                "quantity": 1,
-            },
-            {
-                "price_data": {
-                    "currency": "eur",
-                    "product_data": {
-                        "name": "Frais de livraison",
-                        "description": "Livraison Mondial Relay",
-                    },
-                    "unit_amount": int(shipping_cost * 100),
-                },
-                "quantity": 1,
-            }
-        ]
-        
-        # Create session parameters
-        session_params = {
-            "payment_method_types": ["card"],
-            "line_items": line_items,
-            "mode": "payment",
-            "success_url": data.get('successUrl', f"{request.host_url}payment/success?session_id={{CHECKOUT_SESSION_ID}}"),
-            "cancel_url": data.get('cancelUrl', f"{request.host_url}payment/cancel"),
-            "metadata": {
-                "productId": product_id,
-                "sellerId": seller_id,
-                "buyerId": buyer_id,
-                "platformFee": platform_fee / 100,  # Store in EUR for readability
-                "sellerAmount": (total_cents - platform_fee) / 100,  # Store in EUR for readability
-                "usePlatformAccount": "true" if use_platform_account else "false",
-                "deliveryAddress": json.dumps(delivery_address),
-                "relayPoint": json.dumps(relay_point) if relay_point else None,
-                "shippingCost": shipping_cost,
-                "type": "product"
-            }
-        }
-        
-        # If seller has a Stripe account and we're not using the platform account, add transfer data
-        if seller_stripe_id and not use_platform_account:
-            session_params["payment_intent_data"] = {
-                "application_fee_amount": platform_fee,  # Platform fee + shipping cost
-                "transfer_data": {
-                    "destination": seller_stripe_id,
-                },
-            }
+        session_params = checkout_session_params(data, request.host_url)
         
         # Create the session
         session = stripe.checkout.Session.create(**session_params)
         
         return jsonify({"id": session.id, "url": session.url})
     
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    except stripe.error.RateLimitError as e:
+        return stripe_rate_limited_response(e)
     except Exception as e:
         print(f"Error creating checkout session: {e}")
         return jsonify({"error": str(e)}), 500
 
-def create_appointment_checkout(data):
+def checkout_session_params(data, host_url):
+    # Un panier (`items`) part sur le mode multi-produits
+    if isinstance(data, dict) and 'items' in data:
+        return cart_session_params(data, host_url)
+    
+    # Validate required fields
+    data = CHECKOUT_SESSION_SCHEMA(data)
+    
+    # Extract data
+    product_id = data['productId']
+    product_title = data['productTitle']
+    # Montants en centimes entiers (fees.py), comme facturés par Stripe
+    price_cents = to_cents(data['productPrice'])
+    fees = seller_fees(price_cents)
+    service_fee = to_cents(data['serviceFee']) if data.get('serviceFee') is not None else fees['serviceFee']  # Default to 8%
+    fixed_fee = to_cents(data['fixedFee']) if data.get('fixedFee') is not None else fees['fixedFee']  # Default to 0.70€
+    shipping_cost = to_cents(data['shippingCost']) if data.get('shippingCost') is not None else fees['shipping']  # Default to 3.89€
+    seller_id = data['sellerId']
+    seller_stripe_id = data.get('sellerStripeId')
+    buyer_id = data['buyerId']
+    delivery_address = data['deliveryAddress']
+    relay_point = data.get('relayPoint')
+    use_platform_account = data.get('usePlatformAccount', False)
+    
+    # Calculate platform fee (service fee + fixed fee + shipping)
+    platform_fee = service_fee + fixed_fee + shipping_cost
+    
+    # Create line items
+    line_items = [
+        fee_line_item(product_title, "Achat sur Shay Beauty", price_cents),
+        fee_line_item("Frais de service", "Frais de service Shay Beauty (8%)", service_fee),
+        fee_line_item("Frais fixes", "Frais fixes Shay Beauty", fixed_fee),
+        fee_line_item("Frais de livraison", "Livraison Mondial Relay", shipping_cost)
+    ]
+    
+    # Create session parameters
+    session_params = {
+        "payment_method_types": ["card"],
+        "line_items": line_items,
+        "mode": "payment",
+        "success_url": data.get('successUrl', f"{host_url}payment/success?session_id={{CHECKOUT_SESSION_ID}}"),
+        "cancel_url": data.get('cancelUrl', f"{host_url}payment/cancel"),
+        "metadata": {
+            "productId": product_id,
+            "sellerId": seller_id,
+            "buyerId": buyer_id,
+            "platformFee": platform_fee / 100,  # Store in EUR for readability
+            "sellerAmount": price_cents / 100,  # Store in EUR for readability
+            "usePlatformAccount": "true" if use_platform_account else "false",
+            "deliveryAddress": json_provider.dumps(delivery_address),
+            "relayPoint": json_provider.dumps(relay_point) if relay_point else None,
+            "shippingCost": shipping_cost / 100,
+            "type": "product"
+        }
+    }
+    
+    # If seller has a Stripe account and we're not using the platform account, add transfer data
+    if seller_stripe_id and not use_platform_account:
+        session_params["payment_intent_data"] = {
+            "application_fee_amount": platform_fee,  # Platform fee + shipping cost
+            "transfer_data": {
+                "destination": seller_stripe_id,
+            },
+        }
+    
+    return session_params
+
+def fee_line_item(name, description, unit_amount, quantity=1):
+    return {
+        "price_data": {
+            "currency": "eur",
+            "product_data": {
+                "name": name,
+                "description": description,
+            },
+            "unit_amount": unit_amount,
+        },
+        "quantity": quantity,
+    }
+
+def cart_session_params(data, host_url):
+    data = CART_CHECKOUT_SCHEMA(data)
+    if len(data['items']) > CART_MAX_ITEMS:
+        raise ValidationError(f"Too many items (max {CART_MAX_ITEMS})")
+    items = [CART_ITEM_SCHEMA.validate(item, f"items[{index}].") for index, item in enumerate(data['items'])]
+    
+    # Regroupement par vendeur, montants en centimes
+    sellers = {}
+    line_items = []
+    for item in items:
+        price = to_cents(item['productPrice'])
+        seller = sellers.setdefault(item['sellerId'], {"stripeId": None, "subtotal": 0, "productIds": []})
+        seller['stripeId'] = seller['stripeId'] or item.get('sellerStripeId')
+        seller['subtotal'] += price * item['quantity']
+        seller['productIds'].append(item['productId'])
+        line_items.append(fee_line_item(item['productTitle'], "Achat sur Shay Beauty", price, item['quantity']))
+    if len(sellers) > CART_MAX_SELLERS:
+        raise ValidationError(f"Too many sellers (max {CART_MAX_SELLERS})")
+    
+    # Un colis par vendeur : frais de service, frais fixes et livraison calculés par vendeur
+    cart_id = f"cart_{uuid.uuid4().hex}"
+    service_fee = 0
+    platform_fee = 0
+    metadata = {}
+    for index, (seller_id, seller) in enumerate(sellers.items()):
+        fees = seller_fees(seller['subtotal'])
+        service_fee += fees['serviceFee']
+        platform_fee += fees['platformFee']
+        entry = json_provider.dumps({
+            "sellerId": seller_id,
+            "stripeId": seller['stripeId'],
+            "amount": fees['subtotal'],
+            "productIds": seller['productIds']
+        })
+        if len(entry) > STRIPE_METADATA_MAX_LENGTH:
+            raise ValidationError(f"Too many products for seller {seller_id}")
+        metadata[f"seller_{index}"] = entry
+    
+    line_items.append(fee_line_item("Frais de service", "Frais de service Shay Beauty (8%)", service_fee))
+    line_items.append(fee_line_item("Frais fixes", "Frais fixes Shay Beauty", FIXED_FEE_CENTS, len(sellers)))
+    line_items.append(fee_line_item("Frais de livraison", "Livraison Mondial Relay", SHIPPING_CENTS, len(sellers)))
+    
+    metadata.update({
+        "type": "cart",
+        "cartId": cart_id,
+        "buyerId": data['buyerId'],
+        "sellerCount": len(sellers),
+        "platformFee": platform_fee / 100,  # En euros, comme les achats simples
+        "deliveryAddress": json_provider.dumps(data['deliveryAddress']),
+        "relayPoint": json_provider.dumps(data['relayPoint'])
+    })
+    
+    # Les vendeurs sont payés par des transferts groupés (transfer_group) au webhook
+    return {
+        "payment_method_types": ["card"],
+        "line_items": line_items,
+        "mode": "payment",
+        "success_url": data.get('successUrl', f"{host_url}payment/success?session_id={{CHECKOUT_SESSION_ID}}"),
+        "cancel_url": data.get('cancelUrl', f"{host_url}payment/cancel"),
+        "payment_intent_data": {"transfer_group": cart_id},
+        "metadata": metadata
+    }
+
+def quote_prices(data):
+    # Prix finaux (produit + frais + livraison) de nombreuses annonces, en centimes,
+    # avec le même calcul que create_checkout_session
     try:
-        # Validate required fields
-        required_fields = ['amount', 'stripe_account_id']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"Missing required field: {field}"}), 400
+        data = QUOTE_PRICES_SCHEMA(data)
+        prices_cents = data.get('pricesCents')
+        if prices_cents is None:
+            prices = data.get('prices')
+            if prices is None:
+                raise ValidationError("Missing required field: prices")
+            prices_cents = [price_to_cents(price, index) for index, price in enumerate(prices)]
+        elif not all(type(price) is int and 0 <= price <= QUOTE_MAX_PRICE_CENTS for price in prices_cents):
+            raise ValidationError(f"Invalid field pricesCents: expected integers between 0 and {QUOTE_MAX_PRICE_CENTS}")
+        if len(prices_cents) > QUOTE_MAX_ITEMS:
+            raise ValidationError(f"Too many prices (max {QUOTE_MAX_ITEMS})")
         
-        # Extract data
-        amount = int(data['amount'])  # Amount in cents
-        stripe_account_id = data['stripe_account_id']
+        shipping = to_cents(data['shippingCost']) if data.get('shippingCost') is not None else SHIPPING_CENTS
+        return jsonify({"currency": "eur", **quote_cents(prices_cents, shipping)})
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+
+def price_to_cents(price, index):
+    if isinstance(price, bool) or not isinstance(price, (int, float, str)):
+        raise ValidationError(f"Invalid field prices[{index}]: expected number")
+    try:
+        cents = to_cents(price)
+    except ArithmeticError:
+        raise ValidationError(f"Invalid field prices[{index}]: expected number") from None
+    if cents < 0:
+        raise ValidationError(f"Invalid field prices[{index}]: must be >= 0")
+    if cents > QUOTE_MAX_PRICE_CENTS:
+        raise ValidationError(f"Invalid field prices[{index}]: must be <= {QUOTE_MAX_PRICE_CENTS / 100:.0f}")
+    return cents
+
+def create_appointment_checkout(data):
+    try:
+        session_params = appointment_checkout_params(data, request.host_url)
         
         # Create a Stripe Checkout Session
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[
-                {
-                    "price_data": {
-                        "currency": "eur",
-                        "product_data": {
-                            "name": "Acompte pour rendez-vous",
-                            "description": "Réservation de rendez-vous sur Shay Beauty",
-                        },
-                        "unit_amount": amount,
-                    },
-                    "quantity": 1,
-                }
-            ],
-            mode="payment",
-            success_url=f"{request.host_url}payment/success?session_id={{CHECKOUT_SESSION_ID}}",
-            cancel_url=f"{request.host_url}payment/cancel",
-            payment_intent_data={
-                "application_fee_amount": 0,  # No fee for deposits
-                "transfer_data": {
-                    "destination": stripe_account_id,
-                },
-            },
-            metadata={
-                "type": "appointment"
-            }
-        )
+        session = stripe.checkout.Session.create(**session_params)
         
         return jsonify({"id": session.id, "url": session.url})
     
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    except stripe.error.RateLimitError as e:
+        return stripe_rate_limited_response(e)
     except Exception as e:
         print(f"Error creating appointment checkout: {e}")
         return jsonify({"error": str(e)}), 500
 
+def appointment_checkout_params(data, host_url):
+    # Validate required fields
+    data = APPOINTMENT_CHECKOUT_SCHEMA(data)
+    
+    # Extract data
+    amount = data['amount']  # Amount in cents
+    stripe_account_id = data['stripe_account_id']
+    
+    return {
+        "payment_method_types": ['card'],
+        "line_items": [
+            {
+                "price_data": {
+                    "currency": "eur",
+                    "product_data": {
+                        "name": "Acompte pour rendez-vous",
+                        "description": "Réservation de rendez-vous sur Shay Beauty",
+                    },
+                    "unit_amount": amount,
+                },
+                "quantity": 1,
+            }
+        ],
+        "mode": "payment",
+        "success_url": f"{host_url}payment/success?session_id={{CHECKOUT_SESSION_ID}}",
+        "cancel_url": f"{host_url}payment/cancel",
+        "payment_intent_data": {
+            "application_fee_amount": 0,  # No fee for deposits
+            "transfer_data": {
+                "destination": stripe_account_id,
+            },
+        },
+        "metadata": {
+            "type": "appointment"
+        }
+    }
+
 def create_boost_session(data):
     try:
-        # Validate required fields
-        required_fields = ['productId', 'duration', 'priceId', 'buyerId']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"Missing required field: {field}"}), 400
-        
-        # Extract data
-        product_id = data['productId']
-        duration = data['duration']
-        price_id = data['priceId']
-        buyer_id = data['buyerId']
+        session_params = boost_session_params(data, request.host_url)
         
         # Create a Stripe Checkout Session
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[
-                {
-                    "price": price_id,
-                    "quantity": 1,
-                }
-            ],
-            mode="payment",
-            success_url=f"{request.host_url}payment/success?type=boost&session_id={{CHECKOUT_SESSION_ID}}",
-            cancel_url=f"{request.host_url}payment/cancel",
-            metadata={
-                "productId": product_id,
-                "duration": duration,
-                "userId": buyer_id,
-                "type": "boost"
-            },
-            client_reference_id=buyer_id,
-        )
+        session = stripe.checkout.Session.create(**session_params)
         
         return jsonify({"id": session.id, "url": session.url})
     
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    except stripe.error.RateLimitError as e:
+        return stripe_rate_limited_response(e)
     except Exception as e:
         print(f"Error creating boost session: {e}")
         return jsonify({"error": str(e)}), 500
 
+def boost_session_params(data, host_url):
+    # Validate required fields
+    data = BOOST_SESSION_SCHEMA(data)
+    
+    # Extract data
+    product_id = data['productId']
+    duration = data['duration']
+    price_id = data['priceId']
+    buyer_id = data['buyerId']
+    
+    return {
+        "payment_method_types": ['card'],
+        "line_items": [
+            {
+                "price": price_id,
+                "quantity": 1,
+            }
+        ],
+        "mode": "payment",
+        "success_url": f"{host_url}payment/success?type=boost&session_id={{CHECKOUT_SESSION_ID}}",
+        "cancel_url": f"{host_url}payment/cancel",
+        "metadata": {
+            "productId": product_id,
+            "duration": duration,
+            "userId": buyer_id,
+            "type": "boost"
+        },
+        "client_reference_id": buyer_id
+    }
+
+def circuit_open_response(e):
+    # Mondial Relay en panne (circuit ouvert) : 503 immédiat avec Retry-After
+    response = jsonify({"error": "Mondial Relay temporarily unavailable", "retryAfter": e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+class MondialRelayError(Exception):
+    # Erreur upstream Mondial Relay, avec le corps JSON à renvoyer au client
+    def __init__(self, payload, status_code=500):
+        super().__init__(payload.get('error'))
+        self.payload = payload
+        self.status_code = status_code
+
 def get_relay_points():
     try:
-        data = request.json
-        postal_code = data.get('postalCode')
+        data = request.get_json(silent=True)
+        country, postal_code, limit, latitude, longitude = relay_points_query(data)
+        RELAY_POINTS_STORE.start()
         
+        # Recherche par coordonnées : directement dans la base locale
         if not postal_code:
-            return jsonify({"error": "Missing postalCode"}), 400
-        
-        # Récupération des credentials depuis .env
-        brand_id = os.getenv('MONDIALRELAY_BRAND_ID', 'CC22UCDZ')
-        api_password = os.getenv('MONDIALRELAY_API_PASSWORD', '@YeVkNvuZ*py]nSB7:Dq')
-        
-        # Construction du payload XML avec namespaces corrects
-        soap_request = f"""<?xml version="1.0" encoding="utf-8"?>
-        <soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" 
-                       xmlns:mr="http://www.mondialrelay.fr/webservice/">
-            <soap:Body>
-                <mr:WSI4_PointRelais_Recherche>
-                    <mr:Enseigne>{brand_id}</mr:Enseigne>
-                    <mr:Pays>FR</mr:Pays>
-                    <mr:CP>{postal_code}</mr:CP>
-                    <mr:NombreResultats>20</mr:NombreResultats>
-                    <mr:Security>{api_password}</mr:Security>
-                </mr:WSI4_PointRelais_Recherche>
-            </soap:Body>
-        </soap:Envelope>"""
-        
-        # Envoi de la requête
-        response = requests.post(
-            "https://api.mondialrelay.com/Web_Services.asmx",
-            data=soap_request,
-            headers={'Content-Type': 'text/xml; charset=utf-8'}
-        )
+            relay_points = RELAY_POINTS_STORE.nearest(float(latitude), float(longitude), k=limit)
+            return jsonify({'relay_points': relay_points, 'source': 'offline'})
         
-        # Vérification de la réponse
-        if response.status_code != 200:
-            return jsonify({
-                "error": f"Mondial Relay API error: {response.status_code}",
-                "details": response.text[:200]
-            }), 500
-        
-        # Parsing avec gestion des namespaces
-        root = ET.fromstring(response.content)
-        namespaces = {
-            'soap': 'http://schemas.xmlsoap.org/soap/envelope/',
-            'mr': 'http://www.mondialrelay.fr/webservice/'
-        }
+        # Les résultats changent peu : on sert depuis le cache (country, CP, nombre)
+        key = (country, postal_code, limit)
+        try:
+            relay_points = RELAY_POINTS_CACHE.get_or_load(key, lambda: load_relay_points(*key))
+        except Exception as e:
+            relay_points, source = relay_points_fallback(key)
+            if not relay_points:
+                raise
+            print(f"Mondial Relay unavailable, serving {source} relay points: {e}")
+            return jsonify({'relay_points': relay_points, 'source': source})
         
-        # Extraction sécurisée des points relais
-        relay_points = []
-        for point in root.findall(".//mr:PointRelais_Details", namespaces):
-            # Fonction helper pour les champs texte
-            get_text = lambda el: point.findtext(f'mr:{el}', namespaces=namespaces) or ''
-            
-            # Gestion des horaires
-            livraison = point.findtext('mr:Horaires_Livraison/mr:string', namespaces=namespaces) or ''
-            retrait = point.findtext('mr:Horaires_Retrait/mr:string', namespaces=namespaces) or ''
-            opening_hours = livraison if livraison else retrait
-            
-            # Construction de l'objet avec valeurs par défaut
-            relay_point = {
-                'id': get_text('Num') or f'unknown-{uuid.uuid4().hex[:8]}',
-                'name': get_text('LgAdr1'),
-                'address': f"{get_text('LgAdr3')} {get_text('LgAdr4')}".strip(),
-                'postalCode': get_text('CP'),
-                'city': get_text('Ville'),
-                'distance': float(get_text('Distance') or 0),
-                'openingHours': opening_hours or 'Non communiqué',
-                'photoUrl': ''
-            }
-            
-            # Nettoyage final des valeurs null
-            relay_point = {k: v if v is not None else '' for k, v in relay_point.items()}
-            relay_points.append(relay_point)
-            
         return jsonify({'relay_points': relay_points})
         
-    except ET.ParseError as e:
-        return jsonify({
-            "error": "XML parsing error",
-            "details": str(e),
-            "response": response.text[:500] if 'response' in locals() else None
-        }), 500
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except MondialRelayError as e:
+        return jsonify(e.payload), e.status_code
     except Exception as e:
         return jsonify({
             "error": str(e),
             "stack": traceback.format_exc()
         }), 500
 
+def relay_points_fallback(key):
+    # API indisponible : derniers résultats connus pour cette recherche, même
+    # expirés, sinon la base locale autour du code postal. Renvoie (points, source)
+    relay_points = RELAY_POINTS_CACHE.last_value(key)
+    if relay_points:
+        return relay_points, 'stale'
+    country, postal_code, limit = key
+    return RELAY_POINTS_STORE.nearest(postal_code=postal_code, k=limit), 'offline'
+
+def relay_points_query(data):
+    # Renvoie (pays, code postal, nombre, latitude, longitude)
+    data = RELAY_POINTS_SCHEMA(data)
+    postal_code = str(data.get('postalCode') or '').strip()
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+    
+    if not postal_code and (latitude is None or longitude is None):
+        raise ValidationError("Missing postalCode")
+    
+    country = str(data.get('country') or 'FR').upper()
+    limit = min(max(int(data.get('limit', RELAY_POINTS_DEFAULT_LIMIT)), 1), RELAY_POINTS_MAX_LIMIT)
+    return country, postal_code, limit, latitude, longitude
+
+def load_relay_points(country, postal_code, limit):
+    relay_points = fetch_relay_points(country, postal_code, limit)
+    RELAY_POINTS_STORE.add_points(relay_points)
+    return relay_points
+
+def fetch_relay_points(country, postal_code, limit):
+    # Envoi de la requête
+    # La recherche est idempotente : elle peut être relancée en cas d'échec
+    response = MONDIAL_RELAY_CLIENT.post(
+        MONDIAL_RELAY_SOAP_URL,
+        data=relay_points_soap_request(country, postal_code, limit),
+        headers={'Content-Type': 'text/xml; charset=utf-8'},
+        idempotent=True,
+        operation='WSI4_PointRelais_Recherche'
+    )
+    return parse_relay_points_response(response)
+
+def relay_points_soap_request(country, postal_code, limit):
+    # Récupération des credentials depuis .env
+    brand_id = os.getenv('MONDIALRELAY_BRAND_ID', 'CC22UCDZ')
+    api_password = os.getenv('MONDIALRELAY_API_PASSWORD', '@YeVkNvuZ*py]nSB7:Dq')
+    
+    # Construction du payload XML avec namespaces corrects
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+    <soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" 
+                   xmlns:mr="http://www.mondialrelay.fr/webservice/">
+        <soap:Body>
+            <mr:WSI4_PointRelais_Recherche>
+                <mr:Enseigne>{brand_id}</mr:Enseigne>
+                <mr:Pays>{country}</mr:Pays>
+                <mr:CP>{postal_code}</mr:CP>
+                <mr:NombreResultats>{limit}</mr:NombreResultats>
+                <mr:Security>{api_password}</mr:Security>
+            </mr:WSI4_PointRelais_Recherche>
+        </soap:Body>
+    </soap:Envelope>"""
+
+def parse_relay_points_response(response):
+    # Vérification de la réponse (requests ou httpx)
+    if response.status_code != 200:
+        raise MondialRelayError({
+            "error": f"Mondial Relay API error: {response.status_code}",
+            "details": response.text[:200]
+        })
+    
+    try:
+        return parse_relay_points(response.content)
+    except ET.ParseError as e:
+        raise MondialRelayError({
+            "error": "XML parsing error",
+            "details": str(e),
+            "response": response.text[:500]
+        })
+
+def parse_relay_points(content):
+    # Parsing avec gestion des namespaces
+    root = ET.fromstring(content)
+    namespaces = {
+        'soap': 'http://schemas.xmlsoap.org/soap/envelope/',
+        'mr': 'http://www.mondialrelay.fr/webservice/'
+    }
+    
+    # Extraction sécurisée des points relais
+    relay_points = []
+    for point in root.findall(".//mr:PointRelais_Details", namespaces):
+        # Fonction helper pour les champs texte
+        get_text = lambda el: point.findtext(f'mr:{el}', namespaces=namespaces) or ''
+        
+        # Gestion des horaires
+        livraison = point.findtext('mr:Horaires_Livraison/mr:string', namespaces=namespaces) or ''
+        retrait = point.findtext('mr:Horaires_Retrait/mr:string', namespaces=namespaces) or ''
+        opening_hours = livraison if livraison else retrait
+        
+        # Construction de l'objet avec valeurs par défaut
+        relay_point = {
+            'id': get_text('Num') or f'unknown-{uuid.uuid4().hex[:8]}',
+            'name': get_text('LgAdr1'),
+            'address': f"{get_text('LgAdr3')} {get_text('LgAdr4')}".strip(),
+            'postalCode': get_text('CP'),
+            'city': get_text('Ville'),
+            'distance': float(get_text('Distance') or 0),
+            'openingHours': opening_hours or 'Non communiqué',
+            'photoUrl': '',
+            'latitude': parse_coordinate(get_text('Latitude')),
+            'longitude': parse_coordinate(get_text('Longitude'))
+        }
+        
+        # Nettoyage final des valeurs null (sauf coordonnées, absentes si inconnues)
+        relay_point = {k: v if v is not None or k in ('latitude', 'longitude') else '' for k, v in relay_point.items()}
+        relay_points.append(relay_point)
+    
+    return relay_points
+
+def parse_coordinate(value):
+    # Mondial Relay renvoie les coordonnées au format français ("48,856614")
+    try:
+        return float(value.strip().replace(',', '.')) if value and value.strip() else None
+    except ValueError:
+        return None
+
 # Fonction pour créer une étiquette d'expédition
 def create_shipping_label(data):
     try:
-        # Valider les données requises
-        required_fields = ['buyer', 'seller', 'relayPoint', 'productId']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"Missing required field: {field}"}), 400
-
-        buyer = data['buyer']
-        seller = data['seller']
-        relay_point = data['relayPoint']
-        product_id = data['productId']
-
-        # Construire le payload XML pour Mondial Relay
-        soap_request = f"""<?xml version="1.0" encoding="utf-8"?>
-        <soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" 
-                       xmlns:mr="http://www.mondialrelay.fr/webservice/">
-            <soap:Body>
-                <mr:WSI2_CreationEtiquette>
-                    <mr:Enseigne>{MONDIAL_RELAY_BRAND_ID}</mr:Enseigne>
-                    <mr:ModeCol>CCC</mr:ModeCol>
-                    <mr:ModeLiv>24R</mr:ModeLiv>
-                    <mr:NDossier></mr:NDossier>
-                    <mr:NExpedition></mr:NExpedition>
-                    <mr:Expe_Langage>FR</mr:Expe_Langage>
-                    <mr:Expe_Ad1>{seller['fullName']}</mr:Expe_Ad1>
-                    <mr:Expe_Ad3>{seller['street']}</mr:Expe_Ad3>
-                    <mr:Expe_Ville>{seller['city']}</mr:Expe_Ville>
-                    <mr:Expe_CP>{seller['postalCode']}</mr:Expe_CP>
-                    <mr:Expe_Pays>FR</mr:Expe_Pays>
-                    <mr:Expe_Tel1>{seller['phone']}</mr:Expe_Tel1>
-                    <mr:Expe_Mail></mr:Expe_Mail>
-                    <mr:Dest_Langage>FR</mr:Dest_Langage>
-                    <mr:Dest_Ad1>{buyer['fullName']}</mr:Dest_Ad1>
-                    <mr:Dest_Ad3>{relay_point['address']}</mr:Dest_Ad3>
-                    <mr:Dest_Ville>{relay_point['city']}</mr:Dest_Ville>
-                    <mr:Dest_CP>{relay_point['postalCode']}</mr:Dest_CP>
-                    <mr:Dest_Pays>FR</mr:Dest_Pays>
-                    <mr:Dest_Tel1>{buyer['phone']}</mr:Dest_Tel1>
-                    <mr:Dest_Mail></mr:Dest_Mail>
-                    <mr:Poids>500</mr:Poids>
-                    <mr:Longueur>20</mr:Longueur>
-                    <mr:Taille>10</mr:Taille>
-                    <mr:NbColis>1</mr:NbColis>
-                    <mr:CRT_Valeur>0</mr:CRT_Valeur>
-                    <mr:CRT_Devise>EUR</mr:CRT_Devise>
-                    <mr:Exp_Valeur>0</mr:Exp_Valeur>
-                    <mr:Exp_Devise>EUR</mr:Exp_Devise>
-                    <mr:COL_Rel_Pays>FR</mr:COL_Rel_Pays>
-                    <mr:COL_Rel></mr:COL_Rel>
-                    <mr:LIV_Rel_Pays>FR</mr:LIV_Rel_Pays>
-                    <mr:LIV_Rel>{relay_point['id']}</mr:LIV_Rel>
-                    <mr:TAvisage>N</mr:TAvisage>
-                    <mr:TReprise>N</mr:TReprise>
-                    <mr:Montage>0</mr:Montage>
-                    <mr:TRDV>N</mr:TRDV>
-                    <mr:Assurance>0</mr:Assurance>
-                    <mr:Instructions></mr:Instructions>
-                    <mr:Security>{hashlib.md5(f"{MONDIAL_RELAY_BRAND_ID}{MONDIAL_RELAY_API_PASSWORD}".encode()).hexdigest().upper()}</mr:Security>
-                </mr:WSI2_CreationEtiquette>
-            </soap:Body>
-        </soap:Envelope>"""
+        soap_request = shipping_label_soap_request(data)
 
         # Envoyer la requête à l'API Mondial Relay
-        response = requests.post(
+        response = MONDIAL_RELAY_CLIENT.post(
             MONDIAL_RELAY_API_URL,
             data=soap_request,
-            headers={'Content-Type': 'text/xml; charset=utf-8'}
+            headers={'Content-Type': 'text/xml; charset=utf-8'},
+            operation='WSI2_CreationEtiquette'
         )
 
-        # Vérifier la réponse
-        if response.status_code != 200:
-            return jsonify({
-                "error": f"Mondial Relay API error: {response.status_code}",
-                "details": response.text
-            }), 500
-
-        # Parser la réponse XML
-        root = ET.fromstring(response.content)
-        namespaces = {
-            'soap': 'http://schemas.xmlsoap.org/soap/envelope/',
-            'mr': 'http://www.mondialrelay.fr/webservice/'
-        }
-
-        # Vérifier si la création a réussi
-        stat = root.findtext('.//mr:Stat', namespaces=namespaces)
-        if stat != "0":
-            error_message = root.findtext('.//mr:Libelle', namespaces=namespaces) or "Unknown error"
-            return jsonify({"error": f"Mondial Relay error: {error_message}"}), 400
-
-        # Récupérer l'URL du PDF
-        pdf_url = root.findtext('.//mr:URL_PDF', namespaces=namespaces)
-        if not pdf_url:
-            return jsonify({"error": "No PDF URL in response"}), 500
-
+        pdf_url = parse_shipping_label_response(response)
         return jsonify({"pdfUrl": pdf_url})
 
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except MondialRelayError as e:
+        return jsonify(e.payload), e.status_code
     except Exception as e:
         print(f"Error in create_shipping_label: {e}")
         return jsonify({"error": str(e)}), 500
 
+def shipping_label_soap_request(data):
+    # Valider les données requises
+    data = SHIPPING_LABEL_SCHEMA(data)
+
+    buyer = data['buyer']
+    seller = data['seller']
+    relay_point = data['relayPoint']
+    product_id = data['productId']
+
+    # Construire le payload XML pour Mondial Relay
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+    <soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" 
+                   xmlns:mr="http://www.mondialrelay.fr/webservice/">
+        <soap:Body>
+            <mr:WSI2_CreationEtiquette>
+                <mr:Enseigne>{MONDIAL_RELAY_BRAND_ID}</mr:Enseigne>
+                <mr:ModeCol>CCC</mr:ModeCol>
+                <mr:ModeLiv>24R</mr:ModeLiv>
+                <mr:NDossier></mr:NDossier>
+                <mr:NExpedition></mr:NExpedition>
+                <mr:Expe_Langage>FR</mr:Expe_Langage>
+                <mr:Expe_Ad1>{seller['fullName']}</mr:Expe_Ad1>
+                <mr:Expe_Ad3>{seller['street']}</mr:Expe_Ad3>
+                <mr:Expe_Ville>{seller['city']}</mr:Expe_Ville>
+                <mr:Expe_CP>{seller['postalCode']}</mr:Expe_CP>
+                <mr:Expe_Pays>FR</mr:Expe_Pays>
+                <mr:Expe_Tel1>{seller['phone']}</mr:Expe_Tel1>
+                <mr:Expe_Mail></mr:Expe_Mail>
+                <mr:Dest_Langage>FR</mr:Dest_Langage>
+                <mr:Dest_Ad1>{buyer['fullName']}</mr:Dest_Ad1>
+                <mr:Dest_Ad3>{relay_point['address']}</mr:Dest_Ad3>
+                <mr:Dest_Ville>{relay_point['city']}</mr:Dest_Ville>
+                <mr:Dest_CP>{relay_point['postalCode']}</mr:Dest_CP>
+                <mr:Dest_Pays>FR</mr:Dest_Pays>
+                <mr:Dest_Tel1>{buyer['phone']}</mr:Dest_Tel1>
+                <mr:Dest_Mail></mr:Dest_Mail>
+                <mr:Poids>500</mr:Poids>
+                <mr:Longueur>20</mr:Longueur>
+                <mr:Taille>10</mr:Taille>
+                <mr:NbColis>1</mr:NbColis>
+                <mr:CRT_Valeur>0</mr:CRT_Valeur>
+                <mr:CRT_Devise>EUR</mr:CRT_Devise>
+                <mr:Exp_Valeur>0</mr:Exp_Valeur>
+                <mr:Exp_Devise>EUR</mr:Exp_Devise>
+                <mr:COL_Rel_Pays>FR</mr:COL_Rel_Pays>
+                <mr:COL_Rel></mr:COL_Rel>
+                <mr:LIV_Rel_Pays>FR</mr:LIV_Rel_Pays>
+                <mr:LIV_Rel>{relay_point['id']}</mr:LIV_Rel>
+                <mr:TAvisage>N</mr:TAvisage>
+                <mr:TReprise>N</mr:TReprise>
+                <mr:Montage>0</mr:Montage>
+                <mr:TRDV>N</mr:TRDV>
+                <mr:Assurance>0</mr:Assurance>
+                <mr:Instructions></mr:Instructions>
+                <mr:Security>{hashlib.md5(f"{MONDIAL_RELAY_BRAND_ID}{MONDIAL_RELAY_API_PASSWORD}".encode()).hexdigest().upper()}</mr:Security>
+            </mr:WSI2_CreationEtiquette>
+        </soap:Body>
+    </soap:Envelope>"""
+
+def parse_shipping_label_response(response):
+    # Vérifier la réponse
+    if response.status_code != 200:
+        raise MondialRelayError({
+            "error": f"Mondial Relay API error: {response.status_code}",
+            "details": response.text
+        })
+
+    # Parser la réponse XML
+    root = ET.fromstring(response.content)
+    namespaces = {
+        'soap': 'http://schemas.xmlsoap.org/soap/envelope/',
+        'mr': 'http://www.mondialrelay.fr/webservice/'
+    }
+
+    # Vérifier si la création a réussi
+    stat = root.findtext('.//mr:Stat', namespaces=namespaces)
+    if stat != "0":
+        error_message = root.findtext('.//mr:Libelle', namespaces=namespaces) or "Unknown error"
+        raise MondialRelayError({"error": f"Mondial Relay error: {error_message}"}, status_code=400)
+
+    # Récupérer l'URL du PDF
+    pdf_url = root.findtext('.//mr:URL_PDF', namespaces=namespaces)
+    if not pdf_url:
+        raise MondialRelayError({"error": "No PDF URL in response"})
+
+    return pdf_url
+
+def create_shipping_labels(data):
+    try:
+        data = SHIPPING_LABEL_BATCH_SCHEMA(data)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    labels = data['labels']
+    
+    if len(labels) > SHIPPING_LABEL_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Too many labels (max {SHIPPING_LABEL_BATCH_MAX_ITEMS})"}), 400
+    
+    # Un batchId déjà connu reprend le lot : les étiquettes déjà créées ne sont pas refaites
+    batch_id = str(data.get('batchId') or uuid.uuid4().hex)
+    LABEL_BATCH_STORE.purge()
+    # Un seul traitement par lot à la fois, y compris entre workers gunicorn
+    if not LABEL_BATCH_STORE.claim(batch_id, len(labels)):
+        return jsonify({"error": f"Batch {batch_id} is already being processed", "batchId": batch_id}), 409
+    completed = LABEL_BATCH_STORE.completed(batch_id)
+    
+    items = []
+    for index, label in enumerate(labels):
+        item_hash = payload_hash(label)
+        done = completed.get(index)
+        if not (done and done[0] == item_hash):
+            items.append((index, item_hash, label))
+    
+    # Les étiquettes sont créées en arrière-plan : la requête ne dépasse pas
+    # le timeout des workers, la progression se suit sur la route GET
+    start_label_batch(current_app._get_current_object(), batch_id, items)
+    return jsonify({
+        "batchId": batch_id,
+        "status": LABEL_BATCH_STORE.batch(batch_id)['status'],
+        "total": len(labels),
+        "resumed": len(labels) - len(items),
+        "pending": len(items)
+    }), 202
+
+def start_label_batch(flask_app, batch_id, items):
+    # items: [(index, payload_hash, label)] ; le lot est terminé au dernier élément enregistré.
+    # Les étiquettes sont créées dans le contexte de flask_app, l'application qui a reçu le lot
+    if not items:
+        LABEL_BATCH_STORE.finish(batch_id)
+        return
+    LABEL_BATCH_STORE.mark_pending(batch_id, [(index, item_hash) for index, item_hash, _ in items])
+    remaining = [len(items)]
+    lock = threading.Lock()
+    
+    def item_done(index, item_hash, future):
+        try:
+            pdf_url, error = future.result()
+            LABEL_BATCH_STORE.record(batch_id, index, item_hash, pdf_url=pdf_url, error=error)
+        except Exception as e:
+            print(f"Error recording label batch {batch_id} item {index}: {e}")
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            LABEL_BATCH_STORE.finish(batch_id)
+    
+    for index, item_hash, label in items:
+        future = SHIPPING_LABEL_EXECUTOR.submit(create_batch_shipping_label, flask_app, label)
+        future.add_done_callback(lambda f, index=index, item_hash=item_hash: item_done(index, item_hash, f))
+
+def create_batch_shipping_label(flask_app, label):
+    # Exécuté dans le pool : renvoie (pdf_url, erreur)
+    try:
+        if not isinstance(label, dict):
+            return None, "Label payload must be an object"
+        with flask_app.app_context():
+            response = create_shipping_label(label)
+            body, status_code = response if isinstance(response, tuple) else (response, 200)
+            body = body.get_json()
+        if status_code >= 400:
+            return None, body.get('error', f"HTTP {status_code}")
+        return body['pdfUrl'], None
+    except Exception as e:
+        print(f"Error in batch shipping label: {e}")
+        return None, str(e)
+
 def handle_successful_payment(session):
+    claimed = False
     try:
         metadata = session.get('metadata', {})
         payment_type = metadata.get('type', '')
         
+        if payment_type == 'cart':
+            return handle_cart_payment(session)
+        
         # Only handle product purchases
         if payment_type != 'product':
             return jsonify({"status": "ignored"}), 200
 
+        # Idempotence : une session de paiement ne produit qu'une seule étiquette
+        session_id = session.get('id')
+        if not session_id:
+            return jsonify({'error': "Missing checkout session id"}), 400
+        claim, cached_pdf_url = EVENT_STORE.claim_session(session_id)
+        if claim == DONE:
+            return jsonify({'status': 'shipping label created', 'pdfUrl': cached_pdf_url, 'duplicate': True}), 200
+        if claim == BUSY:
+            return jsonify({'error': f"Checkout session {session_id} is already being processed"}), 409
+        claimed = True
+
         # Extract necessary data from metadata
         product_id = metadata.get('productId')
         seller_id = metadata.get('sellerId')
         buyer_id = metadata.get('buyerId')
-        shipping_cost = metadata.get('shippingCost')
-        delivery_address = json.loads(metadata.get('deliveryAddress'))
-        relay_point = json.loads(metadata.get('relayPoint')) if metadata.get('relayPoint') else None
-        
-        # Fetch seller's address from database
-        if not supabase_client:
-            raise Exception("Supabase client not initialized")
-
-        # Fetch seller's profile
-        response = supabase_client.from_('profiles').select('metadata').eq('id', seller_id).execute()
-        if response.error:
-            raise Exception(f"Error fetching seller profile: {response.error.message}")
-        
-        if not response.data or len(response.data) == 0:
-            raise Exception(f"No profile found for seller ID: {seller_id}")
-        
-        seller_metadata = response.data[0].get('metadata', {})
-        seller_address = seller_metadata.get('shippingAddress', {})
-        
-        # Create shipping label
-        label_data = {
-            'buyer': {
-                'fullName': delivery_address.get('fullName'),
-                'phone': delivery_address.get('phone'),
-                'street': delivery_address.get('street'),
-                'postalCode': delivery_address.get('postalCode'),
-                'city': delivery_address.get('city'),
-                'country': delivery_address.get('country', 'FR')
-            },
-            'seller': {
-                'fullName': seller_address.get('fullName', 'Vendeur Shay Beauty'),
-                'phone': seller_address.get('phone', ''),
-                'street': seller_address.get('street', ''),
-                'postalCode': seller_address.get('postalCode', ''),
-                'city': seller_address.get('city', ''),
-                'country': seller_address.get('country', 'FR')
-            },
-            'relayPoint': relay_point,
-            'productId': product_id
-        }
-
-        # Call create_shipping_label
-        label_response = create_shipping_label(label_data)
-        if isinstance(label_response, tuple):
-            # If it returns a tuple, it's a Flask response (error case)
-            label_data = label_response[0].json
-            if 'error' in label_data:
-                raise Exception(f"Failed to create shipping label: {label_data['error']}")
-        else:
-            # This should be a JSON response from the function
-            label_data = label_response.json
-
-        pdf_url = label_data.get('pdfUrl')
-        if not pdf_url:
-            raise Exception("No PDF URL in label response")
-
-        # Send message to seller
-        message_content = f"Voici votre étiquette Mondial Relay à imprimer pour expédier le colis: {pdf_url}"
-        message_data = {
-            "sender_id": buyer_id,
-            "receiver_id": seller_id,
-            "content": message_content
-        }
-        insert_response = supabase_client.from_('messages').insert([message_data]).execute()
-        if insert_response.error:
-            print(f"Error inserting message: {insert_response.error.message}")
+        delivery_address = json_provider.loads(metadata.get('deliveryAddress'))
+        relay_point = json_provider.loads(metadata.get('relayPoint')) if metadata.get('relayPoint') else None
+        
+        pdf_url = ship_order(session_id, seller_id, buyer_id, product_id, delivery_address, relay_point)
+        claimed = False
 
-        return jsonify({'status': 'shipping label created'}), 200
+        return jsonify({'status': 'shipping label created', 'pdfUrl': pdf_url}), 200
 
+    except RetryLater:
+        # Remonte jusqu'à la file des webhooks, qui reprogramme l'événement
+        if claimed:
+            EVENT_STORE.release_session(session_id)
+        raise
     except Exception as e:
         print(f"Error handling successful payment: {e}")
+        if claimed:
+            EVENT_STORE.release_session(session_id)
         return jsonify({'error': str(e)}), 500
 
+def handle_cart_payment(session):
+    # Un colis (étiquette + transfert) par vendeur ; chaque vendeur est une unité
+    # idempotente, les vendeurs déjà traités sont sautés quand le webhook est rejoué
+    session_id = session.get('id')
+    if not session_id:
+        return jsonify({'error': "Missing checkout session id"}), 400
+    metadata = session.get('metadata', {})
+    buyer_id = metadata.get('buyerId')
+    delivery_address = json_provider.loads(metadata.get('deliveryAddress'))
+    relay_point = json_provider.loads(metadata.get('relayPoint')) if metadata.get('relayPoint') else None
+    sellers = [json_provider.loads(metadata[f"seller_{index}"]) for index in range(int(metadata.get('sellerCount', 0)))]
+    
+    charge_id = None
+    results = []
+    errors = []
+    deferred = None
+    for seller in sellers:
+        seller_id = seller['sellerId']
+        order_id = f"{session_id}:{seller_id}"
+        claim, cached_pdf_url = EVENT_STORE.claim_session(order_id)
+        if claim == DONE:
+            results.append({'sellerId': seller_id, 'pdfUrl': cached_pdf_url, 'duplicate': True})
+            continue
+        if claim == BUSY:
+            errors.append(f"{seller_id}: already being processed")
+            continue
+        
+        try:
+            progress = EVENT_STORE.progress(order_id)
+            # Pas de transfert tant que les étiquettes ne peuvent pas être créées
+            label_breaker = MONDIAL_RELAY_CLIENT.breaker('WSI2_CreationEtiquette')
+            if not progress['labelUrl'] and label_breaker.state == 'open':
+                raise RetryLater(label_breaker.retry_after(), "Shipping labels deferred: Mondial Relay circuit open")
+            if seller.get('stripeId') and not progress['transferred']:
+                if charge_id is None:
+                    charge_id = stripe.PaymentIntent.retrieve(session['payment_intent']).latest_charge
+                # La clé d'idempotence Stripe ne vaut que 24 h : le point de reprise
+                # enregistré ensuite protège des rejeus plus tardifs
+                stripe.Transfer.create(
+                    amount=seller['amount'],
+                    currency='eur',
+                    destination=seller['stripeId'],
+                    transfer_group=metadata.get('cartId'),
+                    source_transaction=charge_id,
+                    metadata={'sessionId': session_id, 'sellerId': seller_id},
+                    idempotency_key=f"transfer-{order_id}"
+                )
+                EVENT_STORE.record_transfer(order_id)
+            pdf_url = ship_order(order_id, seller_id, buyer_id, ','.join(seller['productIds']),
+                                 delivery_address, relay_point)
+            results.append({'sellerId': seller_id, 'pdfUrl': pdf_url})
+        except RetryLater as e:
+            EVENT_STORE.release_session(order_id)
+            deferred = e
+        except stripe.error.RateLimitError as e:
+            # Budget Stripe épuisé : report sans consommer de tentative
+            EVENT_STORE.release_session(order_id)
+            deferred = RetryLater(stripe_retry_after(e), f"Transfer deferred: {e}")
+        except Exception as e:
+            print(f"Error handling cart order {order_id}: {e}")
+            EVENT_STORE.release_session(order_id)
+            errors.append(f"{seller_id}: {e}")
+    
+    if errors:
+        return jsonify({'error': '; '.join(errors), 'sellers': results}), 500
+    if deferred is not None:
+        # Les vendeurs déjà servis sont sautés quand l'événement revient
+        raise deferred
+    return jsonify({'status': 'shipping labels created', 'sellers': results}), 200
+
+def ship_order(order_id, seller_id, buyer_id, product_id, delivery_address, relay_point):
+    # Étiquette Mondial Relay + message au vendeur ; renvoie l'URL du PDF.
+    # L'étiquette créée est enregistrée avant le message : si l'envoi échoue,
+    # le rejeu reprend au message sans créer de seconde étiquette
+    supabase_client = SUPABASE_CLIENT.get()
+    if not supabase_client:
+        raise Exception("Supabase client not initialized")
+
+    pdf_url = EVENT_STORE.progress(order_id)['labelUrl']
+    if not pdf_url:
+        pdf_url = create_order_label(supabase_client, seller_id, product_id, delivery_address, relay_point)
+        EVENT_STORE.record_label(order_id, pdf_url)
+
+    # Copie locale du PDF : les réimpressions ne repassent plus par Mondial Relay
+    label_url = pdf_url
+    try:
+        if not LABEL_STORE.lookup(order_id):
+            LABEL_STORE.fetch_and_store(order_id, pdf_url)
+        if PUBLIC_BASE_URL:
+            label_url = f"{PUBLIC_BASE_URL}/api/labels/{order_id}"
+    except Exception as e:
+        print(f"Error storing label PDF for {order_id}: {e}")
+
+    # Send message to seller
+    message_content = f"Voici votre étiquette Mondial Relay à imprimer pour expédier le colis: {label_url}"
+    message_data = {
+        "sender_id": buyer_id,
+        "receiver_id": seller_id,
+        "content": message_content
+    }
+    insert_response = supabase_execute('messages', 'insert', supabase_client.from_('messages').insert([message_data]))
+    if getattr(insert_response, 'error', None):
+        raise Exception(f"Error inserting message: {insert_response.error.message}")
+
+    # Commande terminée seulement une fois le vendeur prévenu
+    EVENT_STORE.complete_session(order_id, pdf_url)
+    return pdf_url
+
+def create_order_label(supabase_client, seller_id, product_id, delivery_address, relay_point):
+    # Fetch seller's profile
+    response = supabase_execute('profiles', 'select', supabase_client.from_('profiles').select('metadata').eq('id', seller_id))
+    # postgrest >= 0.10 lève APIError et ne renseigne plus response.error
+    if getattr(response, 'error', None):
+        raise Exception(f"Error fetching seller profile: {response.error.message}")
+    
+    if not response.data or len(response.data) == 0:
+        raise Exception(f"No profile found for seller ID: {seller_id}")
+    
+    seller_metadata = response.data[0].get('metadata', {})
+    seller_address = seller_metadata.get('shippingAddress', {})
+    
+    # Create shipping label
+    label_data = {
+        'buyer': {
+            'fullName': delivery_address.get('fullName'),
+            'phone': delivery_address.get('phone'),
+            'street': delivery_address.get('street'),
+            'postalCode': delivery_address.get('postalCode'),
+            'city': delivery_address.get('city'),
+            'country': delivery_address.get('country', 'FR')
+        },
+        'seller': {
+            'fullName': seller_address.get('fullName', 'Vendeur Shay Beauty'),
+            'phone': seller_address.get('phone', ''),
+            'street': seller_address.get('street', ''),
+            'postalCode': seller_address.get('postalCode', ''),
+            'city': seller_address.get('city', ''),
+            'country': seller_address.get('country', 'FR')
+        },
+        'relayPoint': relay_point,
+        'productId': product_id
+    }
+
+    # Call create_shipping_label
+    label_response = create_shipping_label(label_data)
+    if isinstance(label_response, tuple):
+        # If it returns a tuple, it's a Flask response (error case)
+        label_data = label_response[0].json
+        if 'retryAfter' in label_data:
+            # Circuit ouvert : la commande est reportée, pas mise en échec
+            raise RetryLater(label_data['retryAfter'], f"Shipping label deferred: {label_data['error']}")
+        if 'error' in label_data:
+            raise Exception(f"Failed to create shipping label: {label_data['error']}")
+    else:
+        # This should be a JSON response from the function
+        label_data = label_response.json
+
+    pdf_url = label_data.get('pdfUrl')
+    if not pdf_url:
+        raise Exception("No PDF URL in label response")
+    return pdf_url
+
+# Traitement asynchrone des webhooks (appelé par les workers de la file)
+QUEUED_WEBHOOK_EVENTS = {'checkout.session.completed'}
+
+def process_webhook_event(event):
+    if event['type'] == 'checkout.session.completed':
+        with WEBHOOK_APP.app_context():
+            response = handle_successful_payment(event['data']['object'])
+        body, status_code = response if isinstance(response, tuple) else (response, 200)
+        if status_code >= 400:
+            raise Exception(body.get_json().get('error', f"HTTP {status_code}"))
+        EVENT_STORE.mark_event(event['id'], event['data']['object'].get('id'))
+
+WEBHOOK_QUEUE = WebhookQueue(
+    path=os.getenv('WEBHOOK_QUEUE_PATH', os.path.join(DATA_DIR, 'webhook_queue.db')),
+    handler=process_webhook_event,
+    workers=int(os.getenv('WEBHOOK_WORKERS', 4)),
+    max_attempts=int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 8))
+)
+WEBHOOK_APP = None
+
+def start_webhook_workers(flask_app):
+    # Les workers traitent les événements dans le contexte de l'application
+    # qui les a démarrés (une seule file par processus)
+    global WEBHOOK_APP
+    if WEBHOOK_APP is None:
+        WEBHOOK_APP = flask_app
+    WEBHOOK_QUEUE.start()
+
+def admin_unauthorized():
+    # None si la requête porte le jeton d'administration, sinon la réponse 401
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if ADMIN_TOKEN and scheme == 'Bearer' and hmac.compare_digest(token, ADMIN_TOKEN):
+        return None
+    return jsonify({"error": "Unauthorized"}), 401
+
 def handle_cors():
     response = jsonify({"message": "CORS preflight request"})
     response.headers.add('Access-Control-Allow-Origin', '*')
@@ -939,16 +1936,42 @@ def handle_cors():
     response.headers.add('Access-Control-Allow-Methods', 'GET,POST,PUT,DELETE,OPTIONS')
     return response
 
-# Serve static files from the dist directory
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
+# Serve static files from the dist directory, indexed once at startup
+DIST_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dist')
+STATIC_ASSETS = StaticAssets(
+    DIST_FOLDER,
+    memory_max_bytes=int(os.getenv('STATIC_MEMORY_MAX_BYTES', 256 * 1024))
+)
+
+@bp.route('/', defaults={'path': ''})
+@bp.route('/<path:path>')
 def serve(path):
-    if path and os.path.exists(app.static_folder + '/' + path):
-        return send_from_directory(app.static_folder, path)
-    else:
-        return send_from_directory(app.static_folder, 'index.html')
+    response = STATIC_ASSETS.serve(request, path)
+    if response is None:
+        return jsonify({"error": "Not found"}), 404
+    return response
+
+def create_app():
+    # Les fichiers du front (dist/) sont servis par la route catch-all via un manifeste
+    flask_app = Flask(__name__, static_folder=None)
+    flask_app.json = FastJSONProvider(flask_app)
+    CORS(flask_app, resources={r"/*": {"origins": "*"}})
+    flask_app.request_class = UploadRequest
+    flask_app.register_blueprint(bp)
+    metrics.init_app(flask_app)
+    profiler.init_app(flask_app)
+    STATIC_ASSETS.index()
+    return flask_app
+
+# Module-level app for `gunicorn server:app` and asgi.py
+app = create_app()
+
+SERVER_IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+print(f"✅ server.py imported in {1000 * SERVER_IMPORT_SECONDS:.1f} ms")
 
 if __name__ == '__main__':
+    # Dev server only; production runs under gunicorn (see gunicorn.conf.py)
     port = int(os.environ.get('PORT', 5000))
-    print(f"✅ Starting server on port {port}")
-    app.run(host='0.0.0.0', port=port, debug=True)
+    debug = os.getenv('FLASK_DEBUG', '').lower() in ('1', 'true')
+    print(f"✅ Starting development server on port {port} (debug={debug})")
+    app.run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,143 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import Response, send_file
+
+try:
+    import brotli
+except ImportError:  # Optional: in-memory brotli variants are skipped without it
+    brotli = None
+
+# Vite emits content-hashed names such as assets/index-4f3a9c1b.js
+HASHED_ASSET_RE = re.compile(r'^assets/.+-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$')
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml',
+                      'application/xml', 'application/manifest+json')
+ENCODING_SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+
+class _Variant:
+    __slots__ = ('path', 'data', 'size', 'etag')
+
+    def __init__(self, path, data, size, etag):
+        self.path = path
+        self.data = data
+        self.size = size
+        self.etag = etag
+
+
+class _Asset:
+    __slots__ = ('mimetype', 'cache_control', 'variants')
+
+    def __init__(self, mimetype, cache_control):
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.variants = {}  # encoding ('identity', 'br', 'gzip') -> _Variant
+
+
+class StaticAssets:
+    """In-memory manifest of the built SPA in `dist/`.
+
+    The directory is indexed once: each file gets a content ETag, its
+    pre-built .br/.gz siblings, and small files are kept in memory (with
+    gzip/brotli variants computed up front when none were shipped).
+    """
+
+    def __init__(self, root, memory_max_bytes=256 * 1024, fallback='index.html'):
+        self.root = root
+        self.memory_max_bytes = memory_max_bytes
+        self.fallback = fallback
+        self.manifest = {}
+
+    def index(self):
+        manifest = {}
+        if os.path.isdir(self.root):
+            for directory, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    if filename.endswith(('.br', '.gz')):
+                        continue
+                    full_path = os.path.join(directory, filename)
+                    rel_path = os.path.relpath(full_path, self.root).replace(os.sep, '/')
+                    manifest[rel_path] = self._index_file(rel_path, full_path)
+        self.manifest = manifest
+        in_memory = sum(1 for asset in manifest.values() if asset.variants['identity'].data is not None)
+        print(f"✅ Indexed {len(manifest)} static files from {self.root} ({in_memory} in memory)")
+        return manifest
+
+    def _index_file(self, rel_path, full_path):
+        mimetype = mimetypes.guess_type(rel_path)[0] or 'application/octet-stream'
+        cache_control = IMMUTABLE_CACHE_CONTROL if HASHED_ASSET_RE.search(rel_path) else REVALIDATE_CACHE_CONTROL
+        asset = _Asset(mimetype, cache_control)
+
+        with open(full_path, 'rb') as f:
+            content = f.read()
+        etag = hashlib.sha1(content).hexdigest()[:20]
+        small = len(content) <= self.memory_max_bytes
+        asset.variants['identity'] = _Variant(full_path, content if small else None, len(content), etag)
+
+        for encoding, suffix in ENCODING_SUFFIXES:
+            variant_path = full_path + suffix
+            if os.path.exists(variant_path):
+                size = os.path.getsize(variant_path)
+                data = None
+                if size <= self.memory_max_bytes:
+                    with open(variant_path, 'rb') as f:
+                        data = f.read()
+                asset.variants[encoding] = _Variant(variant_path, data, size, f"{etag}-{encoding}")
+
+        # Small text files without shipped variants are compressed once here
+        if small and mimetype.startswith(COMPRESSIBLE_TYPES) and len(content) > 1024:
+            if 'gzip' not in asset.variants:
+                data = gzip.compress(content, compresslevel=9, mtime=0)
+                if len(data) < len(content):
+                    asset.variants['gzip'] = _Variant(None, data, len(data), f"{etag}-gzip")
+            if 'br' not in asset.variants and brotli is not None:
+                data = brotli.compress(content)
+                if len(data) < len(content):
+                    asset.variants['br'] = _Variant(None, data, len(data), f"{etag}-br")
+        return asset
+
+    def lookup(self, path):
+        # Unknown paths fall back to the SPA entry point
+        asset = self.manifest.get(path)
+        if asset is None:
+            return self.manifest.get(self.fallback), True
+        return asset, False
+
+    def serve(self, request, path):
+        asset, is_fallback = self.lookup(path)
+        if asset is None:
+            return None
+
+        encoding = 'identity'
+        for candidate, _ in ENCODING_SUFFIXES:
+            if candidate in asset.variants and request.accept_encodings[candidate] > 0:
+                encoding = candidate
+                break
+        variant = asset.variants[encoding]
+
+        if variant.data is not None:
+            response = Response(variant.data, mimetype=asset.mimetype)
+            response.set_etag(variant.etag)
+            response.make_conditional(request, accept_ranges=True, complete_length=variant.size)
+        else:
+            response = send_file(variant.path, mimetype=asset.mimetype, conditional=True, etag=variant.etag)
+
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        if len(asset.variants) > 1:
+            response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL if is_fallback else asset.cache_control
+        return response
+
+    def stats(self):
+        return {
+            "files": len(self.manifest),
+            "inMemory": sum(1 for a in self.manifest.values() if a.variants['identity'].data is not None),
+            "compressedVariants": sum(len(a.variants) - 1 for a in self.manifest.values()),
+        }
@@ -0,0 +1,56 @@
+import time
+from urllib.parse import urlsplit
+
+import stripe
+
+import metrics
+from rate_limiter import RateLimitExceeded, backoff_seconds
+
+
+def rate_limit_error(e):
+    # Same exception type as a 429 from Stripe itself, so callers handle both alike
+    return stripe.error.RateLimitError(
+        str(e), http_status=429, headers={'Retry-After': str(e.retry_after)}, code='rate_limit'
+    )
+
+
+class InstrumentedRequestsClient(stripe.http_client.RequestsClient):
+    """stripe-python's requests client, with each API call timed per endpoint.
+
+    `limiter(method, path)` returns the (TokenBucket, priority) the call
+    must take a token from, or (None, None). A 429 answer throttles that
+    bucket and the call is retried, up to `rate_limit_retries` times.
+    Installed as `stripe.default_http_client` when stripe is first loaded
+    (see configure_stripe in server.py).
+    """
+
+    def __init__(self, limiter=None, rate_limit_retries=3, **kwargs):
+        super().__init__(**kwargs)
+        self.limiter = limiter
+        self.rate_limit_retries = rate_limit_retries
+
+    def request(self, method, url, headers, post_data=None):
+        path = urlsplit(url).path
+        operation = f"{method.upper()} {metrics.normalize_path(path)}"
+        bucket, priority = self.limiter(method.upper(), path) if self.limiter else (None, None)
+
+        for attempt in range(1 + self.rate_limit_retries):
+            if bucket is not None:
+                try:
+                    bucket.acquire(priority)
+                except RateLimitExceeded as e:
+                    metrics.observe_upstream('stripe', operation, 'rate_limited', 0.0)
+                    raise rate_limit_error(e) from None
+
+            start = time.perf_counter()
+            try:
+                response = super().request(method, url, headers, post_data)
+            except Exception:
+                metrics.observe_upstream('stripe', operation, 'error', time.perf_counter() - start)
+                raise
+            metrics.observe_upstream('stripe', operation, response[1], time.perf_counter() - start)
+
+            if response[1] != 429 or bucket is None or attempt == self.rate_limit_retries:
+                return response
+            # 429 : la requête n'a pas été exécutée, on peut la rejouer
+            bucket.throttle(backoff_seconds(response[2], attempt))
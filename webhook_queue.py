@@ -0,0 +1,245 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import traceback
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id TEXT NOT NULL UNIQUE,
+    event_type TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    locked_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_webhook_events_ready ON webhook_events (status, available_at);
+CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    failed_at REAL NOT NULL
+);
+"""
+
+
+class RetryLater(Exception):
+    # Raised by the handler when a dependency is known to be down (open
+    # circuit): the event is rescheduled without counting as a failed attempt
+    def __init__(self, delay, reason=''):
+        super().__init__(reason or f"retry in {delay}s")
+        self.delay = delay
+
+
+def connect(path):
+    # One connection per thread; WAL lets gunicorn workers share the file
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=30000')
+    return conn
+
+
+class WebhookQueue:
+    """Durable SQLite-backed queue for Stripe webhook events.
+
+    `enqueue` commits the event before the webhook is acknowledged; a pool
+    of background threads drains it through `handler(event)`, retrying
+    with exponential backoff and moving exhausted events to a dead-letter
+    table. Claims are leased so events held by a crashed worker come back.
+    A handler raising RetryLater defers the event without using an attempt.
+    """
+
+    def __init__(self, path, handler, workers=4, max_attempts=8, base_delay=5.0,
+                 max_delay=900.0, lease_seconds=300.0, poll_interval=1.0):
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self.counters = {"enqueued": 0, "processed": 0, "retried": 0, "deferred": 0, "deadLettered": 0}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = connect(self.path)
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name, n=1):
+        with self._counters_lock:
+            self.counters[name] += n
+
+    def start(self):
+        # Cheap to call on every request: starts the pool once per process
+        if self._started_pid == os.getpid() or self.workers <= 0:
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self._worker_loop, name=f"webhook-worker-{i}", daemon=True).start()
+
+    def enqueue(self, event_id, event_type, payload):
+        if not isinstance(payload, str):
+            payload = json.dumps(payload)
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT OR IGNORE INTO webhook_events (event_id, event_type, payload, available_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (event_id, event_type, payload, now, now)
+        )
+        inserted = cursor.rowcount == 1
+        if inserted:
+            self._count("enqueued")
+            self._wakeup.set()
+        return inserted
+
+    def _claim(self):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT id, event_id, event_type, payload, attempts, created_at FROM webhook_events "
+                "WHERE (status = 'pending' AND available_at <= ?) "
+                "OR (status = 'processing' AND locked_until <= ?) "
+                "ORDER BY id LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE webhook_events SET status = 'processing', attempts = attempts + 1, locked_until = ? "
+                    "WHERE id = ?",
+                    (now + self.lease_seconds, row[0])
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return row
+
+    def _worker_loop(self):
+        while True:
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                print(f"Error claiming webhook event: {e}")
+                row = None
+            if row is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self._process(row)
+            except Exception as e:
+                # Écriture du résultat en échec (base verrouillée...) : le worker
+                # survit, l'événement est repris quand son bail expire
+                print(f"Error recording webhook event {row[1]}: {e}")
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _process(self, row):
+        row_id, event_id, event_type, payload, attempts, created_at = row
+        attempts += 1
+        try:
+            self.handler(json.loads(payload))
+        except RetryLater as e:
+            print(f"Webhook event {event_id} deferred for {e.delay}s: {e}")
+            self.defer(row_id, str(e), e.delay)
+            return
+        except Exception as e:
+            error = f"{e}\n{traceback.format_exc()}"
+            print(f"Error processing webhook event {event_id} (attempt {attempts}): {e}")
+            if attempts >= self.max_attempts:
+                self._dead_letter(row_id, event_id, event_type, payload, attempts, error, created_at)
+            else:
+                self.retry(row_id, error, self._backoff(attempts))
+            return
+        self._conn().execute("DELETE FROM webhook_events WHERE id = ?", (row_id,))
+        self._count("processed")
+
+    def _backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return random.uniform(delay / 2, delay)
+
+    def retry(self, row_id, error, delay):
+        self._conn().execute(
+            "UPDATE webhook_events SET status = 'pending', available_at = ?, locked_until = NULL, last_error = ? "
+            "WHERE id = ?",
+            (time.time() + delay, error, row_id)
+        )
+        self._count("retried")
+
+    def defer(self, row_id, reason, delay):
+        # Hands the claimed attempt back (attempts - 1), with a little jitter
+        # so deferred events do not all come back at the same instant
+        self._conn().execute(
+            "UPDATE webhook_events SET status = 'pending', attempts = MAX(attempts - 1, 0), available_at = ?, "
+            "locked_until = NULL, last_error = ? WHERE id = ?",
+            (time.time() + delay * random.uniform(1, 1.5), reason, row_id)
+        )
+        self._count("deferred")
+
+    def _dead_letter(self, row_id, event_id, event_type, payload, attempts, error, created_at):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                "INSERT INTO webhook_dead_letters (event_id, event_type, payload, attempts, last_error, created_at, failed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (event_id, event_type, payload, attempts, error, created_at, time.time())
+            )
+            conn.execute("DELETE FROM webhook_events WHERE id = ?", (row_id,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._count("deadLettered")
+        print(f"❌ Webhook event {event_id} moved to dead letters after {attempts} attempts")
+
+    def stats(self):
+        conn = self._conn()
+        now = time.time()
+        by_status = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM webhook_events GROUP BY status"
+        ).fetchall())
+        ready, oldest = conn.execute(
+            "SELECT COUNT(*), MIN(created_at) FROM webhook_events WHERE status = 'pending' AND available_at <= ?",
+            (now,)
+        ).fetchone()
+        dead_letters = conn.execute("SELECT COUNT(*) FROM webhook_dead_letters").fetchone()[0]
+        with self._counters_lock:
+            counters = dict(self.counters)
+        return {
+            "pending": by_status.get('pending', 0),
+            "processing": by_status.get('processing', 0),
+            "ready": ready,
+            "oldestReadyAgeSeconds": round(now - oldest, 3) if oldest else 0.0,
+            "deadLetters": dead_letters,
+            "workers": self.workers,
+            **counters,
+        }